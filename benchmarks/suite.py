@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+'''
+pg_bawler benchmark suite.
+
+Measures sender and listener hot paths against local PostgreSQL or the
+in-memory stand-in (``pg_bawler.memory``) and writes results as JSON, so
+they can be compared between versions.
+
+    $ python benchmarks/suite.py --output results.json
+    $ python benchmarks/suite.py --dsn "dbname=postgres user=postgres" \\
+        --driver aiopg --driver asyncpg --loop asyncio --loop uvloop
+
+Benchmarks:
+
+* ``send`` - ``send()`` messages per second
+* ``receive`` - notifications per second (wall clock and CPU time) drained
+  by listener
+* ``dispatch`` - overhead of dispatching notification to handlers
+* ``reconnect`` - time from killing listener's connection to receiving
+  notification again
+* ``latency`` - p50 / p99 latency from ``send()`` to handler
+'''
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+import pg_bawler
+import pg_bawler.core
+import pg_bawler.memory
+import pg_bawler.metrics
+from pg_bawler.listener import NotificationListener
+from pg_bawler.sender import NotificationSender
+
+CHANNEL = 'pg_bawler_bench'
+
+BENCHMARKS = ('send', 'receive', 'dispatch', 'reconnect', 'latency')
+
+
+class Backend:
+
+    def __init__(self, connection_params, driver):
+        self.connection_params = connection_params
+        self.driver = driver
+
+    def listener(self):
+        listener = NotificationListener(
+            self.connection_params, driver=self.driver)
+        listener.listen_timeout = 0.1
+        listener.reconnect_interval = 0.01
+        return listener
+
+    def sender(self):
+        return NotificationSender(self.connection_params, driver=self.driver)
+
+    async def kill(self, listener):
+        '''
+        Kills connection of ``listener``.
+        '''
+        raise NotImplementedError
+
+
+class MemoryBackend(Backend):
+
+    name = 'memory'
+
+    def __init__(self, latency=0):
+        super().__init__(
+            {'server': pg_bawler.memory.MemoryServer(latency=latency)},
+            'memory')
+
+    async def kill(self, listener):
+        (await listener.pg_connection()).break_connection()
+
+
+class PostgresBackend(Backend):
+
+    name = 'postgres'
+
+    async def kill(self, listener):
+        pid, = await listener.pg_fetchone('SELECT pg_backend_pid()')
+        async with self.sender() as sender:
+            await sender.pg_execute(
+                'SELECT pg_terminate_backend({})'.format(pid))
+
+
+def make_payload(size, prefix=''):
+    return prefix + 'x' * max(0, size - len(prefix))
+
+
+async def bench_send(backend, *, count, payload_size, **_):
+    payload = make_payload(payload_size)
+    async with backend.sender() as sender:
+        await sender.send(channel=CHANNEL, payload=payload)
+        started = time.perf_counter()
+        for _ in range(count):
+            await sender.send(channel=CHANNEL, payload=payload)
+        elapsed = time.perf_counter() - started
+    return [{
+        'payload_size': payload_size,
+        'count': count,
+        'messages_per_sec': count / elapsed,
+    }]
+
+
+async def bench_receive(backend, *, count, payload_size, **_):
+    payload = make_payload(payload_size)
+    async with backend.listener() as listener:
+        await listener.register_channel(CHANNEL)
+        async with backend.sender() as sender:
+            for _ in range(count):
+                await sender.send(channel=CHANNEL, payload=payload)
+        received = 0
+        started, started_cpu = time.perf_counter(), time.process_time()
+        while received < count:
+            if await listener.get_notification() is None:
+                break
+            received += 1
+        elapsed = time.perf_counter() - started
+        elapsed_cpu = time.process_time() - started_cpu
+    return [{
+        'payload_size': payload_size,
+        'count': count,
+        'received': received,
+        'notifications_per_sec': received / elapsed,
+        'notifications_per_cpu_sec': received / max(elapsed_cpu, 1e-9),
+    }]
+
+
+async def bench_dispatch(backend, *, count, handler_counts=(1, 5), **_):
+    results = []
+    for handler_count in handler_counts:
+        listener = backend.listener()
+        expected = count * handler_count
+        handled = 0
+        done = asyncio.Event()
+
+        async def handler(notification, listener):
+            nonlocal handled
+            notification.row
+            handled += 1
+            if handled == expected:
+                done.set()
+
+        for _ in range(handler_count):
+            listener.register_handler(CHANNEL, handler)
+        notification = pg_bawler.core.Notification(
+            0, CHANNEL, 'INSERT {"id": 1, "name": "bench"}')
+        started = time.perf_counter()
+        for _ in range(count):
+            listener._dispatch(notification)
+        await done.wait()
+        elapsed = time.perf_counter() - started
+        results.append({
+            'handlers': handler_count,
+            'count': count,
+            'usec_per_notification': elapsed / count * 1e6,
+        })
+    return results
+
+
+async def bench_reconnect(backend, *, rounds=5, **_):
+    received = asyncio.Event()
+
+    async def handler(notification, listener):
+        received.set()
+
+    durations = []
+    async with backend.listener() as listener:
+        listener.register_handler(CHANNEL, handler)
+        await listener.register_channel(CHANNEL)
+        listen_task = asyncio.ensure_future(listener.listen())
+        async with backend.sender() as sender:
+            for _ in range(rounds):
+                await backend.kill(listener)
+                started = time.perf_counter()
+                received.clear()
+                while not received.is_set():
+                    await sender.send(channel=CHANNEL, payload='reconnect')
+                    try:
+                        await asyncio.wait_for(received.wait(), 0.01)
+                    except asyncio.TimeoutError:
+                        pass
+                durations.append(time.perf_counter() - started)
+        await listener.stop()
+        await listen_task
+    return [{
+        'rounds': rounds,
+        'recovery_p50': pg_bawler.metrics.percentile(durations, 50),
+        'recovery_max': max(durations),
+    }]
+
+
+async def bench_latency(backend, *, count, payload_size, channels, **_):
+    latencies = []
+    done = asyncio.Event()
+
+    async def handler(notification, listener):
+        sent = float(notification.payload.split(' ', 1)[0])
+        latencies.append(time.perf_counter() - sent)
+        if len(latencies) == count:
+            done.set()
+
+    channel_names = [
+        '{}_{}'.format(CHANNEL, number) for number in range(channels)]
+    async with backend.listener() as listener:
+        for channel in channel_names:
+            listener.register_handler(channel, handler)
+            await listener.register_channel(channel)
+        listen_task = asyncio.ensure_future(listener.listen())
+        async with backend.sender() as sender:
+            for number in range(count):
+                await sender.send(
+                    channel=channel_names[number % channels],
+                    payload=make_payload(
+                        payload_size, '{!r} '.format(time.perf_counter())))
+                # let listener keep up, measure latency not backlog
+                await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(done.wait(), 10)
+        except asyncio.TimeoutError:
+            pass
+        await listener.stop()
+        await listen_task
+    return [{
+        'payload_size': payload_size,
+        'channels': channels,
+        'count': count,
+        'received': len(latencies),
+        'latency_p50': pg_bawler.metrics.percentile(latencies, 50),
+        'latency_p99': pg_bawler.metrics.percentile(latencies, 99),
+    }]
+
+
+BENCHMARK_FUNCTIONS = {
+    'send': bench_send,
+    'receive': bench_receive,
+    'dispatch': bench_dispatch,
+    'reconnect': bench_reconnect,
+    'latency': bench_latency,
+}
+
+#: Benchmarks parametrized by payload size and channel count
+PAYLOAD_BENCHMARKS = ('send', 'receive')
+CHANNELS_BENCHMARKS = ('latency', )
+
+
+async def run_benchmarks(backend, *, benchmarks, count, payload_sizes,
+                         channel_counts):
+    results = []
+    for name in benchmarks:
+        variants = [{}]
+        if name in PAYLOAD_BENCHMARKS:
+            variants = [{'payload_size': size} for size in payload_sizes]
+        elif name in CHANNELS_BENCHMARKS:
+            variants = [
+                {'payload_size': size, 'channels': channels}
+                for size in payload_sizes for channels in channel_counts]
+        for variant in variants:
+            for result in await BENCHMARK_FUNCTIONS[name](
+                backend, count=count, **variant
+            ):
+                results.append({'benchmark': name, **result})
+    return results
+
+
+def get_default_cli_args_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--dsn', metavar='DSN',
+        help='Benchmark against PostgreSQL instead of in-memory stand-in.')
+    parser.add_argument(
+        '--memory-latency', metavar='SECONDS', type=float, default=0,
+        help='Latency of in-memory stand-in.')
+    parser.add_argument(
+        '--driver', metavar='DRIVER', action='append',
+        help='Driver to use with --dsn, may be given multiple times.')
+    parser.add_argument(
+        '--loop', metavar='LOOP', action='append',
+        help='Event loop implementation, may be given multiple times.')
+    parser.add_argument(
+        '--benchmark', metavar='BENCHMARK', action='append',
+        choices=BENCHMARKS,
+        help='Benchmark to run, may be given multiple times.')
+    parser.add_argument('--count', metavar='COUNT', type=int, default=10000)
+    parser.add_argument(
+        '--payload-size', metavar='BYTES', type=int, action='append',
+        help='Payload size, may be given multiple times.')
+    parser.add_argument(
+        '--channels', metavar='COUNT', type=int, action='append',
+        help='Number of channels, may be given multiple times.')
+    parser.add_argument(
+        '--output', metavar='FILE',
+        help='Write JSON results to FILE instead of stdout.')
+    return parser
+
+
+def main(*argv):
+    args = get_default_cli_args_parser().parse_args(argv or sys.argv[1:])
+    runs = []
+    for loop_name in args.loop or ['asyncio']:
+        for driver in args.driver or ['aiopg']:
+            if args.dsn:
+                backend = PostgresBackend({'dsn': args.dsn}, driver)
+            else:
+                backend = MemoryBackend(latency=args.memory_latency)
+            loop = pg_bawler.core.new_event_loop(loop_name)
+            try:
+                results = loop.run_until_complete(run_benchmarks(
+                    backend,
+                    benchmarks=args.benchmark or BENCHMARKS,
+                    count=args.count,
+                    payload_sizes=args.payload_size or [16, 1024, 7000],
+                    channel_counts=args.channels or [1, 10, 100]))
+            finally:
+                loop.close()
+            runs.append({
+                'backend': backend.name,
+                'driver': backend.driver,
+                'loop': loop_name,
+                'results': results,
+            })
+            if not args.dsn:
+                break
+    report = {
+        'pg_bawler': pg_bawler.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'runs': runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import sys
+
+from pg_bawler.bawlerd.daemon import main
+
+
+sys.exit(main())
@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 import itertools
 import os
 
@@ -32,13 +32,13 @@ def build_config_location_list(
     ]
 
 
-def _load_file(_file, ft='yaml', default_loader=yaml.load):
+def _load_file(_file, ft='yaml', default_loader=yaml.safe_load):
     '''
     Parse file into a python object (mapping).
 
     TODO: Only yaml for now, maybe more formats later.
     '''
-    return {'yaml': yaml.load}.get(ft, default_loader)(_file)
+    return {'yaml': yaml.safe_load}.get(ft, default_loader)(_file)
 
 
 def _merge_configs(base, precede):
@@ -49,7 +49,7 @@ def _merge_configs(base, precede):
     for key in set(itertools.chain(base.keys(), precede.keys())):
         if key in precede and key in base:
             value = precede[key]
-            if isinstance(value, collections.Mapping):
+            if isinstance(value, collections.abc.Mapping):
                 value = _merge_configs(base[key], precede[key])
         else:
             value = precede[key] if key in precede else base[key]
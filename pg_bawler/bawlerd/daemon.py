@@ -0,0 +1,274 @@
+'''
+========================
+pg_bawler.bawlerd.daemon
+========================
+
+Runs listeners defined by bawlerd configuration.
+
+    $ python -m pg_bawler.bawlerd
+
+Configuration is read from
+:data:`pg_bawler.bawlerd.conf.DEFAULT_CONFIG_LOCATIONS` or from files given
+by ``--config``. Options from ``common`` section are used
+as defaults for every connection.
+
+Top level ``loop`` option selects event loop implementation, see
+:func:`pg_bawler.core.new_event_loop`.
+
+Handler's ``call`` is a ``module:callable`` path. If handler has ``config``,
+the callable is treated as factory and called with ``config`` as keyword
+arguments to create the actual handler. Handler's ``match`` rules and
+``project`` columns are compiled into :class:`pg_bawler.filters.EventFilter`
+applied before handler task is created.
+
+Channels with ``shards`` option are consumed as
+:class:`pg_bawler.groups.ConsumerGroup`, ``group`` section gives number of
+``members`` and this listener's ``member`` number. With ``mode: advisory``
+members claim shards with advisory locks instead,
+see :class:`pg_bawler.groups.AdvisoryLockGroup`.
+
+Optional ``monitor`` section configures
+:class:`pg_bawler.monitoring.NotificationQueueMonitor`, its ``alerts`` are
+callables configured the same way as handlers.
+
+Optional ``admission`` section and channels' ``priority``, ``shedding`` and
+``sample_percent`` options configure
+:class:`pg_bawler.shedding.AdmissionController`.
+
+Optional ``spool`` section configures
+:class:`pg_bawler.spool.NotificationSpool`, its ``directory`` has to be unique
+per connection.
+
+Optional ``retry`` section configures :class:`pg_bawler.retry.RetryScheduler`
+with ``dead_letter`` file and default :class:`pg_bawler.retry.RetryPolicy`
+options. Handlers may override the policy with their own ``retry`` options,
+``null`` disables retries of the handler.
+
+Optional ``relay`` section configures :class:`pg_bawler.relay.RelayServer`
+rebroadcasting notifications to local processes over Unix socket at
+``path``.
+'''
+import argparse
+import asyncio
+import functools
+import logging
+import logging.config
+import os
+import sys
+
+import pg_bawler.core
+import pg_bawler.filters
+import pg_bawler.groups
+import pg_bawler.listener
+import pg_bawler.monitoring
+import pg_bawler.relay
+import pg_bawler.retry
+import pg_bawler.shedding
+import pg_bawler.spool
+from pg_bawler.bawlerd import conf
+
+LOGGER = logging.getLogger('pg_bawler.bawlerd')
+
+#: Listener attributes configurable in ``common`` and connection sections
+LISTENER_OPTIONS = (
+    'listen_timeout',
+    'stop_on_timeout',
+    'try_to_reconnect',
+    'reconnect_interval',
+    'reconnect_attempts',
+    'handler_timeout',
+    'drain_timeout',
+)
+
+#: Consumer group classes by ``mode`` of ``group`` section
+GROUP_MODES = {
+    'static': pg_bawler.groups.ConsumerGroup,
+    'advisory': pg_bawler.groups.AdvisoryLockGroup,
+}
+
+
+def build_handler(handler_config):
+    '''
+    Resolves handler from its configuration.
+    '''
+    handler = pg_bawler.listener.resolve_handler(handler_config['call'])
+    if 'config' in handler_config:
+        handler = handler(**handler_config['config'])
+    return handler
+
+
+def build_monitor(listener, monitor_config):
+    '''
+    Creates queue monitor of ``listener`` from ``monitor`` configuration
+    section.
+    '''
+    monitor_config = dict(monitor_config)
+    alerts = monitor_config.pop('alerts', ())
+    monitor = pg_bawler.monitoring.NotificationQueueMonitor(
+        listener, **monitor_config)
+    for alert_config in alerts:
+        monitor.add_alert_callback(build_handler(alert_config))
+    return monitor
+
+
+def build_admission(listener, admission_config, channel_configs):
+    '''
+    Creates admission controller of ``listener`` from ``admission``
+    configuration section and shedding options of channels.
+    '''
+    policies = {
+        channel_config['name']: pg_bawler.shedding.ChannelPolicy(
+            priority=channel_config.get('priority', 0),
+            policy=channel_config.get('shedding', 'none'),
+            percent=channel_config.get('sample_percent', 100))
+        for channel_config in channel_configs
+    }
+    return pg_bawler.shedding.AdmissionController(
+        listener, policies=policies, **(admission_config or {}))
+
+
+def build_retry(listener, retry_config, handler_policies):
+    '''
+    Creates retry scheduler of ``listener`` from ``retry`` configuration
+    section and policies of handlers. Without ``retry`` section only handlers
+    with their own policy are retried.
+    '''
+    default_policy = dead_letter = None
+    if retry_config is not None:
+        retry_config = dict(retry_config)
+        dead_letter = retry_config.pop('dead_letter', None)
+        default_policy = pg_bawler.retry.RetryPolicy(**retry_config)
+    return pg_bawler.retry.RetryScheduler(
+        listener,
+        default_policy=default_policy,
+        policies={
+            handler: None if policy is None else pg_bawler.retry.RetryPolicy(
+                **policy)
+            for handler, policy in handler_policies.items()
+        },
+        dead_letter=dead_letter)
+
+
+def build_group(listener, channel, shards, group_config):
+    '''
+    Creates listener's membership in consumer group of sharded ``channel``
+    from ``group`` configuration section.
+    '''
+    group_config = dict(group_config or {})
+    mode = group_config.pop('mode', 'static')
+    if mode not in GROUP_MODES:
+        raise pg_bawler.groups.PgBawlerGroupError(
+            'Unknown consumer group mode {!r}'.format(mode))
+    group_class = GROUP_MODES[mode]
+    return group_class(listener, channel, shards=shards, **group_config)
+
+
+def build_listener(
+    connection_config,
+    common=None,
+    *,
+    loop=None,
+    listener_class=pg_bawler.listener.NotificationListener
+):
+    '''
+    Creates listener for one item of ``connections`` configuration section
+    and registers its channel handlers.
+    '''
+    options = {**(common or {}), **connection_config}
+    listener = listener_class(
+        connection_config['connection_params'],
+        loop=loop,
+        driver=options.get('driver'))
+    for option in LISTENER_OPTIONS:
+        if option in options:
+            setattr(listener, option, options[option])
+    if options.get('monitor'):
+        listener.queue_monitor = build_monitor(listener, options['monitor'])
+    channel_configs = connection_config.get('channels', ())
+    if options.get('admission') or any(
+        'priority' in channel_config or 'shedding' in channel_config
+        for channel_config in channel_configs
+    ):
+        listener.admission = build_admission(
+            listener, options.get('admission'), channel_configs)
+    if options.get('spool'):
+        listener.spool = pg_bawler.spool.NotificationSpool(
+            listener, **options['spool'])
+    if options.get('relay'):
+        listener.relay = pg_bawler.relay.RelayServer(
+            listener, **options['relay'])
+    handler_policies = {}
+    for channel_config in channel_configs:
+        channel = channel_config['name']
+        if channel_config.get('shards'):
+            register_handler = build_group(
+                listener, channel, channel_config['shards'],
+                options.get('group')).register_handler
+        else:
+            listener.registered_channels.setdefault(channel, [])
+            register_handler = functools.partial(
+                listener.register_handler, channel)
+        for handler_config in channel_config.get('handlers', ()):
+            handler = build_handler(handler_config)
+            if 'retry' in handler_config:
+                handler_policies[handler] = handler_config['retry']
+            event_filter = None
+            if 'match' in handler_config or 'project' in handler_config:
+                event_filter = pg_bawler.filters.compile_filter(
+                    handler_config.get('match'), handler_config.get('project'))
+            register_handler(handler, event_filter=event_filter)
+    if 'retry' in options or handler_policies:
+        listener.retry = build_retry(
+            listener, options.get('retry'), handler_policies)
+    return listener
+
+
+def build_listeners(config, *, loop=None):
+    return [
+        build_listener(connection_config, config.get('common'), loop=loop)
+        for connection_config in config.get('connections', ())
+    ]
+
+
+async def run_listener(listener):
+    await listener._re_register_all_channels()
+    await listener.listen()
+
+
+def get_default_cli_args_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--config',
+        metavar='CONFIG',
+        action='append',
+        help=(
+            'Path to configuration file. May be given multiple times,'
+            ' later files take precedence.'))
+    return parser
+
+
+def read_config(paths=None):
+    paths = paths or [
+        path for path in conf.build_config_location_list()
+        if os.path.exists(path)
+    ]
+    return conf.read_config_files(paths)
+
+
+def main(*argv, loop=None):
+    args = get_default_cli_args_parser().parse_args(argv or sys.argv[1:])
+    config = read_config(args.config)
+    if 'logging' in config:
+        logging.config.dictConfig({'version': 1, **config['logging']})
+    loop = loop or pg_bawler.core.new_event_loop(config.get('loop', 'asyncio'))
+    listeners = build_listeners(config, loop=loop)
+    LOGGER.info('Starting %s listener(s)', len(listeners))
+    try:
+        loop.run_until_complete(asyncio.gather(
+            *[run_listener(listener) for listener in listeners]))
+    finally:
+        for listener in listeners:
+            loop.run_until_complete(listener.stop())
+        loop.close()
@@ -0,0 +1,200 @@
+'''
+===============
+pg_bawler.cache
+===============
+
+Read-through cache invalidated by change notifications.
+
+Entries are keyed by table name and primary key (tuple of values of
+listener's ``event_key_columns``, scalar is accepted for single column keys)
+and loaded by ``loader`` coroutine function on miss. Concurrent misses of the
+same key share one ``loader`` call::
+
+    async def load_user(table, key):
+        return await db.fetch_user(key[0])
+
+    users = NotificationCache(load_user, maxsize=50000, ttl=3600)
+    users.attach(listener, 'users')
+
+    user = await users.get('users', 42)
+
+Change notification of a row (produced by triggers from
+``pg_bawler.gen_sql``) evicts exactly that row, aggregated notification of
+``--per-transaction`` triggers evicts all rows it lists, ``TRUNCATE`` or
+payload which can't be decoded evicts the whole table. Cache is flushed after
+listener reconnects, because notifications sent meanwhile are lost.
+
+Cache exports ``<prefix>.hits``, ``<prefix>.misses``, ``<prefix>.evictions``
+(capacity and TTL) and ``<prefix>.invalidations`` (notifications) counters.
+'''
+import asyncio
+import collections
+import logging
+import time
+
+import pg_bawler.events
+import pg_bawler.metrics
+
+LOGGER = logging.getLogger('pg_bawler.cache')
+
+
+def make_key(table, key):
+    if not isinstance(key, tuple):
+        key = (key, )
+    return (table, key)
+
+
+class NotificationCache:
+    '''
+    LRU cache with optional TTL.
+
+    :param loader: Coroutine function called with table and key tuple on
+        miss, its result (including ``None``) is cached.
+    :param maxsize: Maximal number of entries.
+    :param ttl: Seconds entry stays valid, ``None`` for no limit.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry`, defaults to
+        :data:`pg_bawler.metrics.REGISTRY`.
+    :param prefix: Prefix of exported metric names.
+    '''
+
+    def __init__(
+        self,
+        loader,
+        *,
+        maxsize=10000,
+        ttl=None,
+        registry=None,
+        prefix='pg_bawler.cache'
+    ):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._loading = {}
+        registry = registry or pg_bawler.metrics.REGISTRY
+        self.hits = registry.counter('{}.hits'.format(prefix))
+        self.misses = registry.counter('{}.misses'.format(prefix))
+        self.evictions = registry.counter('{}.evictions'.format(prefix))
+        self.invalidations = registry.counter(
+            '{}.invalidations'.format(prefix))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, table_key):
+        return make_key(*table_key) in self._entries
+
+    def _lookup(self, cache_key):
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return False, None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[cache_key]
+            self.evictions.inc()
+            return False, None
+        self._entries.move_to_end(cache_key)
+        return True, value
+
+    def _store(self, cache_key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[cache_key] = (value, expires)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions.inc()
+
+    async def get(self, table, key):
+        '''
+        Returns cached value of ``key`` in ``table`` or loads it.
+        '''
+        cache_key = make_key(table, key)
+        found, value = self._lookup(cache_key)
+        if found:
+            self.hits.inc()
+            return value
+        self.misses.inc()
+        future = self._loading.get(cache_key)
+        if future is None:
+            future = self._loading[cache_key] = asyncio.ensure_future(
+                self._load(cache_key))
+        return await asyncio.shield(future)
+
+    async def _load(self, cache_key):
+        task = asyncio.current_task()
+        try:
+            value = await self.loader(*cache_key)
+        finally:
+            # key invalidated during load keeps the result out of cache
+            if self._loading.get(cache_key) is task:
+                del self._loading[cache_key]
+                stale = False
+            else:
+                stale = True
+        if not stale:
+            self._store(cache_key, value)
+        return value
+
+    def set(self, table, key, value):
+        self._store(make_key(table, key), value)
+
+    def invalidate(self, table, key):
+        '''
+        Evicts ``key`` of ``table`` and discards its running load.
+        '''
+        cache_key = make_key(table, key)
+        self._loading.pop(cache_key, None)
+        if self._entries.pop(cache_key, None) is not None:
+            self.invalidations.inc()
+
+    def invalidate_table(self, table):
+        for cache_key in [key for key in self._loading if key[0] == table]:
+            del self._loading[cache_key]
+        cache_keys = [key for key in self._entries if key[0] == table]
+        for cache_key in cache_keys:
+            del self._entries[cache_key]
+        self.invalidations.inc(len(cache_keys))
+
+    def clear(self):
+        self.invalidations.inc(len(self._entries))
+        self._entries.clear()
+        self._loading.clear()
+
+    async def handle_notification(self, notification, listener):
+        '''
+        Handler evicting changed row, expects
+        :class:`pg_bawler.events.ChangeEvent`.
+        '''
+        if notification.op == 'TRUNCATE':
+            self.invalidate_table(notification.table)
+            return
+        try:
+            if notification.op == pg_bawler.events.TRANSACTION:
+                key_columns = notification.key_columns
+                keys = [
+                    tuple(key.get(column) for column in key_columns)
+                    for _, key in notification.changes
+                ]
+            else:
+                keys = [notification.keys]
+        except ValueError:
+            LOGGER.warning(
+                'Can\'t decode keys from %s notification, evicting table %s',
+                notification.channel, notification.table)
+            self.invalidate_table(notification.table)
+        else:
+            for key in keys:
+                self.invalidate(notification.table, key)
+
+    async def handle_reconnect(self, listener):
+        LOGGER.info('Listener reconnected, flushing cache')
+        self.clear()
+
+    def attach(self, listener, *channels):
+        '''
+        Registers cache as handler of ``channels`` and flushes it whenever
+        ``listener`` reconnects.
+        '''
+        for channel in channels:
+            listener.register_handler(channel, self.handle_notification)
+        listener.add_reconnect_callback(self.handle_reconnect)
@@ -11,12 +11,21 @@ Postgresql documentation for
 `NOTIFY <https://www.postgresql.org/docs/current/static/sql-notify.html>`_.
 '''
 import asyncio
+import collections
+import importlib
 import logging
 
-import aiopg
-
 LOGGER = logging.getLogger(name='pg_bawler.core')
 
+#: Notification as received from the database
+Notification = collections.namedtuple('Notification', 'pid channel payload')
+
+#: Event loop factories selectable by name
+EVENT_LOOPS = {
+    'asyncio': 'asyncio:new_event_loop',
+    'uvloop': 'uvloop:new_event_loop',
+}
+
 
 class PgBawlerException(Exception):
     '''
@@ -24,6 +33,24 @@ class PgBawlerException(Exception):
     '''
 
 
+def new_event_loop(name='asyncio'):
+    '''
+    Creates new event loop of implementation given by ``name``
+    (see :data:`EVENT_LOOPS`) or by ``module:factory`` path and sets it as
+    the current event loop.
+    '''
+    module_name, factory_name = EVENT_LOOPS.get(name, name).split(':')
+    try:
+        factory = getattr(importlib.import_module(module_name), factory_name)
+    except ImportError as exc:
+        raise PgBawlerException(
+            'Event loop {!r} is not available: {}'.format(name, exc)
+        ) from exc
+    loop = factory()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
 def cache_async_def(func):
     cache_attr_name = '_cache_async_def_{func.__name__}'.format(func=func)
     async def _cache_method(self, *args, **kwargs):
@@ -42,22 +69,92 @@ def cache_async_def(func):
 
 class BawlerBase:
     '''
-    Base ``pg_bawler`` class with convenience methods around ``aiopg``.
+    Base ``pg_bawler`` class with convenience methods around database
+    driver, ``aiopg`` by default. See :mod:`pg_bawler.drivers`.
     '''
 
-    def __init__(self, connection_params, *, loop=None):
+    def __init__(self, connection_params, *, loop=None, driver=None):
+        # imported here, pg_bawler.drivers depends on this module
+        import pg_bawler.drivers
         self.connection_params = connection_params
         self._connection = None
-        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self._loop = loop
+        self.driver = pg_bawler.drivers.get_driver(driver)
+
+    @property
+    def loop(self):
+        '''
+        Event loop given to the constructor or the running one.
+        '''
+        if self._loop is None:
+            return asyncio.get_running_loop()
+        return self._loop
+
+    @loop.setter
+    def loop(self, loop):
+        self._loop = loop
 
     @cache_async_def
     async def pg_pool(self):
-        return await aiopg.create_pool(
-            loop=self.loop, **self.connection_params)
+        return await self.driver.create_pool(
+            self.connection_params, loop=self._loop)
 
     @cache_async_def
     async def pg_connection(self):
-        return await (await self.pg_pool()).acquire()
+        return await self.driver.acquire(await self.pg_pool())
+
+    @property
+    def pg_lock(self):
+        '''
+        Lock serializing statements on current connection. Health checks,
+        ``LISTEN`` and statements of monitors or consumer groups share the
+        connection and drivers (e.g. ``aiopg``) don't allow concurrent
+        statements on one connection.
+        '''
+        prop_name = '_pg_lock'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, asyncio.Lock())
+        return getattr(self, prop_name)
+
+    async def pg_execute(self, statement):
+        '''
+        Executes ``statement`` using current connection.
+        '''
+        async with self.pg_lock:
+            await self.driver.execute(await self.pg_connection(), statement)
+
+    async def pg_fetchone(self, statement):
+        '''
+        Executes ``statement`` using current connection and returns first
+        row as tuple or ``None``.
+        '''
+        async with self.pg_lock:
+            return await self.driver.fetchone(
+                await self.pg_connection(), statement)
+
+    async def pg_fetchall(self, statement):
+        '''
+        Executes ``statement`` using current connection and returns list of
+        row tuples.
+        '''
+        async with self.pg_lock:
+            return await self.driver.fetchall(
+                await self.pg_connection(), statement)
+
+    async def pg_listen(self, channel, statement=None):
+        '''
+        Starts listening on ``channel`` using current connection.
+        '''
+        async with self.pg_lock:
+            await self.driver.listen(
+                await self.pg_connection(), channel, statement)
+
+    async def pg_unlisten(self, channel):
+        '''
+        Stops listening on ``channel`` using current connection.
+        '''
+        async with self.pg_lock:
+            await self.driver.unlisten(await self.pg_connection(), channel)
 
     async def drop_connection(self):
         '''
@@ -68,8 +165,8 @@ class BawlerBase:
         '''
         if hasattr(self, self.pg_connection.cache_attr_name):
             pg_conn = (await self.pg_connection())
-            pg_conn.close()
-            await (await self.pg_pool()).release(pg_conn)
+            self.driver.close(pg_conn)
+            await self.driver.release(await self.pg_pool(), pg_conn)
             # clear cached connection property (cache_async_def)
             delattr(self, self.pg_connection.cache_attr_name)
 
@@ -0,0 +1,348 @@
+'''
+=================
+pg_bawler.drivers
+=================
+
+Database driver engines used by :class:`pg_bawler.core.BawlerBase`.
+
+* ``aiopg`` - :class:`AiopgDriver` (default), psycopg2 based.
+* ``asyncpg`` - :class:`AsyncpgDriver`, uses native ``add_listener``
+  callbacks and asyncpg's binary protocol.
+* ``logical`` - :class:`pg_bawler.logical.LogicalDecodingDriver`, changes
+  from logical replication slot.
+* ``memory`` - :class:`pg_bawler.memory.MemoryDriver`, in-memory stand-in
+  for load-testing without PostgreSQL.
+* ``relay`` - :class:`pg_bawler.relay.RelayDriver`, notifications from
+  :class:`pg_bawler.relay.RelayServer` over a Unix domain socket.
+
+Driver may be selected by name, by ``module:Class`` path, passed as class
+or instance, or as mapping with ``name`` and driver's keyword arguments::
+
+    NotificationListener(connection_params, driver='asyncpg')
+    NotificationListener(
+        connection_params, driver={'name': 'logical', 'slot_name': 'foo'})
+
+Drivers are instantiated per :class:`~pg_bawler.core.BawlerBase` instance,
+so they can keep per connection state.
+'''
+import asyncio
+import importlib
+
+import pg_bawler.core
+
+#: Registered drivers by name
+DRIVERS = {
+    'aiopg': 'pg_bawler.drivers:AiopgDriver',
+    'asyncpg': 'pg_bawler.drivers:AsyncpgDriver',
+    'logical': 'pg_bawler.logical:LogicalDecodingDriver',
+    'memory': 'pg_bawler.memory:MemoryDriver',
+    'relay': 'pg_bawler.relay:RelayDriver',
+}
+
+#: Name of driver used when none is given
+DEFAULT_DRIVER = 'aiopg'
+
+#: Put into notifications queue by drivers when their upstream (e.g. relay's
+#: database connection) reconnected and notifications may have been missed,
+#: listener runs its reconnect callbacks on it
+UPSTREAM_RECONNECTED = object()
+
+
+class PgBawlerDriverError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised when driver can't be resolved.
+    '''
+
+
+class NotifiesQueue(asyncio.Queue):
+    '''
+    Notifications queue raising connection error once connection is lost.
+    Put the exception into the queue to raise it from all following
+    ``get()`` calls.
+    '''
+
+    async def get(self):
+        item = await super().get()
+        if isinstance(item, BaseException):
+            self.put_nowait(item)
+            raise item
+        return item
+
+
+class Driver:
+    '''
+    Interface of driver engines.
+    '''
+
+    #: Name of the driver
+    name = None
+    #: Exceptions raised by the driver for any database failure
+    errors = ()
+    #: Exceptions meaning that the connection is lost
+    connection_errors = ()
+    #: Notifications go through server's notification queue, so
+    #: ``pg_notification_queue_usage()`` is meaningful
+    uses_notification_queue = True
+    #: Driver wants to know when notifications are processed, see
+    #: :meth:`processed`
+    confirms_processed = False
+
+    async def create_pool(self, connection_params, *, loop=None):
+        raise NotImplementedError
+
+    async def acquire(self, pool):
+        raise NotImplementedError
+
+    async def release(self, pool, connection):
+        raise NotImplementedError
+
+    def close(self, connection):
+        '''
+        Closes ``connection`` without waiting, it's released afterwards.
+        '''
+        raise NotImplementedError
+
+    async def execute(self, connection, statement):
+        raise NotImplementedError
+
+    async def fetchone(self, connection, statement):
+        '''
+        Executes ``statement`` and returns first row as tuple or ``None``.
+        '''
+        raise NotImplementedError
+
+    async def fetchall(self, connection, statement):
+        '''
+        Executes ``statement`` and returns list of row tuples.
+        '''
+        raise NotImplementedError
+
+    async def copy_out(self, connection, query):
+        '''
+        Returns output of ``COPY (query) TO STDOUT`` in CSV format as bytes.
+        Drivers not supporting ``COPY`` raise ``NotImplementedError``.
+        '''
+        raise NotImplementedError
+
+    async def listen(self, connection, channel, statement=None):
+        '''
+        Starts listening on ``channel``. Drivers executing ``LISTEN``
+        directly use ``statement`` if given.
+        '''
+        raise NotImplementedError
+
+    async def unlisten(self, connection, channel):
+        raise NotImplementedError
+
+    def processed(self, connection, notification):
+        '''
+        Called by listener, if :attr:`confirms_processed`, once all handlers
+        of ``notification`` taken from :meth:`notifies` queue finished, or
+        the notification was spooled or shed.
+        '''
+
+    def notifies(self, connection):
+        '''
+        Returns queue (:class:`asyncio.Queue` or object with ``get()``
+        coroutine) of received notifications. Notifications have ``pid``,
+        ``channel`` and ``payload`` attributes.
+        '''
+        raise NotImplementedError
+
+
+class AiopgDriver(Driver):
+
+    name = 'aiopg'
+
+    def __init__(self):
+        import aiopg
+        import psycopg2
+        self.aiopg = aiopg
+        self.errors = (psycopg2.Error, )
+        self.connection_errors = (
+            psycopg2.InterfaceError,
+            psycopg2.OperationalError,
+        )
+
+    async def create_pool(self, connection_params, *, loop=None):
+        # aiopg always uses the running loop
+        return await self.aiopg.create_pool(**connection_params)
+
+    async def acquire(self, pool):
+        return await pool.acquire()
+
+    async def release(self, pool, connection):
+        await pool.release(connection)
+
+    def close(self, connection):
+        connection.close()
+
+    async def execute(self, connection, statement):
+        async with connection.cursor() as cursor:
+            await cursor.execute(statement)
+
+    async def fetchone(self, connection, statement):
+        async with connection.cursor() as cursor:
+            await cursor.execute(statement)
+            return await cursor.fetchone()
+
+    async def fetchall(self, connection, statement):
+        # asynchronous psycopg2 connections don't support COPY
+        async with connection.cursor() as cursor:
+            await cursor.execute(statement)
+            return await cursor.fetchall()
+
+    async def listen(self, connection, channel, statement=None):
+        await self.execute(
+            connection, statement or 'LISTEN {channel}'.format(
+                channel=channel))
+
+    async def unlisten(self, connection, channel):
+        await self.execute(
+            connection, 'UNLISTEN {channel}'.format(channel=channel))
+
+    def notifies(self, connection):
+        return connection.notifies
+
+
+def _parse_libpq_dsn(dsn):
+    '''
+    Parses simple ``key=value`` libpq connection string.
+    '''
+    return dict(item.split('=', 1) for item in dsn.split())
+
+
+def get_asyncpg_connection_params(connection_params):
+    '''
+    Translates aiopg style ``connection_params`` to asyncpg arguments.
+    '''
+    params = dict(connection_params)
+    dsn = params.pop('dsn', None)
+    if dsn is not None:
+        if '://' in dsn:
+            params['dsn'] = dsn
+        else:
+            params = {**_parse_libpq_dsn(dsn), **params}
+    if 'dbname' in params:
+        params['database'] = params.pop('dbname')
+    if 'port' in params:
+        params['port'] = int(params['port'])
+    for aiopg_name, name in (('minsize', 'min_size'), ('maxsize', 'max_size')):
+        if aiopg_name in params:
+            params[name] = params.pop(aiopg_name)
+    return params
+
+
+class AsyncpgDriver(Driver):
+    '''
+    `asyncpg <https://github.com/MagicStack/asyncpg>`_ driver.
+
+    Accepts the same ``connection_params`` as aiopg, ``dbname`` is
+    translated to ``database``, ``minsize`` and ``maxsize`` to ``min_size``
+    and ``max_size`` and ``key=value`` DSNs are split into keyword
+    arguments.
+    '''
+
+    #: Pool sizes used unless given in ``connection_params``, bawlers use
+    #: one connection each while asyncpg opens ``min_size`` connections
+    #: right away (10 by default)
+    pool_min_size = 1
+    pool_max_size = 2
+
+    name = 'asyncpg'
+
+    def __init__(self):
+        import asyncpg
+        self.asyncpg = asyncpg
+        self.errors = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError)
+        self.connection_errors = (
+            asyncpg.PostgresConnectionError,
+            asyncpg.InterfaceError,
+            OSError,
+        )
+        self._queues = {}
+        self._callbacks = {}
+
+    async def create_pool(self, connection_params, *, loop=None):
+        params = get_asyncpg_connection_params(connection_params)
+        params.setdefault('min_size', self.pool_min_size)
+        params.setdefault('max_size', max(
+            self.pool_max_size, params['min_size']))
+        return await self.asyncpg.create_pool(loop=loop, **params)
+
+    async def acquire(self, pool):
+        return await pool.acquire()
+
+    async def release(self, pool, connection):
+        self._queues.pop(connection, None)
+        self._callbacks.pop(connection, None)
+        await pool.release(connection)
+
+    def close(self, connection):
+        connection.terminate()
+
+    async def execute(self, connection, statement):
+        await connection.execute(statement)
+
+    async def fetchone(self, connection, statement):
+        row = await connection.fetchrow(statement)
+        return None if row is None else tuple(row)
+
+    async def fetchall(self, connection, statement):
+        return [tuple(row) for row in await connection.fetch(statement)]
+
+    async def copy_out(self, connection, query):
+        chunks = []
+
+        async def _write(chunk):
+            chunks.append(chunk)
+
+        await connection.copy_from_query(query, output=_write, format='csv')
+        return b''.join(chunks)
+
+    def _get_callback(self, connection):
+        if connection not in self._callbacks:
+            queue = self.notifies(connection)
+
+            def _callback(connection, pid, channel, payload):
+                queue.put_nowait(
+                    pg_bawler.core.Notification(pid, channel, payload))
+
+            self._callbacks[connection] = _callback
+        return self._callbacks[connection]
+
+    async def listen(self, connection, channel, statement=None):
+        await connection.add_listener(channel, self._get_callback(connection))
+
+    async def unlisten(self, connection, channel):
+        await connection.remove_listener(
+            channel, self._get_callback(connection))
+
+    def notifies(self, connection):
+        if connection not in self._queues:
+            self._queues[connection] = asyncio.Queue()
+        return self._queues[connection]
+
+
+def get_driver(driver=None):
+    '''
+    Returns driver instance for ``driver`` given as name, ``module:Class``
+    path, class, instance or mapping with ``name`` and driver's options.
+    '''
+    options = {}
+    if driver is None:
+        driver = DEFAULT_DRIVER
+    if isinstance(driver, Driver):
+        return driver
+    if isinstance(driver, dict):
+        options = dict(driver)
+        driver = options.pop('name', DEFAULT_DRIVER)
+    if isinstance(driver, str):
+        path = DRIVERS.get(driver, driver)
+        if ':' not in path:
+            raise PgBawlerDriverError(
+                'Unknown driver {driver!r}. Known drivers: {known}'.format(
+                    driver=driver, known=', '.join(sorted(DRIVERS))))
+        module_name, class_name = path.split(':')
+        driver = getattr(importlib.import_module(module_name), class_name)
+    return driver(**options)
@@ -0,0 +1,190 @@
+'''
+================
+pg_bawler.events
+================
+
+Structured change events.
+
+Listener wraps every received notification in a :class:`ChangeEvent` and
+passes the same instance to all handlers registered for the channel. Payload
+produced by triggers from ``pg_bawler.gen_sql`` (``"OP {json}"``) is decoded
+lazily, at most once, on the first access to :attr:`ChangeEvent.row`.
+Aggregated notifications of ``gen_sql --per-transaction`` triggers
+(``"TRANSACTION [[op, {key}], ...]"``) are available as
+:attr:`ChangeEvent.changes`.
+
+JSON is decoded with `orjson <https://github.com/ijl/orjson>`_ or
+`ujson <https://github.com/ultrajson/ultrajson>`_ when installed.
+'''
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
+
+#: Operations (``TG_OP``) recognized as payload prefix
+OPERATIONS = frozenset(('INSERT', 'UPDATE', 'DELETE', 'TRUNCATE'))
+#: Prefix of aggregated notifications of ``gen_sql --per-transaction``
+TRANSACTION = 'TRANSACTION'
+
+_UNSET = object()
+
+
+class ChangeEvent:
+    '''
+    Notification with lazily decoded change data.
+
+    Proxies ``pid``, ``channel`` and ``payload`` of the wrapped notification
+    and unpacks, indexes, compares and hashes as the notification tuple, so
+    handlers written for raw notifications keep working.
+
+    :param notification: Received notification.
+    :param envelope: :class:`pg_bawler.tracing.Envelope` if the notification
+        was enveloped. Envelope's origin of ``pg_bawler.gen_sql`` triggers
+        is used as ``schema.table``, origins of other senders (default
+        ``hostname:pid``) are ignored.
+    :param key_columns: Names of columns forming :attr:`keys`.
+    '''
+
+    __slots__ = (
+        'notification', 'envelope', 'key_columns', '_op', '_body', '_row')
+
+    def __init__(self, notification, envelope=None, key_columns=('id', )):
+        self.notification = notification
+        self.envelope = envelope
+        self.key_columns = key_columns
+        self._op = _UNSET
+        self._body = None
+        self._row = _UNSET
+
+    def __iter__(self):
+        return iter(self.notification)
+
+    def __len__(self):
+        return len(self.notification)
+
+    def __getitem__(self, index):
+        return self.notification[index]
+
+    def __eq__(self, other):
+        if isinstance(other, ChangeEvent):
+            other = other.notification
+        return self.notification == other
+
+    def __hash__(self):
+        return hash(self.notification)
+
+    def __repr__(self):
+        return '<{cls} {channel} {op}>'.format(
+            cls=type(self).__name__, channel=self.channel, op=self.op)
+
+    @property
+    def pid(self):
+        return self.notification.pid
+
+    @property
+    def channel(self):
+        return self.notification.channel
+
+    @property
+    def payload(self):
+        return self.notification.payload
+
+    def _split_payload(self):
+        payload = self.notification.payload
+        op, _, body = payload.partition(' ')
+        if op in OPERATIONS or op == TRANSACTION:
+            self._op, self._body = op, body
+        else:
+            self._op, self._body = None, payload
+
+    @property
+    def op(self):
+        '''
+        Operation (``INSERT``, ``UPDATE``, ...), ``TRANSACTION`` for
+        aggregated notifications or ``None`` if payload doesn't start with
+        one.
+        '''
+        if self._op is _UNSET:
+            self._split_payload()
+        return self._op
+
+    @property
+    def row(self):
+        '''
+        Decoded row data. Raises ``ValueError`` for non JSON payloads.
+        '''
+        if self._row is _UNSET:
+            if self._op is _UNSET:
+                self._split_payload()
+            self._row = json_loads(self._body)
+        return self._row
+
+    def _table_origin(self):
+        '''
+        Returns ``(schema, table)`` from the envelope origin set by
+        ``pg_bawler.gen_sql`` triggers or ``None``.
+        '''
+        if self.envelope is None:
+            return None
+        origin = self.envelope.origin
+        # senders default to hostname:pid, hostname may contain dots
+        if ':' in origin or '.' not in origin:
+            return None
+        return origin.split('.', 1)
+
+    @property
+    def schema(self):
+        origin = self._table_origin()
+        return None if origin is None else origin[0]
+
+    @property
+    def table(self):
+        '''
+        Table name from the envelope origin or channel name, which is the
+        table name for triggers generated with default options.
+        '''
+        origin = self._table_origin()
+        return self.channel if origin is None else origin[1]
+
+    @property
+    def keys(self):
+        '''
+        Values of ``key_columns`` of the changed row. Raises ``ValueError``
+        for ``TRANSACTION`` notifications (see :attr:`changes`) and payloads
+        without JSON object.
+        '''
+        if self.op == TRANSACTION:
+            raise ValueError(
+                'TRANSACTION notification changes many rows, use changes')
+        row = self.row
+        if not isinstance(row, dict):
+            raise ValueError('Payload has no row: {}'.format(self.payload))
+        return tuple(row.get(column) for column in self.key_columns)
+
+    @property
+    def changes(self):
+        '''
+        List of ``(operation, row)`` pairs, rows of ``TRANSACTION``
+        notifications contain only key columns.
+        '''
+        if self.op == TRANSACTION:
+            return [(op, key) for op, key in self.row]
+        return [(self.op, self.row)]
+
+    def project(self, columns):
+        '''
+        Returns event of the same notification with :attr:`row` limited to
+        ``columns``. Raises ``ValueError`` for non JSON payloads.
+        ``TRANSACTION`` events carry only keys and are returned as they are.
+        '''
+        if self.op == TRANSACTION:
+            return self
+        row = self.row
+        event = type(self)(self.notification, self.envelope, self.key_columns)
+        event._op, event._body = self._op, self._body
+        event._row = {
+            column: row[column] for column in columns if column in row}
+        return event
@@ -0,0 +1,198 @@
+'''
+=================
+pg_bawler.filters
+=================
+
+Declarative event filters evaluated before handler tasks are created.
+
+Handler which only cares about some changes may be registered with
+:class:`EventFilter` compiled once from ``match`` rules and optional
+``project`` columns::
+
+    listener.register_handler(
+        'clients', index_in_elastic,
+        event_filter=compile_filter(
+            match={
+                'op': ['INSERT', 'UPDATE'],
+                'columns': {'status': {'in': ['active', 'pending']}},
+            },
+            project=['id', 'status']))
+
+Events rejected by filters of all handlers of a channel (and without
+subscriptions) create no task at all and are dropped before admission
+control and spool, so they are never queued, shed or spooled. Rules are
+checked from the cheapest: ``op`` and ``table`` need no JSON decoding,
+``columns`` decode the row (once per event, shared by all handlers).
+``match`` accepts:
+
+* ``op`` - operation or list of operations (``INSERT``, ``UPDATE``, ...,
+  ``TRANSACTION`` for aggregated notifications of ``gen_sql
+  --per-transaction`` triggers)
+* ``table`` - table name or list of names, see
+  :attr:`pg_bawler.events.ChangeEvent.table`
+* ``columns`` - mapping of column names to predicates, either a value the
+  column has to equal, or mapping of :data:`OPERATORS` to their arguments,
+  all of which have to hold
+
+Events whose payload isn't JSON object (including ``TRANSACTION`` ones)
+never match column predicates. ``project`` passes handler an event with row
+limited to given columns, ``TRANSACTION`` events are passed whole.
+
+Filters work on :class:`pg_bawler.events.ChangeEvent`, so listener's
+``event_class`` has to be kept.
+'''
+import logging
+import operator
+
+import pg_bawler.core
+import pg_bawler.events
+
+LOGGER = logging.getLogger('pg_bawler.filters')
+
+
+def _contains(value, argument):
+    return value in argument
+
+
+def _not_contains(value, argument):
+    return value not in argument
+
+
+#: Column predicate operators
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'in': _contains,
+    'not_in': _not_contains,
+}
+
+#: Keys accepted in ``match`` rules
+MATCH_KEYS = frozenset(('op', 'table', 'columns'))
+
+
+class PgBawlerFilterError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised for invalid filter rules.
+    '''
+
+
+def _as_set(value):
+    if isinstance(value, str):
+        return frozenset((value, ))
+    return frozenset(value)
+
+
+def _freeze(argument):
+    try:
+        return frozenset(argument)
+    except TypeError:
+        # unhashable items, e.g. lists, are compared one by one
+        return tuple(argument)
+
+
+def compile_column_predicate(column, spec):
+    '''
+    Returns function checking ``column`` of decoded row against ``spec``.
+    '''
+    if not isinstance(spec, dict):
+        spec = {'eq': spec}
+    checks = []
+    for name, argument in spec.items():
+        if name not in OPERATORS:
+            raise PgBawlerFilterError(
+                'Unknown operator {!r} for column {}'.format(name, column))
+        if name in ('in', 'not_in'):
+            argument = _freeze(argument)
+        checks.append((OPERATORS[name], argument))
+
+    def _predicate(row):
+        value = row.get(column)
+        try:
+            return all(check(value, argument) for check, argument in checks)
+        except TypeError:
+            # ordering of incomparable values, e.g. NULL column
+            return False
+
+    return _predicate
+
+
+def compile_match(match):
+    '''
+    Returns predicate accepting :class:`pg_bawler.events.ChangeEvent` for
+    ``match`` rules.
+    '''
+    unknown = set(match) - MATCH_KEYS
+    if unknown:
+        raise PgBawlerFilterError(
+            'Unknown match rule(s): {}'.format(', '.join(sorted(unknown))))
+    operations = tables = None
+    if match.get('op') is not None:
+        operations = _as_set(match['op'])
+        unknown = operations - pg_bawler.events.OPERATIONS - {
+            pg_bawler.events.TRANSACTION}
+        if unknown:
+            raise PgBawlerFilterError('Unknown operation(s): {}'.format(
+                ', '.join(sorted(unknown))))
+    if match.get('table') is not None:
+        tables = _as_set(match['table'])
+    column_predicates = [
+        compile_column_predicate(column, spec)
+        for column, spec in (match.get('columns') or {}).items()
+    ]
+
+    def _match(event):
+        if operations is not None and event.op not in operations:
+            return False
+        if tables is not None and event.table not in tables:
+            return False
+        if column_predicates:
+            try:
+                row = event.row
+            except ValueError:
+                return False
+            if not isinstance(row, dict):
+                return False
+            return all(predicate(row) for predicate in column_predicates)
+        return True
+
+    return _match
+
+
+class EventFilter:
+    '''
+    Callable returning event to pass to handler or ``None`` to skip it.
+
+    :param match: Predicate accepting event, ``None`` to accept all.
+    :param project: Columns to limit row to, ``None`` to pass whole row.
+    '''
+
+    __slots__ = ('match', 'project')
+
+    def __init__(self, match=None, project=None):
+        self.match = match
+        self.project = None if project is None else tuple(project)
+
+    def __call__(self, event):
+        if self.match is not None and not self.match(event):
+            return None
+        if self.project is not None:
+            try:
+                return event.project(self.project)
+            except ValueError:
+                LOGGER.warning(
+                    'Can\'t project non JSON payload from %s: %s',
+                    event.channel, event.payload)
+        return event
+
+
+def compile_filter(match=None, project=None):
+    '''
+    Returns :class:`EventFilter` for ``match`` rules and ``project`` columns
+    as given in bawlerd handler configuration.
+    '''
+    return EventFilter(
+        None if match is None else compile_match(match), project)
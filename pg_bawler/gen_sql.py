@@ -12,19 +12,71 @@ create trigger statements. Thus installation should be
 easy as:
 
     $ python -m pg_bawler.gen_sql mytable | psql mydb
+
+Busy table may be split into shard channels, each row is sent to channel
+``<channel>_<shard>`` chosen by hash of its ``--shard-key`` columns, so
+changes of the same row always go through the same channel. Shards require
+``--envelope``, so listeners take table name from the envelope origin
+instead of the shard channel:
+
+    $ python -m pg_bawler.gen_sql --shards 8 --envelope mytable
+
+Transactions changing many rows may send one notification per transaction
+instead of one per row. Keys of changed rows are collected in a temporary
+table and sent at commit by a ``DEFERRABLE INITIALLY DEFERRED`` constraint
+trigger, in notifications of at most ``--chunk-size`` bytes:
+
+    $ python -m pg_bawler.gen_sql --per-transaction --key-column id mytable
+
+Payload is ``TRANSACTION`` followed by JSON list of ``[operation, key]``
+pairs with the last operation of each key, in order of the last changes,
+see :attr:`pg_bawler.events.ChangeEvent.changes`. Keys too long to fit into
+a notification are skipped with a warning instead of failing the commit.
+Constraint trigger fires for every changed row, the first firing marks
+changes as sent in transaction local setting and the others return without
+reading the temporary table.
+
+Whole schema may be covered at once. One generic trigger function, taking
+channel from trigger argument, is installed into the schema and a ``DO``
+block creates triggers on all its tables matching ``TABLENAME`` pattern
+(``LIKE`` syntax), found in ``information_schema.tables``:
+
+    $ python -m pg_bawler.gen_sql --schema billing 'invoice%' | psql mydb
+
+Channel of each table is its name prefixed with ``--channel-prefix``.
+
+Shard channels are consumed by consumer groups, see
+:mod:`pg_bawler.groups`. Payloads of shard channels carry table name only
+in tracing envelope.
 '''
 import argparse
+import functools
+import hashlib
 import sys
 
 import jinja2
 
+import pg_bawler.tracing
 
 TRIGGER_FUNCTION_TEMPLATE = 'trigger.sql.tpl'
+TRANSACTION_TRIGGER_FUNCTION_TEMPLATE = 'transaction_trigger.sql.tpl'
+SCHEMA_TRIGGER_FUNCTION_TEMPLATE = 'schema_trigger.sql.tpl'
+SCHEMA_TRIGGERS_TEMPLATE = 'schema_triggers.sql.tpl'
 DROP_TRIGGER_TEMPLATE = 'drop_trigger.sql.tpl'
 CREATE_TRIGGER_TEMPLATE = 'create_trigger.sql.tpl'
 
 TRIGGER_FN_FMT = 'bawler_trigger_fn_{args.tablename}'
 TRIGGER_NAME_FMT = 'bawler_trigger_{args.tablename}'
+FLUSH_SUFFIX = '_flush'
+#: Notification payload has to be shorter than 8000 bytes
+MAX_PAYLOAD_SIZE = 7999
+#: Smallest ``--chunk-size``, a few keys per notification
+MIN_CHUNK_SIZE = 64
+#: Transaction local setting marking changes of channel as sent, holds the
+#: last id of collected changes
+FLUSH_SETTING_FMT = 'pg_bawler.flushed_{digest}'
+SCHEMA_TRIGGER_FN_NAME = 'bawler_trigger_fn'
+SCHEMA_TRIGGER_NAME = 'bawler_trigger'
 
 
 def get_default_cli_args_parser():
@@ -33,8 +85,10 @@ def get_default_cli_args_parser():
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument(
         'tablename',
-        metavar='TABLENAME', type=str,
-        help='Name of sql table you want ot generate trigger code for.')
+        metavar='TABLENAME', type=str, nargs='?',
+        help=(
+            'Name of sql table you want ot generate trigger code for.'
+            ' With --schema, LIKE pattern of table names (default %%).'))
     parser.add_argument(
         '--channel',
         metavar='CHANNEL', type=str,
@@ -63,12 +117,87 @@ def get_default_cli_args_parser():
         '--only-create',
         action='store_true',
         help='Generate only CREATE TRIGGER sql statement.')
+    parser.add_argument(
+        '--envelope',
+        action='store_true',
+        help=(
+            'Wrap payload with tracing envelope'
+            ' (clock_timestamp, txid and origin).'))
+    parser.add_argument(
+        '--origin',
+        metavar='ORIGIN', type=str,
+        help=(
+            'Origin recorded in tracing envelope.'
+            ' Defaults to schema qualified table name.'))
+    parser.add_argument(
+        '--shards',
+        metavar='SHARDS', type=int,
+        help=(
+            'Route each row to one of SHARDS channels'
+            ' <channel>_<hash of shard key modulo SHARDS>.'
+            ' Requires --envelope.'))
+    parser.add_argument(
+        '--shard-key',
+        metavar='COLUMN', type=str, action='append',
+        help=(
+            'Column hashed to select shard channel, may be given multiple'
+            ' times. Defaults to id.'))
+    parser.add_argument(
+        '--per-transaction',
+        action='store_true',
+        help=(
+            'Collect keys of changed rows and send them in aggregated'
+            ' notification(s) at commit.'))
+    parser.add_argument(
+        '--key-column',
+        metavar='COLUMN', type=str, action='append',
+        help=(
+            'Key column collected by --per-transaction triggers, may be'
+            ' given multiple times. Defaults to id.'))
+    parser.add_argument(
+        '--chunk-size',
+        metavar='BYTES', type=int, default=MAX_PAYLOAD_SIZE,
+        help=(
+            'Maximal payload size of one aggregated notification in bytes,'
+            ' at most %(default)s (default).'))
+    parser.add_argument(
+        '--schema',
+        metavar='SCHEMA', type=str,
+        help=(
+            'Install one generic trigger function into SCHEMA and triggers'
+            ' on all its tables matching TABLENAME pattern.'))
+    parser.add_argument(
+        '--channel-prefix',
+        metavar='PREFIX', type=str, default='',
+        help='With --schema, channel of each table is PREFIX + table name.')
     return parser
 
 
+def quote_ident(name):
+    '''
+    Quotes SQL identifier.
+    '''
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def quote_literal(value):
+    '''
+    Quotes SQL string literal.
+    '''
+    return '\'{}\''.format(value.replace('\'', '\'\''))
+
+
+@functools.lru_cache(maxsize=None)
 def get_default_tpl_loader():
-    return jinja2.Environment(
+    '''
+    Returns Jinja environment of bundled templates. The environment is
+    created once and keeps compiled templates, don't modify it.
+    '''
+    env = jinja2.Environment(
         loader=jinja2.PackageLoader(__package__, 'templates'))
+    env.filters['quote_ident'] = quote_ident
+    env.filters['quote_literal'] = quote_literal
+    return env
 
 
 def _get_and_render_template(context, tpl_loader, tpl_name):
@@ -76,6 +205,12 @@ def _get_and_render_template(context, tpl_loader, tpl_name):
     return tpl_loader.get_template(tpl_name).render(**context)
 
 
+def get_trigger_function_template(context):
+    if context.get('per_transaction'):
+        return TRANSACTION_TRIGGER_FUNCTION_TEMPLATE
+    return TRIGGER_FUNCTION_TEMPLATE
+
+
 def get_trigger_function_code(
     context,
     tpl_loader=None,
@@ -101,21 +236,87 @@ def get_create_trigger_statement(
 
 
 def create_context_from_args(args):
+    trigger_fn_name = args.trigger_fn or TRIGGER_FN_FMT.format(args=args)
+    trigger_name = args.trigger or TRIGGER_NAME_FMT.format(args=args)
     return {
         'table_name': args.tablename,
         'channel': args.channel or args.tablename,
-        'trigger_fn_name': args.trigger_fn or TRIGGER_FN_FMT.format(args=args),
-        'trigger_name': args.trigger or TRIGGER_NAME_FMT.format(args=args),
+        'trigger_fn_name': trigger_fn_name,
+        'trigger_name': trigger_name,
+        'envelope': args.envelope,
+        'envelope_prefix': pg_bawler.tracing.ENVELOPE_PREFIX,
+        'origin': args.origin,
+        'shards': args.shards,
+        'shard_key': args.shard_key or ['id'],
+        'per_transaction': args.per_transaction,
+        'flush_fn_name': trigger_fn_name + FLUSH_SUFFIX,
+        'flush_trigger_name': trigger_name + FLUSH_SUFFIX,
+        'key_columns': args.key_column or ['id'],
+        'chunk_size': args.chunk_size,
+        'max_payload_size': MAX_PAYLOAD_SIZE,
+        # channel may contain characters invalid in setting names
+        'flush_setting': FLUSH_SETTING_FMT.format(digest=hashlib.md5(
+            (args.channel or args.tablename).encode('utf-8')).hexdigest()),
+    }
+
+
+def create_schema_context_from_args(args):
+    return {
+        'schema': args.schema,
+        'table_pattern': args.tablename or '%',
+        'trigger_fn_name': args.trigger_fn or SCHEMA_TRIGGER_FN_NAME,
+        'trigger_name': args.trigger or SCHEMA_TRIGGER_NAME,
+        'channel_prefix': args.channel_prefix,
+        'envelope': args.envelope,
+        'envelope_prefix': pg_bawler.tracing.ENVELOPE_PREFIX,
+        'drop': not (args.no_drop or args.only_create),
+        'create': not (args.no_create or args.only_drop),
     }
 
 
+def schema_main(args, parser):
+    if args.channel or args.shards or args.per_transaction or args.origin:
+        parser.error(
+            '--schema can\'t be combined with --channel, --shards,'
+            ' --per-transaction or --origin')
+    tpl_loader = get_default_tpl_loader()
+    context = create_schema_context_from_args(args)
+    if not (args.only_drop or args.only_create):
+        sys.stdout.write(_get_and_render_template(
+            context, tpl_loader, SCHEMA_TRIGGER_FUNCTION_TEMPLATE))
+    if context['drop'] or context['create']:
+        sys.stdout.write(_get_and_render_template(
+            context, tpl_loader, SCHEMA_TRIGGERS_TEMPLATE))
+
+
+def check_table_args(args, parser):
+    '''
+    Reports invalid combination of single table options with ``parser``.
+    '''
+    if not args.tablename:
+        parser.error('TABLENAME is required without --schema')
+    if args.per_transaction and (args.shards or args.envelope):
+        parser.error(
+            '--per-transaction can\'t be combined with --shards or --envelope')
+    if args.shards and not args.envelope:
+        parser.error('--shards requires --envelope')
+    if not MIN_CHUNK_SIZE <= args.chunk_size <= MAX_PAYLOAD_SIZE:
+        parser.error('--chunk-size has to be between {} and {}'.format(
+            MIN_CHUNK_SIZE, MAX_PAYLOAD_SIZE))
+
+
 def main(*argv):
-    args = get_default_cli_args_parser().parse_args(argv or sys.argv[1:])
+    parser = get_default_cli_args_parser()
+    args = parser.parse_args(argv or sys.argv[1:])
+    if args.schema:
+        return schema_main(args, parser)
+    check_table_args(args, parser)
     tpl_loader = get_default_tpl_loader()
     context = create_context_from_args(args)
 
     if not (args.only_drop or args.only_create):
-        sys.stdout.write(get_trigger_function_code(context, tpl_loader))
+        sys.stdout.write(get_trigger_function_code(
+            context, tpl_loader, get_trigger_function_template(context)))
     if not (args.no_drop or args.only_create):
         sys.stdout.write(get_drop_trigger_statement(context, tpl_loader))
     if not (args.no_create or args.only_drop):
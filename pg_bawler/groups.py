@@ -0,0 +1,299 @@
+'''
+================
+pg_bawler.groups
+================
+
+Consumer groups sharing shard channels of one table.
+
+Triggers generated with ``pg_bawler.gen_sql --shards N`` send changes of
+each row to one of ``N`` channels ``<channel>_<shard>``. Listeners of a
+consumer group split the shard channels among themselves, so every change is
+handled by one member only. Each handler gets notifications of a shard one
+after another in order of arrival (see
+:attr:`pg_bawler.listener.ListenerMixin.ordered_channels`), so changes of
+the same row keep their order::
+
+    group = ConsumerGroup(
+        listener, 'clients', shards=8, members=3, member=0)
+    group.register_handler(index_in_elastic)
+    await group.join()
+
+Member ``member`` of ``members`` gets shards whose number modulo ``members``
+equals ``member``. Adding a member means starting one more process with
+``members`` increased everywhere.
+
+Static assignment needs every member configured and doesn't survive a
+member going down. :class:`AdvisoryLockGroup` members claim shards
+dynamically with PostgreSQL advisory locks held by their listening
+sessions::
+
+    group = AdvisoryLockGroup(listener, 'clients', shards=8, interval=5)
+    group.register_handler(index_in_elastic)
+    await listener.listen()
+
+Every ``interval`` seconds each member counts live members (holders of
+shared membership lock), releases shards above its fair share
+(``ceil(shards / members)``) and claims free shards up to it with
+``pg_try_advisory_lock``. Session of a member which goes down ends and its
+locks are released, so its shards are taken over within two intervals. Lock
+keys are ``(lock_key, 0)`` for membership and ``(lock_key, shard + 1)`` for
+shards, ``lock_key`` defaults to hash of the channel. Notifications sent
+while a shard is handed over are handled by none of the members, as no one
+listens on it. After listener reconnects, member listens on its shards again
+only after it locked them again.
+
+Handlers get events of shard channels, so ``channel`` of the event is the
+shard channel. ``gen_sql`` requires ``--envelope`` with ``--shards``, so
+``table`` of the event is taken from the envelope origin.
+'''
+import asyncio
+import logging
+import math
+import random
+import zlib
+
+import pg_bawler.core
+
+LOGGER = logging.getLogger('pg_bawler.groups')
+
+
+class PgBawlerGroupError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised for invalid consumer group configuration.
+    '''
+
+
+def shard_channel(channel, shard):
+    return '{}_{}'.format(channel, shard)
+
+
+def shard_channels(channel, shards):
+    '''
+    Returns all shard channels of ``channel`` split into ``shards``.
+    '''
+    return [shard_channel(channel, shard) for shard in range(shards)]
+
+
+def assign_shards(shards, members, member):
+    '''
+    Returns shards of ``member`` (counted from 0) of ``members``.
+    '''
+    if not 0 <= member < members:
+        raise PgBawlerGroupError(
+            'Member {} out of range of {} members'.format(member, members))
+    return [shard for shard in range(shards) if shard % members == member]
+
+
+class ConsumerGroup:
+    '''
+    Listener's membership in consumer group of ``channel``.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param channel: Channel name given to ``gen_sql``.
+    :param shards: Number of shard channels.
+    :param members: Number of group members.
+    :param member: Number of this member, from 0 to ``members - 1``.
+    '''
+
+    #: Listener listens on assigned shards again after it reconnects
+    relisten_on_reconnect = True
+
+    def __init__(self, listener, channel, *, shards, members=1, member=0):
+        self.listener = listener
+        self.channel = channel
+        self.shards = shards
+        self.members = members
+        self.member = member
+        self.handlers = []
+        self.assigned = set()
+        for shard in self.initial_shards():
+            self._assign(shard)
+        listener.consumer_groups.append(self)
+
+    def initial_shards(self):
+        return assign_shards(self.shards, self.members, self.member)
+
+    @property
+    def channels(self):
+        return [shard_channel(self.channel, shard) for shard in sorted(
+            self.assigned)]
+
+    def register_handler(self, handler, *, event_filter=None):
+        '''
+        Registers ``handler`` for all shards assigned to the member, now and
+        in future.
+        '''
+        self.handlers.append((handler, event_filter))
+        for shard in self.assigned:
+            self.listener.register_handler(
+                shard_channel(self.channel, shard), handler,
+                event_filter=event_filter)
+
+    def _assign(self, shard):
+        self.assigned.add(shard)
+        channel = shard_channel(self.channel, shard)
+        self.listener.registered_channels.setdefault(channel, [])
+        self.listener.ordered_channels.add(channel)
+        for handler, event_filter in self.handlers:
+            self.listener.register_handler(
+                channel, handler, event_filter=event_filter)
+
+    def _unassign(self, shard):
+        self.assigned.discard(shard)
+        channel = shard_channel(self.channel, shard)
+        for handler, _ in self.handlers:
+            self.listener.unregister_handler(channel, handler)
+        self.listener.registered_channels.pop(channel, None)
+        self.listener.ordered_channels.discard(channel)
+
+    async def run(self):
+        '''
+        Keeps membership while listener listens, static assignment needs
+        nothing.
+        '''
+
+    async def join(self):
+        '''
+        Starts listening on assigned shard channels.
+        '''
+        for channel in self.channels:
+            await self.listener.register_channel(channel)
+        LOGGER.info(
+            'Member %s of %s consuming %s', self.member, self.members,
+            ', '.join(self.channels))
+
+
+class AdvisoryLockGroup(ConsumerGroup):
+    '''
+    Consumer group of listeners across hosts coordinated by advisory locks.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param channel: Channel name given to ``gen_sql``.
+    :param shards: Number of shard channels.
+    :param interval: Seconds between rebalancing.
+    :param lock_key: First part of advisory lock keys, defaults to CRC32 of
+        ``channel``.
+    '''
+
+    MEMBERSHIP_LOCK_TPL = 'SELECT pg_advisory_lock_shared({key}, 0)'
+    MEMBERS_COUNT_TPL = (
+        'SELECT count(*) FROM pg_locks WHERE locktype = \'advisory\''
+        ' AND classid = {key} AND objid = 0 AND objsubid = 2 AND granted')
+    TRY_LOCK_TPL = 'SELECT pg_try_advisory_lock({key}, {shard})'
+    UNLOCK_TPL = 'SELECT pg_advisory_unlock({key}, {shard})'
+    # shards are listened on again once they are locked again
+    relisten_on_reconnect = False
+
+    def __init__(
+        self,
+        listener,
+        channel,
+        *,
+        shards,
+        interval=5,
+        lock_key=None
+    ):
+        self.interval = interval
+        self.lock_key = (
+            zlib.crc32(channel.encode('utf-8')) & 0x7fffffff
+            if lock_key is None else lock_key)
+        self.joined = False
+        super().__init__(listener, channel, shards=shards)
+        listener.add_reconnect_callback(self.handle_reconnect)
+
+    @property
+    def lock(self):
+        '''
+        Lock serializing rebalancing and handling of reconnect.
+        '''
+        prop_name = '_lock'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, asyncio.Lock())
+        return getattr(self, prop_name)
+
+    def initial_shards(self):
+        return ()
+
+    @property
+    def fair_share(self):
+        return math.ceil(self.shards / self.members)
+
+    async def _fetch(self, template, **kwargs):
+        row = await self.listener.pg_fetchone(
+            template.format(key=self.lock_key, **kwargs))
+        return row[0]
+
+    async def _try_lock(self, shard):
+        return bool(await self._fetch(self.TRY_LOCK_TPL, shard=shard + 1))
+
+    async def _claim(self, shard):
+        self._assign(shard)
+        await self.listener.register_channel(
+            shard_channel(self.channel, shard))
+        LOGGER.info('Claimed %s', shard_channel(self.channel, shard))
+
+    async def _release(self, shard, *, unlock=True):
+        channel = shard_channel(self.channel, shard)
+        # stop listening before another member may claim the shard
+        await self.listener.pg_unlisten(channel)
+        self._unassign(shard)
+        if unlock:
+            await self._fetch(self.UNLOCK_TPL, shard=shard + 1)
+        LOGGER.info('Released %s', channel)
+
+    async def rebalance(self):
+        '''
+        Releases shards above fair share and claims free shards up to it.
+        '''
+        async with self.lock:
+            await self._rebalance()
+
+    async def _rebalance(self):
+        if not self.joined:
+            await self._fetch(self.MEMBERSHIP_LOCK_TPL)
+            self.joined = True
+        self.members = max(await self._fetch(self.MEMBERS_COUNT_TPL), 1)
+        fair_share = self.fair_share
+        for shard in sorted(self.assigned)[fair_share:]:
+            await self._release(shard)
+        if len(self.assigned) >= fair_share:
+            return
+        # members start from different shards to not compete for the same
+        offset = random.randrange(self.shards)
+        for number in range(self.shards):
+            shard = (offset + number) % self.shards
+            if shard in self.assigned:
+                continue
+            if await self._try_lock(shard):
+                await self._claim(shard)
+                if len(self.assigned) >= fair_share:
+                    break
+
+    async def handle_reconnect(self, listener):
+        '''
+        Locks of the lost session are gone, shards locked again are
+        listened on again, the others are given up.
+        '''
+        async with self.lock:
+            self.joined = False
+            for shard in sorted(self.assigned):
+                channel = shard_channel(self.channel, shard)
+                if await self._try_lock(shard):
+                    await self.listener.register_channel(channel)
+                else:
+                    # new session doesn't listen on it
+                    self._unassign(shard)
+                    LOGGER.info('Lost %s', channel)
+            await self._rebalance()
+
+    async def run(self):
+        while not self.listener.is_stopped:
+            try:
+                await self.rebalance()
+            except self.listener.driver.errors:
+                # listener reconnects and calls handle_reconnect
+                LOGGER.exception('Rebalancing of %s failed', self.channel)
+            except Exception:
+                LOGGER.exception(
+                    'Unexpected failure of rebalancing %s', self.channel)
+            await asyncio.sleep(self.interval)
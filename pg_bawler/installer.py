@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+'''
+===================
+pg_bawler.installer
+===================
+
+Idempotent installation of triggers generated by :mod:`pg_bawler.gen_sql`.
+
+Output of ``gen_sql`` always drops and recreates the trigger, which locks the
+table on every deploy. Installer connects to the database, compares what is
+installed with rendered templates and applies only the differences::
+
+    $ python -m pg_bawler.installer --dsn "dbname=mydb" --envelope mytable
+
+* trigger functions are replaced when their source (``pg_proc.prosrc``)
+  differs from the rendered one, which takes no lock on the table
+* triggers are recreated when missing from ``pg_trigger`` or when their
+  function, events or deferrability differ, flush trigger left from
+  ``--per-transaction`` is dropped
+
+Changes are applied in one transaction with ``lock_timeout``, so installer
+waiting for a busy table fails instead of blocking queries queued behind its
+lock request. Tables with up to date triggers aren't locked at all.
+``--dry-run`` prints the statements instead of applying them.
+
+Installer accepts ``gen_sql`` options for one table, except ``--schema`` and
+``--no-*`` / ``--only-*`` ones.
+'''
+import logging
+import re
+import sys
+
+import pg_bawler.core
+import pg_bawler.gen_sql
+
+LOGGER = logging.getLogger('pg_bawler.installer')
+
+FUNCTION_RE = re.compile(
+    r'CREATE OR REPLACE FUNCTION (?P<name>[^\s(]+)\(\)'
+    r'.*?AS \$\$(?P<source>.*?)\$\$ LANGUAGE plpgsql;',
+    re.DOTALL)
+CREATE_TRIGGER_RE = re.compile(
+    r'CREATE (?:CONSTRAINT )?TRIGGER (?P<name>\S+).*?;', re.DOTALL)
+
+#: ``pg_trigger.tgtype`` of ``AFTER INSERT OR UPDATE OR DELETE`` row trigger
+#: (row 1, insert 4, delete 8, update 16)
+TRIGGER_TYPE = 29
+
+#: Seconds to wait for table lock by default
+DEFAULT_LOCK_TIMEOUT = 5
+
+
+def _unqualified(name):
+    return name.rsplit('.', 1)[-1]
+
+
+def _catalog_name(name):
+    '''
+    Returns unqualified ``name`` as stored in catalog, unquoted identifiers
+    are folded to lower case by PostgreSQL.
+    '''
+    name = _unqualified(name)
+    if len(name) > 1 and name.startswith('"') and name.endswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name.lower()
+
+
+def expected_functions(context, tpl_loader=None):
+    '''
+    Returns mapping of trigger function names to their source and
+    ``CREATE OR REPLACE FUNCTION`` statement rendered for ``context``.
+    '''
+    code = pg_bawler.gen_sql.get_trigger_function_code(
+        context, tpl_loader,
+        pg_bawler.gen_sql.get_trigger_function_template(context))
+    return {
+        match.group('name'): (match.group('source'), match.group(0))
+        for match in FUNCTION_RE.finditer(code)
+    }
+
+
+def expected_triggers(context, tpl_loader=None):
+    '''
+    Returns mapping of trigger names to their definition (function name as
+    stored in catalog, ``tgtype``, deferrable, initially deferred) and
+    ``CREATE TRIGGER`` statement rendered for ``context``.
+    '''
+    statements = {
+        match.group('name'): match.group(0)
+        for match in CREATE_TRIGGER_RE.finditer(
+            pg_bawler.gen_sql.get_create_trigger_statement(
+                context, tpl_loader))
+    }
+    definitions = {
+        context['trigger_name']: (
+            _catalog_name(context['trigger_fn_name']),
+            TRIGGER_TYPE, False, False),
+    }
+    if context['per_transaction']:
+        definitions[context['flush_trigger_name']] = (
+            _catalog_name(context['flush_fn_name']),
+            TRIGGER_TYPE, True, True)
+    return {
+        name: (definition, statements[name])
+        for name, definition in definitions.items()
+    }
+
+
+def plan_changes(context, functions, triggers, tpl_loader=None):
+    '''
+    Returns statements bringing table with installed ``functions`` (name ->
+    source) and ``triggers`` (name as stored in catalog -> definition) in
+    line with ``context``.
+    '''
+    statements = [
+        statement
+        for name, (source, statement) in expected_functions(
+            context, tpl_loader).items()
+        if functions.get(name) != source
+    ]
+    expected = expected_triggers(context, tpl_loader)
+    managed = {context['trigger_name'], context['flush_trigger_name']}
+    for name in sorted(managed - set(expected)):
+        if _catalog_name(name) in triggers:
+            statements.append(TriggerInstaller.DROP_TRIGGER_TPL.format(
+                name=name, table=context['table_name']))
+    for name, (definition, statement) in expected.items():
+        installed = triggers.get(_catalog_name(name))
+        if installed == definition:
+            continue
+        if installed is not None:
+            statements.append(TriggerInstaller.DROP_TRIGGER_TPL.format(
+                name=name, table=context['table_name']))
+        statements.append(statement)
+    return statements
+
+
+class TriggerInstaller(pg_bawler.core.BawlerBase):
+    '''
+    Installs triggers of one table rendered for ``gen_sql`` ``context``.
+
+    :param context: Template context, see
+        :func:`pg_bawler.gen_sql.create_context_from_args`.
+    :param lock_timeout: Seconds to wait for table lock.
+    '''
+
+    FUNCTION_SOURCE_TPL = (
+        'SELECT prosrc FROM pg_proc WHERE oid = to_regprocedure({signature})')
+    TRIGGERS_TPL = (
+        'SELECT t.tgname, p.proname, t.tgtype, t.tgdeferrable,'
+        ' t.tginitdeferred FROM pg_trigger t'
+        ' JOIN pg_proc p ON p.oid = t.tgfoid'
+        ' WHERE t.tgrelid = to_regclass({table}) AND NOT t.tgisinternal')
+    DROP_TRIGGER_TPL = 'DROP TRIGGER {name} ON {table};'
+    LOCK_TIMEOUT_TPL = 'SET LOCAL lock_timeout = \'{milliseconds}ms\''
+
+    def __init__(
+        self,
+        connection_params,
+        context,
+        *,
+        lock_timeout=DEFAULT_LOCK_TIMEOUT,
+        loop=None,
+        driver=None
+    ):
+        super().__init__(connection_params, loop=loop, driver=driver)
+        self.context = context
+        self.lock_timeout = lock_timeout
+
+    async def fetch_functions(self):
+        '''
+        Returns sources of installed trigger functions by name,
+        ``to_regprocedure`` resolves the name like ``CREATE FUNCTION``.
+        '''
+        functions = {}
+        for name in expected_functions(self.context):
+            row = await self.pg_fetchone(self.FUNCTION_SOURCE_TPL.format(
+                signature=pg_bawler.gen_sql.quote_literal(name + '()')))
+            if row is not None:
+                functions[name] = row[0]
+        return functions
+
+    async def fetch_triggers(self):
+        '''
+        Returns definitions of triggers installed on the table by name.
+        '''
+        table = pg_bawler.gen_sql.quote_literal(self.context['table_name'])
+        rows = await self.pg_fetchall(self.TRIGGERS_TPL.format(table=table))
+        return {row[0]: tuple(row)[1:] for row in rows}
+
+    async def plan(self):
+        '''
+        Returns statements needed to bring the table up to date.
+        '''
+        return plan_changes(
+            self.context,
+            await self.fetch_functions(),
+            await self.fetch_triggers())
+
+    async def install(self):
+        '''
+        Applies differences in one transaction and returns executed
+        statements.
+        '''
+        table_name = self.context['table_name']
+        await self.pg_execute('BEGIN')
+        try:
+            await self.pg_execute(self.LOCK_TIMEOUT_TPL.format(
+                milliseconds=int(self.lock_timeout * 1000)))
+            # catalog is read inside the transaction, right before changes
+            statements = await self.plan()
+            for statement in statements:
+                await self.pg_execute(statement)
+        except Exception:
+            try:
+                await self.pg_execute('ROLLBACK')
+            except self.driver.connection_errors:
+                # transaction is gone with the connection, keep the original
+                # exception
+                await self.drop_connection()
+            raise
+        await self.pg_execute('COMMIT')
+        if statements:
+            LOGGER.info(
+                'Applied %s change(s) to triggers of %s',
+                len(statements), table_name)
+        else:
+            LOGGER.info('Triggers of %s are up to date', table_name)
+        return statements
+
+
+def get_default_cli_args_parser():
+    parser = pg_bawler.gen_sql.get_default_cli_args_parser()
+    parser.description = __doc__
+    parser.add_argument(
+        '--log-level',
+        metavar='LOG_LEVEL',
+        default='INFO',
+        choices="FATAL CIRTICAL ERROR WARNING INFO DEBUG".split(),
+        help='Log level. One of: FATAL, CIRTICAL, ERROR, WARNING, INFO, DEBUG')
+    parser.add_argument(
+        '--dsn',
+        metavar='DSN',
+        required=True,
+        help='Connection string. e.g. `dbname=test user=postgres`')
+    parser.add_argument(
+        '--driver',
+        metavar='DRIVER', default=None,
+        help='Database driver. One of: aiopg, asyncpg')
+    parser.add_argument(
+        '--lock-timeout',
+        metavar='SECONDS', type=float, default=DEFAULT_LOCK_TIMEOUT,
+        help='Time to wait for table lock (default %(default)s).')
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Print statements needed instead of applying them.')
+    return parser
+
+
+async def run_installer(installer, *, dry_run=False):
+    async with installer:
+        if dry_run:
+            return await installer.plan()
+        return await installer.install()
+
+
+def main(*argv, loop=None):
+    parser = get_default_cli_args_parser()
+    args = parser.parse_args(argv or sys.argv[1:])
+    logging.basicConfig(
+        format='[%(asctime)s][%(name)s][%(levelname)s]: %(message)s',
+        level=args.log_level.upper())
+    if (
+        args.schema or args.no_drop or args.no_create or
+        args.only_drop or args.only_create
+    ):
+        parser.error(
+            '--schema, --no-* and --only-* options aren\'t supported'
+            ' by installer')
+    pg_bawler.gen_sql.check_table_args(args, parser)
+    installer = TriggerInstaller(
+        {'dsn': args.dsn},
+        pg_bawler.gen_sql.create_context_from_args(args),
+        lock_timeout=args.lock_timeout,
+        driver=args.driver)
+    loop = loop or pg_bawler.core.new_event_loop()
+    try:
+        statements = loop.run_until_complete(
+            run_installer(installer, dry_run=args.dry_run))
+    finally:
+        loop.close()
+    if args.dry_run:
+        sys.stdout.write(''.join(
+            statement + '\n' for statement in statements))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
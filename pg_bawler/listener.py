@@ -4,26 +4,49 @@
 pg_bawler.listener
 ==================
 
-Listen on given channel for notification.
+Listen on given channels for notification.
 
     $ python -m pg_bawler.listener mychannel
 
+Stream notifications as JSON lines (one object per notification) into
+another tool::
+
+    $ python -m pg_bawler.listener --format jsonl foo bar | jq .payload
+
 If you installed notification trigger with ``pg_bawler.gen_sql`` then
 channel is the same as ``tablename`` argument.
 '''
 import argparse
 import asyncio
+import collections
+import functools
 import importlib
+import inspect
+import json
 import logging
 import sys
-
-import psycopg2
+import time
 
 import pg_bawler.core
+import pg_bawler.drivers
+import pg_bawler.events
+import pg_bawler.subscription
+import pg_bawler.tracing
 
 
 LOGGER = logging.getLogger('pg_bawler.listener')
 
+_DEFAULT = object()
+
+
+class _PreparedNotification(pg_bawler.core.Notification):
+    '''
+    Notification carrying its event and handlers accepting it, computed when
+    filtering it before admission, so :meth:`ListenerMixin._dispatch`
+    doesn't decode and filter it again. Spooling on disk turns it back into
+    plain notification.
+    '''
+
 
 class PgBawlerListenerConnectionError(pg_bawler.core.PgBawlerException):
     '''
@@ -39,11 +62,102 @@ class ListenerMixin:
     try_to_reconnect = True
     reconnect_interval = 5
     reconnect_attempts = None
+    #: :class:`pg_bawler.tracing.LatencyTracer` for enveloped notifications
+    latency_tracer = None
+    #: Class wrapping notifications passed to handlers, ``None`` to pass
+    #: notifications as they are
+    event_class = pg_bawler.events.ChangeEvent
+    #: Columns forming :attr:`pg_bawler.events.ChangeEvent.keys`
+    event_key_columns = ('id', )
+    #: :class:`pg_bawler.monitoring.NotificationQueueMonitor` run while
+    #: listening
+    queue_monitor = None
+    #: :class:`pg_bawler.shedding.AdmissionController` deciding which
+    #: notifications get dispatched when handlers can't keep up
+    admission = None
+    #: :class:`pg_bawler.spool.NotificationSpool` holding notifications while
+    #: handlers are backed up
+    spool = None
+    #: :class:`pg_bawler.retry.RetryScheduler` retrying failed handlers
+    retry = None
+    #: :class:`pg_bawler.relay.RelayServer` rebroadcasting notifications to
+    #: local processes while listening
+    relay = None
+    #: Number of dispatched notifications
+    notifications_received = 0
+    #: Number of events skipped by handler filters
+    events_filtered = 0
+    #: Number of created handler tasks
+    handlers_started = 0
+    #: Number of finished handler tasks
+    handlers_completed = 0
+    #: Seconds after which handler task is cancelled, ``None`` for no limit
+    handler_timeout = None
+    #: Seconds :meth:`stop` waits for running handlers before cancelling
+    #: them, ``None`` to wait until they finish
+    drain_timeout = 10
     _stopped = False
+    #: Changed with every (un)registration of handler
+    _registrations_version = 0
+
+    async def stop(self, *, drain_timeout=_DEFAULT):
+        '''
+        Stops listening and drains running handler tasks.
 
-    async def stop(self):
+        :param drain_timeout: Overrides :attr:`drain_timeout`.
+        '''
         await self.drop_connection()
         self._stopped = True
+        await self.drain(
+            self.drain_timeout if drain_timeout is _DEFAULT else drain_timeout)
+        if self.spool is not None:
+            self.spool.close()
+        if self.retry is not None:
+            self.retry.close()
+
+    async def drain(self, timeout=None):
+        '''
+        Waits up to ``timeout`` seconds for running handler tasks, except the
+        current task (handler may stop its listener), and cancels the rest.
+        Tasks started while draining (e.g. retries of failed handlers) are
+        waited for too. Notifications still queued by :attr:`admission` are
+        not dispatched after stop and are abandoned.
+
+        :returns: Number of cancelled tasks.
+        '''
+        current = asyncio.current_task()
+        tasks = self.handler_tasks - {current}
+        if not tasks:
+            return 0
+        LOGGER.info('Draining %s running handler(s)', len(tasks))
+        deadline = None if timeout is None else self.loop.time() + timeout
+        pending = set()
+        while tasks:
+            remaining = (
+                None if deadline is None
+                else max(deadline - self.loop.time(), 0))
+            _, pending = await asyncio.wait(tasks, timeout=remaining)
+            if pending:
+                break
+            tasks = self.handler_tasks - {current}
+        for task in pending:
+            task.cancel()
+        if pending:
+            LOGGER.warning(
+                'Cancelled %s handler(s) still running after %s seconds',
+                len(pending), timeout)
+            await asyncio.wait(pending)
+        return len(pending)
+
+    @property
+    def handler_tasks(self):
+        '''
+        Set of running handler tasks.
+        '''
+        prop_name = '_handler_tasks'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, set())
+        return getattr(self, prop_name)
 
     @property
     def is_stopped(self):
@@ -56,6 +170,49 @@ class ListenerMixin:
             setattr(self, prop_name, {})
         return getattr(self, prop_name)
 
+    @property
+    def notification_taps(self):
+        prop_name = '_notification_taps'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, [])
+        return getattr(self, prop_name)
+
+    def add_notification_tap(self, tap):
+        '''
+        Adds ``tap``, a callable called with every received notification
+        before it's dispatched to handlers.
+
+        :param tap: Callable accepting notification
+        :returns: None
+        '''
+        self.notification_taps.append(tap)
+
+    def remove_notification_tap(self, tap):
+        self.notification_taps.remove(tap)
+
+    @property
+    def reconnect_callbacks(self):
+        prop_name = '_reconnect_callbacks'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, [])
+        return getattr(self, prop_name)
+
+    def add_reconnect_callback(self, callback):
+        '''
+        Adds ``callback`` called with listener after it reconnected and
+        registered its channels again. Notifications sent while connection
+        was lost are missed, so callbacks may e.g. flush caches. Exceptions
+        of callbacks are logged and don't stop listening nor other
+        callbacks.
+
+        :param callback: Callable or coroutine function accepting listener
+        :returns: None
+        '''
+        self.reconnect_callbacks.append(callback)
+
+    def remove_reconnect_callback(self, callback):
+        self.reconnect_callbacks.remove(callback)
+
     async def _reconnect(self):
         '''
         Tries to reconnect for ``reconnect_attempts`` times, waiting
@@ -68,12 +225,8 @@ class ListenerMixin:
                 LOGGER.info(
                     'Trying to reconnect for %s time!',
                     reconnects_attempted + 1)
-                async with (
-                    await self.pg_connection()
-                ).cursor() as pg_cursor:
-                    await pg_cursor.execute('SELECT 1')
-                    await pg_cursor.fetchone() == (1, )
-            except psycopg2.Error:
+                await self.pg_fetchone('SELECT 1')
+            except self.driver.errors:
                 reconnects_attempted += 1
                 LOGGER.error(
                     'Reconnect attempt %s of %s failed!',
@@ -89,9 +242,7 @@ class ListenerMixin:
                             reconnects_attempted
                     ))
                 if self.reconnect_interval:
-                    await asyncio.sleep(
-                        self.reconnect_interval,
-                        loop=self.loop)
+                    await asyncio.sleep(self.reconnect_interval)
                 await self.drop_connection()
                 continue
             else:
@@ -106,8 +257,16 @@ class ListenerMixin:
         return self.CHANNEL_REGISTRATION_TPL.format(channel=channel)
 
     async def _re_register_all_channels(self):
-        for channel in self.registered_channels:
-            await self.register_channel(channel)
+        # e.g. advisory lock groups listen on shards after locking them
+        skipped = {
+            channel
+            for group in self.consumer_groups
+            if not group.relisten_on_reconnect
+            for channel in group.channels
+        }
+        for channel in list(self.registered_channels):
+            if channel not in skipped:
+                await self.register_channel(channel)
 
     async def register_channel(self, channel):
         '''
@@ -116,10 +275,143 @@ class ListenerMixin:
         :param channel: Name of the channel
         :returns: None
         '''
-        async with (await self.pg_connection()).cursor() as cursor:
-            await cursor.execute(self._get_listen_statement(channel))
+        await self.pg_listen(channel, self._get_listen_statement(channel))
         self.registered_channels.setdefault(channel, [])
 
+    @property
+    def on_demand_channels(self):
+        '''
+        Channels registered by :meth:`acquire_channel`.
+        '''
+        prop_name = '_on_demand_channels'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, set())
+        return getattr(self, prop_name)
+
+    def is_channel_used(self, channel):
+        '''
+        Returns whether ``channel`` has handlers, subscriptions or relay
+        subscribers.
+        '''
+        return bool(
+            self.registered_channels.get(channel) or
+            self.subscriptions.get(channel) or
+            (self.relay is not None and self.relay.has_subscribers(channel)))
+
+    async def acquire_channel(self, channel):
+        '''
+        Registers ``channel`` on demand of subscriptions or relay, unless
+        it's registered already.
+        '''
+        if channel not in self.registered_channels:
+            await self.register_channel(channel)
+            self.on_demand_channels.add(channel)
+
+    async def release_channel(self, channel):
+        '''
+        Unlistens ``channel`` registered by :meth:`acquire_channel` once
+        nothing uses it.
+        '''
+        if channel not in self.on_demand_channels or (
+            self.is_channel_used(channel)
+        ):
+            return
+        self.on_demand_channels.discard(channel)
+        self.registered_channels.pop(channel, None)
+        if self.is_stopped:
+            return
+        try:
+            await self.pg_unlisten(channel)
+        except self.driver.errors:
+            LOGGER.exception('Failed to stop listening on %s', channel)
+
+    @property
+    def consumer_groups(self):
+        '''
+        List of :class:`pg_bawler.groups.ConsumerGroup` memberships run
+        while listening.
+        '''
+        prop_name = '_consumer_groups'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, [])
+        return getattr(self, prop_name)
+
+    @property
+    def ordered_channels(self):
+        '''
+        Channels whose notifications are handled one after another by each
+        handler, in order of arrival (used for shard channels of consumer
+        groups). Waiting for the previous notification counts against
+        ``handler_timeout``, retried handlers run out of order.
+        '''
+        prop_name = '_ordered_channels'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, set())
+        return getattr(self, prop_name)
+
+    @property
+    def _ordered_tails(self):
+        # ``(channel, handler)`` -> future of the last handler invocation
+        prop_name = '_ordered_tails_map'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, {})
+        return getattr(self, prop_name)
+
+    def _ordered(self, coro, key):
+        '''
+        Returns coroutine running ``coro`` once previous invocation queued
+        under ``key`` finished.
+        '''
+        tails = self._ordered_tails
+        previous = tails.get(key)
+        done = self.loop.create_future()
+        tails[key] = done
+        done.add_done_callback(functools.partial(self._forget_tail, key))
+        return self._run_ordered(coro, previous, done)
+
+    def _forget_tail(self, key, done):
+        if self._ordered_tails.get(key) is done:
+            del self._ordered_tails[key]
+
+    async def _run_ordered(self, coro, previous, done):
+        try:
+            if previous is not None:
+                await asyncio.wait((previous, ))
+            return await coro
+        finally:
+            # closes ``coro`` cancelled before it started
+            coro.close()
+            # the next one waits for the previous even if this is cancelled
+            if previous is None or previous.done():
+                done.set_result(None)
+            else:
+                previous.add_done_callback(
+                    lambda _: done.set_result(None))
+
+    @property
+    def subscriptions(self):
+        '''
+        Mapping of channels to their open
+        :class:`pg_bawler.subscription.Subscription` instances.
+        '''
+        prop_name = '_subscriptions'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, {})
+        return getattr(self, prop_name)
+
+    def subscribe(self, channel, *, maxsize=1000, overflow='error'):
+        '''
+        Returns :class:`pg_bawler.subscription.Subscription` of ``channel``,
+        async iterator of its events.
+
+        :param channel: Name of channel
+        :param maxsize: Maximal number of buffered events
+        :param overflow: Policy applied when buffer is full, see
+            :data:`pg_bawler.subscription.OVERFLOW_POLICIES`
+        '''
+        return pg_bawler.subscription.Subscription(
+            self, channel, maxsize=maxsize, overflow=overflow)
+
     async def timeout_callback(self):
         LOGGER.debug(
             'Timed out. No notification for last %s seconds.',
@@ -130,9 +422,7 @@ class ListenerMixin:
             LOGGER.debug(
                 'Checking health of connection [%s].',
                 {**self.connection_params, 'password': '*****'})
-            async with (await self.pg_connection()).cursor() as pg_cursor:
-                await pg_cursor.execute('SELECT 1')
-                await pg_cursor.fetchone() == (1, )
+            await self.pg_fetchone('SELECT 1')
             LOGGER.debug(
                 'Connection healthy [%s].',
                 {**self.connection_params, 'password': '*****'})
@@ -140,32 +430,57 @@ class ListenerMixin:
     async def get_notification(self):
         try:
             notification = await asyncio.wait_for(
-                (await self.pg_connection()).notifies.get(),
+                self.driver.notifies(await self.pg_connection()).get(),
                 self.listen_timeout,
-                loop=self.loop,
             )
         except asyncio.TimeoutError:
             await self.timeout_callback()
             return None
-        else:
-            LOGGER.debug(
-                'Received notification from channel %s: %s',
-                notification.channel, notification.payload)
-            return notification
+        if notification is pg_bawler.drivers.UPSTREAM_RECONNECTED:
+            LOGGER.info('Upstream of the connection reconnected')
+            await self._run_reconnect_callbacks()
+            return None
+        LOGGER.debug(
+            'Received notification from channel %s: %s',
+            notification.channel, notification.payload)
+        return notification
 
-    def register_handler(self, channel, handler):
+    @property
+    def handler_filters(self):
+        '''
+        Mapping of ``(channel, handler)`` to filters deciding which events
+        the handler gets, see :mod:`pg_bawler.filters`. There is one filter
+        (or ``None``) per registration of the handler on the channel, in
+        order of registration.
+        '''
+        prop_name = '_handler_filters'
+        if not hasattr(self, prop_name):
+            setattr(self, prop_name, {})
+        return getattr(self, prop_name)
+
+    def register_handler(self, channel, handler, *, event_filter=None):
         '''
         Registers ``handler`` with given ``channel``
 
         :param channel: Name of channel
         :param handler: Coroutine that will handle notifications from
             ``channel``
+        :param event_filter: Callable returning event passed to ``handler``
+            or ``None`` to skip it, e.g.
+            :class:`pg_bawler.filters.EventFilter`
         :returns: None
         '''
+        filters = self.handler_filters.get((channel, handler))
+        if filters is None and event_filter is not None:
+            filters = self.handler_filters[(channel, handler)] = [None] * (
+                self.registered_channels.get(channel, []).count(handler))
+        if filters is not None:
+            filters.append(event_filter)
         if channel in self.registered_channels:
             self.registered_channels[channel].append(handler)
         else:
             self.registered_channels[channel] = [handler]
+        self._registrations_version += 1
 
     def unregister_handler(self, channel, handler):
         '''
@@ -179,6 +494,13 @@ class ListenerMixin:
         if channel in self.registered_channels:
             try:
                 self.registered_channels[channel].remove(handler)
+                filters = self.handler_filters.get((channel, handler))
+                if filters is not None:
+                    # registrations are removed from the first one
+                    del filters[0]
+                    if not any(filters):
+                        del self.handler_filters[(channel, handler)]
+                self._registrations_version += 1
             except ValueError:
                 LOGGER.debug('Handler is not registered.')
             else:
@@ -188,24 +510,253 @@ class ListenerMixin:
     async def _listen(self):
         try:
             notification = await self.get_notification()
-        except (
-            psycopg2.InterfaceError,
-            psycopg2.OperationalError
-        ):
+        except self.driver.connection_errors:
+            if self.is_stopped:
+                # connection closed by stop()
+                return
             if self.try_to_reconnect:
                 await self._reconnect()
                 await self._re_register_all_channels()
+                await self._run_reconnect_callbacks()
             else:
                 await self.stop()
         else:
             if notification is not None:
-                handlers = self.registered_channels[notification.channel]
-                for handler in handlers:
-                    self.loop.create_task(handler(notification, self))
+                for tap in self.notification_taps:
+                    tap(notification)
+                prepared = self._prepare(notification)
+                if prepared is None:
+                    self._processed(notification)
+                    return
+                notification = prepared
+                if self.spool is not None:
+                    self.spool.submit(notification)
+                    # spool is responsible for the notification from now on
+                    self._processed(notification)
+                else:
+                    self._admit(notification)
+
+    async def _run_reconnect_callbacks(self):
+        for callback in tuple(self.reconnect_callbacks):
+            try:
+                result = callback(self)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                LOGGER.exception('Reconnect callback %s failed', callback)
+
+    def _processed(self, notification):
+        '''
+        Reports ``notification`` received from driver as processed to
+        drivers confirming processed position, e.g. logical decoding.
+        '''
+        if not self.driver.confirms_processed:
+            return
+        connection = getattr(self, self.pg_connection.cache_attr_name, None)
+        if connection is not None:
+            self.driver.processed(connection, notification)
+
+    def _processed_when_done(self, notification, tasks):
+        if not tasks:
+            self._processed(notification)
+            return
+        remaining = [len(tasks)]
+
+        def _task_done(task):
+            remaining[0] -= 1
+            if not remaining[0]:
+                self._processed(notification)
+
+        for task in tasks:
+            task.add_done_callback(_task_done)
+
+    def _admit(self, notification):
+        if self.admission is not None:
+            self.admission.submit(notification)
+        else:
+            self._dispatch(notification)
+
+    def _make_event(self, notification):
+        '''
+        Strips tracing envelope and wraps ``notification`` with
+        ``event_class``, returns envelope and the event.
+        '''
+        envelope, payload = pg_bawler.tracing.parse_envelope(
+            notification.payload)
+        if envelope is not None:
+            notification = pg_bawler.core.Notification(
+                notification.pid, notification.channel, payload)
+        if self.event_class is not None:
+            notification = self.event_class(
+                notification, envelope, self.event_key_columns)
+        return envelope, notification
+
+    def _filter_handlers(self, handlers, event):
+        '''
+        Returns list of ``(handler, event)`` of ``handlers`` whose filters
+        accept ``event``.
+        '''
+        filters = self.handler_filters
+        if not filters:
+            return [(handler, event) for handler in handlers]
+        accepted = []
+        registrations = None
+        for handler in handlers:
+            handler_filters = filters.get((event.channel, handler))
+            if handler_filters is None:
+                accepted.append((handler, event))
+                continue
+            if registrations is None:
+                registrations = collections.Counter()
+            event_filter = handler_filters[registrations[handler]]
+            registrations[handler] += 1
+            if event_filter is None:
+                accepted.append((handler, event))
+                continue
+            filtered = event_filter(event)
+            if filtered is not None:
+                accepted.append((handler, filtered))
+        return accepted
+
+    def _prepare(self, notification):
+        '''
+        Returns ``notification`` with its event and handlers accepting it
+        when all handlers of the channel have filters, or ``None`` when the
+        filters reject it, so it skips admission control and spool.
+        '''
+        filters = self.handler_filters
+        if not filters:
+            return notification
+        channel = notification.channel
+        handlers = self.registered_channels.get(channel)
+        if not handlers or self.subscriptions.get(channel) or any(
+            (channel, handler) not in filters for handler in handlers
+        ):
+            return notification
+        envelope, event = self._make_event(notification)
+        accepted = self._filter_handlers(handlers, event)
+        if not accepted:
+            self.events_filtered += len(handlers)
+            return None
+        notification = _PreparedNotification(*notification)
+        notification.envelope = envelope
+        notification.event = event
+        notification.accepted = accepted
+        notification.registrations_version = self._registrations_version
+        return notification
+
+    def _dispatch(self, notification):
+        '''
+        Strips tracing envelope, wraps ``notification`` with
+        ``event_class`` and creates handler tasks for it.
+        '''
+        received_notification = notification
+        accepted = getattr(notification, 'accepted', None)
+        if accepted is not None:
+            envelope, notification = notification.envelope, notification.event
+            if received_notification.registrations_version != (
+                self._registrations_version
+            ):
+                # handlers changed while the notification was queued
+                accepted = None
+        else:
+            envelope, notification = self._make_event(notification)
+        traced = False
+        if envelope is not None:
+            traced = (
+                self.latency_tracer is not None and
+                self.latency_tracer.should_sample())
+            if traced:
+                self.latency_tracer.observe_received(envelope)
+                received = time.monotonic()
+        self.notifications_received += 1
+        subscriptions = self.subscriptions.get(notification.channel)
+        if subscriptions:
+            # subscription with ``error`` overflow removes itself
+            for subscription in tuple(subscriptions):
+                subscription.put(notification)
+        tasks = []
+        # relay's channels may be unregistered while notifications are queued
+        handlers = self.registered_channels.get(notification.channel, ())
+        if accepted is None:
+            accepted = self._filter_handlers(handlers, notification)
+        self.events_filtered += len(handlers) - len(accepted)
+        ordered = notification.channel in self.ordered_channels
+        for handler, event in accepted:
+            coro = handler(event, self)
+            if ordered:
+                coro = self._ordered(coro, (notification.channel, handler))
+            if traced:
+                coro = self.latency_tracer.trace_handler(coro, received)
+            tasks.append(self._start_handler(coro, handler, event))
+        if self.driver.confirms_processed:
+            self._processed_when_done(received_notification, tasks)
+
+    def _start_handler(self, coro, handler, notification, attempt=1):
+        '''
+        Creates tracked task running ``coro`` of ``handler`` for
+        ``notification``.
+        '''
+        task = self.loop.create_task(coro)
+        timeout_handle = None
+        if self.handler_timeout is not None:
+            timeout_handle = self.loop.call_later(
+                self.handler_timeout, self._handler_timed_out, task)
+        task.add_done_callback(functools.partial(
+            self._handler_done, time.monotonic(), timeout_handle, handler,
+            notification, attempt))
+        self.handler_tasks.add(task)
+        self.handlers_started += 1
+        return task
+
+    def _handler_timed_out(self, task):
+        LOGGER.error(
+            'Handler %s timed out after %s seconds, cancelling',
+            task.get_coro(), self.handler_timeout)
+        task.cancel()
+
+    def _handler_done(
+        self, started, timeout_handle, handler, notification, attempt, task
+    ):
+        self.handler_tasks.discard(task)
+        self.handlers_completed += 1
+        if timeout_handle is not None:
+            timeout_handle.cancel()
+        if not task.cancelled() and task.exception() is not None:
+            if self.retry is not None:
+                self.retry.handler_failed(
+                    handler, notification, attempt, task.exception())
+            else:
+                LOGGER.error(
+                    'Handler %s failed', handler, exc_info=task.exception())
+        if self.admission is not None:
+            self.admission.handler_done(time.monotonic() - started)
+        if self.spool is not None:
+            self.spool.pump()
 
     async def listen(self):
-        while not self.is_stopped:
-            await self._listen()
+        monitor_task = None
+        if self.queue_monitor is not None:
+            monitor_task = self.loop.create_task(self.queue_monitor.run())
+        if self.spool is not None:
+            # replay notifications spooled before restart
+            self.spool.pump()
+        if self.relay is not None:
+            await self.relay.start()
+        group_tasks = [
+            self.loop.create_task(group.run())
+            for group in self.consumer_groups
+        ]
+        try:
+            while not self.is_stopped:
+                await self._listen()
+        finally:
+            if monitor_task is not None:
+                monitor_task.cancel()
+            for task in group_tasks:
+                task.cancel()
+            if self.relay is not None:
+                self.relay.close()
 
 
 class DefaultHandler:
@@ -222,6 +773,63 @@ class DefaultHandler:
             notification.channel, notification.payload)
 
 
+class JsonLinesHandler:
+    '''
+    Writes notifications to ``stream`` as JSON lines::
+
+        {"channel": "foo", "pid": 42, "payload": "...", "received": 1.5e9}
+
+    Lines are buffered and written when ``buffer_lines`` lines accumulate
+    or ``flush_interval`` seconds after the first buffered line.
+
+    :param stream: Text stream, ``sys.stdout`` by default.
+    :param buffer_lines: Maximal number of buffered lines.
+    :param flush_interval: Maximal number of seconds line stays buffered.
+    '''
+
+    def __init__(self, stream=None, *, buffer_lines=1000, flush_interval=0.2):
+        self.stream = stream
+        self.buffer_lines = buffer_lines
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._buffer = []
+        self._flush_handle = None
+        self._encode = json.JSONEncoder(
+            ensure_ascii=False, separators=(',', ':')).encode
+
+    async def handle_notification(self, notification, listener):
+        self.write(notification)
+
+    def write(self, notification):
+        self.count += 1
+        self._buffer.append(self._encode({
+            'channel': notification.channel,
+            'pid': notification.pid,
+            'payload': notification.payload,
+            'received': time.time(),
+        }))
+        if len(self._buffer) >= self.buffer_lines:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                self.flush_interval, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._buffer:
+            stream = self.stream or sys.stdout
+            self._buffer.append('')
+            stream.write('\n'.join(self._buffer))
+            stream.flush()
+            self._buffer.clear()
+
+
+#: Output formats of the CLI default handler
+OUTPUT_FORMATS = ('text', 'jsonl')
+
+
 def get_default_cli_args_parser():
     parser = argparse.ArgumentParser(
         description=__doc__,
@@ -251,13 +859,25 @@ def get_default_cli_args_parser():
             ' connection if it\'s alive'))
     parser.add_argument(
         '--handler',
-        metavar='HANDLER', default='pg_bawler.listener:default_handler',
+        metavar='HANDLER', default=None,
         help=(
             'Module and name of python callable.'
             ' e.g. `pg_bawler.listener:default_handler`'))
     parser.add_argument(
-        'channel',
-        metavar='CHANNEL', type=str,
+        '--format',
+        metavar='FORMAT', default='text', choices=OUTPUT_FORMATS,
+        help=(
+            'Output of the default handler. One of: text (log every'
+            ' notification), jsonl (JSON object per line to stdout)'))
+    parser.add_argument(
+        '--loop',
+        metavar='LOOP', default='asyncio',
+        help=(
+            'Event loop implementation. One of: asyncio, uvloop'
+            ' or `module:factory` path.'))
+    parser.add_argument(
+        'channels',
+        metavar='CHANNEL', type=str, nargs='+',
         help='Name of Notify/Listen channel to listen on.')
     return parser
 
@@ -278,7 +898,8 @@ def _main(
     *,
     loop,
     connection_params,
-    channel,
+    channel=None,
+    channels=(),
     handler=default_handler,
     timeout=5,
     stop_on_timeout=False,
@@ -289,8 +910,10 @@ def _main(
         loop=loop)
     listener.listen_timeout = timeout
     listener.stop_on_timeout = stop_on_timeout
-    listener.register_handler(channel, handler)
-    loop.run_until_complete(listener.register_channel(channel))
+    channels = list(channels) + ([channel] if channel is not None else [])
+    for channel in channels:
+        listener.register_handler(channel, handler)
+        loop.run_until_complete(listener.register_channel(channel))
     return listener, loop.create_task(listener.listen())
 
 
@@ -299,19 +922,31 @@ def main(*argv, loop=None):
     logging.basicConfig(
         format='[%(asctime)s][%(name)s][%(levelname)s]: %(message)s',
         level=args.log_level.upper())
-    LOGGER.info('Starting pg_bawler listener for channel: %s', args.channel)
-    loop = loop or asyncio.get_event_loop()
+    LOGGER.info(
+        'Starting pg_bawler listener for channels: %s',
+        ', '.join(args.channels))
+    loop = loop or pg_bawler.core.new_event_loop(args.loop)
+    jsonl_handler = None
+    if args.handler is not None:
+        handler = resolve_handler(args.handler)
+    elif args.format == 'jsonl':
+        jsonl_handler = JsonLinesHandler()
+        handler = jsonl_handler.handle_notification
+    else:
+        handler = default_handler
     _, listen_task = _main(
         loop=loop,
         connection_params={'dsn': args.dsn},
-        channel=args.channel,
-        handler=resolve_handler(args.handler),
+        channels=args.channels,
+        handler=handler,
         stop_on_timeout=args.stop_on_timeout,
         timeout=args.timeout)
     listen_task.add_done_callback(lambda fut: loop.stop())
     try:
         loop.run_forever()
     finally:
+        if jsonl_handler is not None:
+            jsonl_handler.flush()
         if loop.is_running():
             loop.stop()
         loop.close()
@@ -0,0 +1,487 @@
+'''
+=================
+pg_bawler.logical
+=================
+
+Trigger-free source of change notifications using `logical decoding`_.
+
+.. _logical decoding:
+   https://www.postgresql.org/docs/current/static/logicaldecoding.html
+
+:class:`LogicalDecodingDriver` consumes a logical replication slot and turns
+decoded changes into notifications of the same shape the triggers from
+``pg_bawler.gen_sql`` produce, so ``ListenerMixin`` handlers don't need to
+change::
+
+    listener = NotificationListener(
+        {'dsn': 'dbname=clients user=replicator'},
+        driver=LogicalDecodingDriver(
+            slot_name='bawler', plugin='pgoutput', publication='bawler'))
+    listener.register_handler('foo', handler)
+    await listener.register_channel('foo')
+    await listener.listen()
+
+Channel of the notification is made from ``channel_fmt`` (table name by
+default) and notifications from channels nobody listens on are skipped.
+Payload is enveloped (:mod:`pg_bawler.tracing`) with commit timestamp,
+transaction id and ``schema.table`` origin when the plugin provides them.
+
+Supported output plugins are ``pgoutput`` (PostgreSQL 10+, needs
+a publication) and ``wal2json`` (format version 1 and 2).
+
+Position of a change is processed once all handlers of its notification
+finished (or the notification was spooled or shed), together with all
+preceding changes. Processed position is confirmed to the server every
+``feedback_interval`` seconds, not per message. Replication resumes from the
+slot's confirmed position after reconnect or restart, unless ``start_lsn`` is
+given, so changes whose handlers didn't finish are received again. Note that
+``DELETE`` changes carry only replica identity columns of the old row.
+'''
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import struct
+import time
+
+import pg_bawler.core
+import pg_bawler.drivers
+import pg_bawler.tracing
+
+LOGGER = logging.getLogger('pg_bawler.logical')
+
+#: Decoded change
+Change = collections.namedtuple('Change', 'schema table op row xid timestamp')
+
+_OPERATIONS = {
+    'insert': 'INSERT',
+    'update': 'UPDATE',
+    'delete': 'DELETE',
+    'I': 'INSERT',
+    'U': 'UPDATE',
+    'D': 'DELETE',
+}
+
+
+class Wal2JsonDecoder:
+    '''
+    Decoder for `wal2json <https://github.com/eulerto/wal2json>`_ messages,
+    both format version 1 (whole transaction) and 2 (change per message).
+    '''
+
+    plugin = 'wal2json'
+    decode = True
+
+    def __init__(self):
+        self.xid = 0
+
+    def _columns_v1(self, names, values):
+        return dict(zip(names, values))
+
+    def _decode_v1(self, data):
+        for change in data['change']:
+            op = _OPERATIONS.get(change['kind'])
+            if op is None:
+                continue
+            if 'columnnames' in change:
+                row = self._columns_v1(
+                    change['columnnames'], change['columnvalues'])
+            else:
+                row = self._columns_v1(
+                    change['oldkeys']['keynames'],
+                    change['oldkeys']['keyvalues'])
+            yield Change(
+                change['schema'], change['table'], op, row,
+                data.get('xid', 0), None)
+
+    def _decode_v2(self, data):
+        action = data['action']
+        if action == 'B':
+            self.xid = data.get('xid', 0)
+            return
+        op = _OPERATIONS.get(action)
+        if op is None:
+            return
+        columns = data.get('columns') or data.get('identity') or ()
+        yield Change(
+            data['schema'], data['table'], op,
+            {column['name']: column['value'] for column in columns},
+            self.xid, None)
+
+    def __call__(self, payload):
+        data = json.loads(payload)
+        if 'change' in data:
+            return list(self._decode_v1(data))
+        return list(self._decode_v2(data))
+
+
+#: PostgreSQL epoch used by pgoutput timestamps
+_PG_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+_TYPE_CONVERTERS = {
+    16: lambda value: value == 't',     # bool
+    20: int,                            # int8
+    21: int,                            # int2
+    23: int,                            # int4
+    700: float,                         # float4
+    701: float,                         # float8
+    114: json.loads,                    # json
+    3802: json.loads,                   # jsonb
+}
+
+
+class _Reader:
+
+    __slots__ = ('data', 'offset')
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values[0] if len(values) == 1 else values
+
+    def read(self, length):
+        value = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return value
+
+    def string(self):
+        end = self.data.index(b'\0', self.offset)
+        value = self.data[self.offset:end].decode('utf-8')
+        self.offset = end + 1
+        return value
+
+
+class PgOutputDecoder:
+    '''
+    Decoder for the binary protocol (version 1) of the built-in ``pgoutput``
+    plugin.
+    '''
+
+    plugin = 'pgoutput'
+    decode = False
+
+    def __init__(self):
+        self.relations = {}
+        self.xid = 0
+        self.timestamp = None
+
+    def _tuple(self, reader, columns):
+        row = {}
+        for name, type_oid in columns[:reader.unpack('>h')]:
+            kind = reader.read(1)
+            if kind == b'n':
+                row[name] = None
+            elif kind == b't':
+                value = reader.read(reader.unpack('>i')).decode('utf-8')
+                converter = _TYPE_CONVERTERS.get(type_oid)
+                row[name] = value if converter is None else converter(value)
+            # b'u' is unchanged TOASTed value sent without data, the column
+            # is left out of the row
+        return row
+
+    def _relation(self, reader):
+        relation_id = reader.unpack('>I')
+        schema = reader.string()
+        table = reader.string()
+        reader.unpack('>b')
+        columns = []
+        for _ in range(reader.unpack('>h')):
+            reader.unpack('>b')
+            name = reader.string()
+            type_oid, _ = reader.unpack('>Ii')
+            columns.append((name, type_oid))
+        self.relations[relation_id] = (schema, table, columns)
+
+    def __call__(self, payload):
+        reader = _Reader(bytes(payload))
+        kind = reader.read(1)
+        if kind == b'B':
+            _, timestamp, self.xid = reader.unpack('>QqI')
+            self.timestamp = (
+                _PG_EPOCH + datetime.timedelta(microseconds=timestamp)
+            ).timestamp()
+        elif kind == b'R':
+            self._relation(reader)
+        elif kind in (b'I', b'U', b'D'):
+            schema, table, columns = self.relations[reader.unpack('>I')]
+            marker = reader.read(1)
+            row = self._tuple(reader, columns)
+            if kind == b'U' and marker in (b'K', b'O'):
+                reader.read(1)
+                row = self._tuple(reader, columns)
+            return [Change(
+                schema, table, _OPERATIONS[kind.decode()], row,
+                self.xid, self.timestamp)]
+        return []
+
+
+#: Decoders by plugin name
+DECODERS = {
+    'pgoutput': PgOutputDecoder,
+    'wal2json': Wal2JsonDecoder,
+}
+
+
+class ReplicationStream:
+    '''
+    Decoded changes of one replication connection.
+
+    Implements ``get()`` of :meth:`pg_bawler.drivers.Driver.notifies` queue.
+    Position up to which all notifications taken by the listener were
+    processed is confirmed to the server periodically.
+    '''
+
+    def __init__(self, driver, connection, *, loop):
+        self.driver = driver
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.loop = loop
+        self.decoder = DECODERS[driver.plugin]()
+        self.channels = set()
+        self.error = None
+        self.started = False
+        self.processed_lsn = 0
+        self._reading = False
+        self._queue = collections.deque()
+        # notifications taken by listener and not yet processed, in order
+        self._unprocessed = collections.OrderedDict()
+        self._waiter = None
+        self._feedback_handle = None
+
+    async def start(self):
+        options = dict(self.driver.options)
+        if self.driver.plugin == 'pgoutput':
+            options.setdefault('proto_version', '1')
+            options.setdefault('publication_names', self.driver.publication)
+        await self.loop.run_in_executor(None, lambda: (
+            self.cursor.start_replication(
+                slot_name=self.driver.slot_name,
+                start_lsn=self.driver.start_lsn,
+                options=options,
+                decode=self.decoder.decode)))
+        self.started = True
+        self._reading = True
+        self.loop.add_reader(self.connection.fileno(), self._read_messages)
+        self._feedback_handle = self.loop.call_later(
+            self.driver.feedback_interval, self._send_feedback)
+        LOGGER.info(
+            'Started logical replication from slot %s',
+            self.driver.slot_name)
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _fail(self, exc):
+        self.error = exc
+        self.close()
+        self._wakeup()
+
+    def _read_messages(self):
+        try:
+            while True:
+                message = self.cursor.read_message()
+                if message is None:
+                    break
+                self._enqueue(message.data_start, message.payload)
+        except self.driver.errors as exc:
+            self._fail(exc)
+
+    def _enqueue(self, lsn, payload):
+        queued = False
+        for change in self.decoder(payload):
+            channel = self.driver.channel_fmt.format(
+                schema=change.schema, table=change.table)
+            if channel not in self.channels:
+                continue
+            payload = pg_bawler.tracing.wrap_envelope(
+                '{op} {row}'.format(
+                    op=change.op,
+                    row=json.dumps(change.row, default=str)),
+                timestamp=change.timestamp or time.time(),
+                txid=change.xid or 0,
+                origin='{}.{}'.format(change.schema, change.table))
+            self._queue.append(
+                (lsn, pg_bawler.core.Notification(None, channel, payload)))
+            queued = True
+        if queued:
+            self._wakeup()
+        elif not self._queue and not self._unprocessed:
+            # nothing pending, position is processed
+            self.processed_lsn = lsn
+
+    def _send_feedback(self):
+        try:
+            self.cursor.send_feedback(
+                flush_lsn=self.processed_lsn, force=True)
+        except self.driver.errors as exc:
+            self._fail(exc)
+        else:
+            self._feedback_handle = self.loop.call_later(
+                self.driver.feedback_interval, self._send_feedback)
+
+    async def get(self):
+        if not self.started:
+            await self.start()
+        while not self._queue:
+            if self.error is not None:
+                raise self.error
+            self._waiter = self.loop.create_future()
+            await self._waiter
+        lsn, notification = self._queue.popleft()
+        self._unprocessed[id(notification)] = [lsn, notification, False]
+        return notification
+
+    def processed(self, notification):
+        '''
+        Marks ``notification`` as processed and advances processed position
+        past all leading processed notifications.
+        '''
+        entry = self._unprocessed.get(id(notification))
+        if entry is None or entry[1] is not notification:
+            # spooled notification replayed from disk, or taken from
+            # previous connection
+            return
+        entry[2] = True
+        while self._unprocessed:
+            lsn, _, done = next(iter(self._unprocessed.values()))
+            if not done:
+                break
+            self._unprocessed.popitem(last=False)
+            if self._unprocessed:
+                following = next(iter(self._unprocessed.values()))[0]
+            elif self._queue:
+                following = self._queue[0][0]
+            else:
+                following = None
+            # changes decoded from one message share its position
+            if following != lsn:
+                self.processed_lsn = lsn
+
+    def close(self):
+        if self._feedback_handle is not None:
+            self._feedback_handle.cancel()
+            self._feedback_handle = None
+        if self._reading:
+            self._reading = False
+            self.loop.remove_reader(self.connection.fileno())
+        self.connection.close()
+
+
+class LogicalDecodingDriver(pg_bawler.drivers.Driver):
+    '''
+    Driver reading changes from logical replication slot.
+
+    :param slot_name: Name of the replication slot.
+    :param plugin: Output plugin, ``pgoutput`` or ``wal2json``.
+    :param publication: Publication name(s) for ``pgoutput``.
+    :param create_slot: Create the slot if it doesn't exist.
+    :param start_lsn: Position to start from, slot's confirmed position
+        by default.
+    :param feedback_interval: Seconds between position confirmations.
+    :param channel_fmt: Format of notification channel, with ``schema`` and
+        ``table`` keys.
+    :param options: Additional output plugin options.
+    '''
+
+    name = 'logical'
+    uses_notification_queue = False
+    confirms_processed = True
+
+    def __init__(
+        self,
+        *,
+        slot_name='pg_bawler',
+        plugin='pgoutput',
+        publication='pg_bawler',
+        create_slot=True,
+        start_lsn=0,
+        feedback_interval=1,
+        channel_fmt='{table}',
+        options=None
+    ):
+        import psycopg2
+        import psycopg2.extras
+        self.psycopg2 = psycopg2
+        self.connection_factory = (
+            psycopg2.extras.LogicalReplicationConnection)
+        if plugin not in DECODERS:
+            raise pg_bawler.drivers.PgBawlerDriverError(
+                'Unsupported output plugin {!r}'.format(plugin))
+        self.errors = (psycopg2.Error, )
+        self.connection_errors = (
+            psycopg2.InterfaceError,
+            psycopg2.OperationalError,
+        )
+        self.slot_name = slot_name
+        self.plugin = plugin
+        self.publication = publication
+        self.create_slot = create_slot
+        self.start_lsn = start_lsn
+        self.feedback_interval = feedback_interval
+        self.channel_fmt = channel_fmt
+        self.options = options or {}
+        self._streams = {}
+
+    async def create_pool(self, connection_params, *, loop=None):
+        # replication connections are not pooled
+        return {
+            'connection_params': connection_params,
+            'loop': loop or asyncio.get_running_loop(),
+        }
+
+    def _connect(self, connection_params):
+        connection = self.psycopg2.connect(
+            connection_factory=self.connection_factory, **connection_params)
+        if self.create_slot:
+            try:
+                connection.cursor().create_replication_slot(
+                    self.slot_name, output_plugin=self.plugin)
+            except self.psycopg2.ProgrammingError:
+                LOGGER.debug('Replication slot %s exists', self.slot_name)
+        return connection
+
+    async def acquire(self, pool):
+        connection = await pool['loop'].run_in_executor(
+            None, self._connect, pool['connection_params'])
+        self._streams[connection] = ReplicationStream(
+            self, connection, loop=pool['loop'])
+        return connection
+
+    async def release(self, pool, connection):
+        self._streams.pop(connection).close()
+
+    def close(self, connection):
+        self._streams[connection].close()
+
+    async def execute(self, connection, statement):
+        raise pg_bawler.core.PgBawlerException(
+            'Statements can\'t be executed on replication connection')
+
+    async def fetchone(self, connection, statement):
+        # used as health check only
+        stream = self._streams[connection]
+        if stream.error is not None:
+            raise stream.error
+        if connection.closed:
+            raise self.psycopg2.InterfaceError('connection already closed')
+        return (1, )
+
+    async def listen(self, connection, channel, statement=None):
+        self._streams[connection].channels.add(channel)
+
+    async def unlisten(self, connection, channel):
+        self._streams[connection].channels.discard(channel)
+
+    def processed(self, connection, notification):
+        stream = self._streams.get(connection)
+        if stream is not None:
+            stream.processed(notification)
+
+    def notifies(self, connection):
+        return self._streams[connection]
@@ -0,0 +1,401 @@
+'''
+================
+pg_bawler.memory
+================
+
+In-memory stand-in for PostgreSQL ``LISTEN`` / ``NOTIFY``.
+
+:class:`MemoryDriver` plugs into :class:`pg_bawler.core.BawlerBase` in place
+of a real database driver, so handler stacks can be load-tested without
+running PostgreSQL::
+
+    server = MemoryServer(latency=0.001, failure_rate=0.0001)
+    connection_params = {'server': server}
+    listener = NotificationListener(connection_params, driver='memory')
+    sender = NotificationSender(connection_params, driver='memory')
+
+Instead of ``server``, ``connection_params`` may name a shared server with
+``dbname`` (see :func:`get_server`), which also works from bawlerd
+configuration.
+
+Supported statements are ``LISTEN``, ``UNLISTEN``, plain
+``SELECT pg_notify('channel', 'payload')`` as sent by
+:class:`pg_bawler.sender.SenderMixin`, ``SELECT 1`` health checks and
+``SELECT pg_notification_queue_usage()`` returning
+:attr:`MemoryServer.queue_usage`, ``SELECT row_to_json(t)::text FROM
+table t`` (optionally with keys selected by
+:class:`pg_bawler.replica.TableReplica`) returning rows of
+:attr:`MemoryServer.tables` and two part key advisory locks used by
+:class:`pg_bawler.groups.AdvisoryLockGroup`.
+
+Like ``aiopg``, connection raises ``RuntimeError`` when a statement is
+executed while another one is running on it.
+
+Faults may be injected randomly (``failure_rate``, ``timeout_rate``) or on
+demand with :meth:`MemoryServer.drop_connections`, :meth:`MemoryServer.stop`
+and :meth:`MemoryServer.start`.
+'''
+import asyncio
+import collections
+import itertools
+import json
+import random
+import re
+
+import pg_bawler.core
+import pg_bawler.drivers
+
+_NOTIFY_RE = re.compile(
+    r'^\s*SELECT\s+pg_notify\(\s*\'(?P<channel>[^\']*)\'\s*,'
+    r'\s*\'(?P<payload>.*)\'\s*\)\s*;?\s*$',
+    re.DOTALL | re.IGNORECASE)
+_LISTEN_RE = re.compile(
+    r'^\s*(?P<command>LISTEN|UNLISTEN)\s+(?P<channel>\S+?)\s*;?\s*$',
+    re.IGNORECASE)
+_SELECT_ONE_RE = re.compile(r'^\s*SELECT\s+1\s*;?\s*$', re.IGNORECASE)
+_SELECT_JSON_RE = re.compile(
+    r'^\s*SELECT\s+row_to_json\((?P<alias>\w+)\)::text\s+FROM\s+'
+    r'(?P<table>[\w."]+)\s+(?P=alias)(?:\s+WHERE\s+\((?P<columns>[^)]*)\)'
+    r'\s+IN\s+\(SELECT\s+(?P=columns)\s+FROM\s+json_populate_recordset\('
+    r'NULL::(?P=table),\s*\'(?P<keys>.*)\'\)\))?\s*;?\s*$',
+    re.DOTALL | re.IGNORECASE)
+_ADVISORY_LOCK_RE = re.compile(
+    r'^\s*SELECT\s+(?P<function>pg_try_advisory_lock|pg_advisory_unlock|'
+    r'pg_advisory_lock_shared|pg_advisory_unlock_shared)\(\s*'
+    r'(?P<key1>-?\d+)\s*,\s*(?P<key2>-?\d+)\s*\)\s*;?\s*$',
+    re.IGNORECASE)
+_ADVISORY_HOLDERS_RE = re.compile(
+    r'^\s*SELECT\s+count\(\*\)\s+FROM\s+pg_locks\s+WHERE\s+'
+    r'locktype\s*=\s*\'advisory\'\s+AND\s+classid\s*=\s*(?P<key1>\d+)'
+    r'\s+AND\s+objid\s*=\s*(?P<key2>\d+)\s+AND\s+objsubid\s*=\s*2'
+    r'\s+AND\s+granted\s*;?\s*$',
+    re.IGNORECASE)
+_QUEUE_USAGE_RE = re.compile(
+    r'^\s*SELECT\s+pg_notification_queue_usage\(\s*\)\s*;?\s*$',
+    re.IGNORECASE)
+
+
+class PgBawlerMemoryError(pg_bawler.core.PgBawlerException):
+    '''
+    Base class for failures of the in-memory server.
+    '''
+
+
+class PgBawlerMemoryConnectionError(PgBawlerMemoryError):
+    '''
+    Connection to the in-memory server is lost or can't be established.
+    '''
+
+
+class PgBawlerMemoryTimeoutError(PgBawlerMemoryError):
+    '''
+    Statement timed out.
+    '''
+
+
+class PgBawlerMemoryStatementError(PgBawlerMemoryError):
+    '''
+    Statement is not supported by the in-memory server.
+    '''
+
+
+MemoryNotifies = pg_bawler.drivers.NotifiesQueue
+
+
+class MemoryConnection:
+
+    def __init__(self, server, pid):
+        self.server = server
+        self.pid = pid
+        self.channels = set()
+        self.notifies = MemoryNotifies()
+        self.closed = False
+        self._busy = False
+
+    def _check(self):
+        if self.closed:
+            raise PgBawlerMemoryConnectionError('connection already closed')
+
+    async def _start_statement(self):
+        # the same as aiopg, statements can't run concurrently
+        if self._busy:
+            raise RuntimeError(
+                'execute() called while another coroutine is already'
+                ' waiting for incoming data')
+        self._check()
+        self._busy = True
+        try:
+            await self.server._roundtrip(self)
+        finally:
+            self._busy = False
+        self._check()
+
+    def break_connection(self):
+        if not self.closed:
+            self.close()
+            self.notifies.put_nowait(
+                PgBawlerMemoryConnectionError('server closed the connection'))
+
+    def close(self):
+        self.closed = True
+        self.server._disconnect(self)
+
+    async def fetchall(self, statement):
+        await self._start_statement()
+        match = _SELECT_JSON_RE.match(statement)
+        if match is None:
+            raise PgBawlerMemoryStatementError(
+                'Unsupported statement: {}'.format(statement))
+        rows = self.server.tables.get(match.group('table').strip('"'), ())
+        if match.group('keys') is not None:
+            columns = [
+                column.strip()
+                for column in match.group('columns').split(',')
+            ]
+            keys = {
+                tuple(key.get(column) for column in columns)
+                for key in json.loads(
+                    match.group('keys').replace('\'\'', '\''))
+            }
+            rows = [
+                row for row in rows
+                if tuple(row.get(column) for column in columns) in keys
+            ]
+        return [(json.dumps(row), ) for row in rows]
+
+    async def execute(self, statement):
+        '''
+        Executes ``statement`` and returns result row or ``None``.
+        '''
+        await self._start_statement()
+        if _SELECT_ONE_RE.match(statement):
+            return (1, )
+        if _QUEUE_USAGE_RE.match(statement):
+            return (self.server.queue_usage, )
+        match = _NOTIFY_RE.match(statement)
+        if match is not None:
+            self.server.notify(
+                match.group('channel'),
+                match.group('payload').replace('\'\'', '\''),
+                pid=self.pid)
+            return ('', )
+        match = _ADVISORY_LOCK_RE.match(statement)
+        if match is not None:
+            return (self.server._advisory_lock(
+                self, match.group('function').lower(),
+                (int(match.group('key1')), int(match.group('key2')))), )
+        match = _ADVISORY_HOLDERS_RE.match(statement)
+        if match is not None:
+            key = (int(match.group('key1')), int(match.group('key2')))
+            return (
+                len(self.server.shared_advisory_locks.get(key, ())) +
+                (key in self.server.advisory_locks), )
+        match = _LISTEN_RE.match(statement)
+        if match is not None:
+            channel = match.group('channel').strip('"')
+            if match.group('command').upper() == 'LISTEN':
+                self.server._listen(self, channel)
+            else:
+                self.server._unlisten(self, channel)
+            return None
+        raise PgBawlerMemoryStatementError(
+            'Unsupported statement: {}'.format(statement))
+
+
+class MemoryServer:
+    '''
+    In-memory server routing notifications between its connections.
+
+    :param latency: Seconds each statement round trip and notification
+        delivery takes.
+    :param failure_rate: Probability of statement dropping its connection.
+    :param timeout_rate: Probability of statement hanging for
+        ``statement_timeout`` seconds and failing with
+        :class:`PgBawlerMemoryTimeoutError`.
+    :param statement_timeout: Seconds timed out statements hang.
+    :param seed: Seed of random generator used for fault injection.
+    '''
+
+    def __init__(
+        self,
+        *,
+        latency=0,
+        failure_rate=0,
+        timeout_rate=0,
+        statement_timeout=1,
+        seed=None
+    ):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.statement_timeout = statement_timeout
+        self.random = random.Random(seed)
+        self.is_running = True
+        self.connections = set()
+        self.listeners = collections.defaultdict(set)
+        self.notifications_sent = 0
+        #: Returned by ``pg_notification_queue_usage()``, set it to simulate
+        #: slow consumers
+        self.queue_usage = 0.0
+        #: Rows (dictionaries) of tables by name
+        self.tables = {}
+        #: Connections holding exclusive advisory locks by two part keys
+        self.advisory_locks = {}
+        #: Connections holding shared advisory locks by two part keys
+        self.shared_advisory_locks = collections.defaultdict(set)
+        self._pids = itertools.count(1)
+
+    def connect(self):
+        if not self.is_running:
+            raise PgBawlerMemoryConnectionError('could not connect to server')
+        connection = MemoryConnection(self, next(self._pids))
+        self.connections.add(connection)
+        return connection
+
+    def _disconnect(self, connection):
+        self.connections.discard(connection)
+        for key, holder in list(self.advisory_locks.items()):
+            if holder is connection:
+                del self.advisory_locks[key]
+        for holders in self.shared_advisory_locks.values():
+            holders.discard(connection)
+        for channel in connection.channels:
+            self.listeners[channel].discard(connection)
+        connection.channels.clear()
+
+    def _listen(self, connection, channel):
+        connection.channels.add(channel)
+        self.listeners[channel].add(connection)
+
+    def _advisory_lock(self, connection, function, key):
+        # shared locks never conflict with exclusive ones, only used for
+        # group membership
+        if function == 'pg_try_advisory_lock':
+            holder = self.advisory_locks.setdefault(key, connection)
+            return holder is connection
+        if function == 'pg_advisory_unlock':
+            if self.advisory_locks.get(key) is not connection:
+                return False
+            del self.advisory_locks[key]
+            return True
+        holders = self.shared_advisory_locks[key]
+        if function == 'pg_advisory_lock_shared':
+            holders.add(connection)
+            return ''
+        if connection not in holders:
+            return False
+        holders.discard(connection)
+        return True
+
+    def _unlisten(self, connection, channel):
+        if channel == '*':
+            for channel in list(connection.channels):
+                self._unlisten(connection, channel)
+        else:
+            connection.channels.discard(channel)
+            self.listeners[channel].discard(connection)
+
+    async def _roundtrip(self, connection):
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            connection.break_connection()
+        elif self.timeout_rate and self.random.random() < self.timeout_rate:
+            await asyncio.sleep(self.statement_timeout)
+            raise PgBawlerMemoryTimeoutError(
+                'canceling statement due to statement timeout')
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+
+    def notify(self, channel, payload, *, pid=0):
+        '''
+        Delivers notification to all connections listening on ``channel``.
+        '''
+        self.notifications_sent += 1
+        notification = pg_bawler.core.Notification(pid, channel, payload)
+        for connection in self.listeners.get(channel, ()):
+            if self.latency:
+                asyncio.get_event_loop().call_later(
+                    self.latency, connection.notifies.put_nowait,
+                    notification)
+            else:
+                connection.notifies.put_nowait(notification)
+
+    def drop_connections(self):
+        '''
+        Simulates server terminating all connections.
+        '''
+        for connection in list(self.connections):
+            connection.break_connection()
+
+    def stop(self):
+        '''
+        Simulates server shutdown, new connections are refused until
+        :meth:`start`.
+        '''
+        self.is_running = False
+        self.drop_connections()
+
+    def start(self):
+        self.is_running = True
+
+
+#: Servers shared by name
+SERVERS = {}
+
+
+def get_server(name='default'):
+    '''
+    Returns shared :class:`MemoryServer` named ``name``.
+    '''
+    if name not in SERVERS:
+        SERVERS[name] = MemoryServer()
+    return SERVERS[name]
+
+
+class MemoryDriver(pg_bawler.drivers.Driver):
+    '''
+    Driver using :class:`MemoryServer` given as ``server`` in connection
+    params or shared server named by ``dbname``.
+    '''
+
+    name = 'memory'
+    errors = (PgBawlerMemoryError, )
+    # statement timeout is handled as lost connection, as psycopg2's
+    # QueryCanceledError is OperationalError
+    connection_errors = (
+        PgBawlerMemoryConnectionError,
+        PgBawlerMemoryTimeoutError,
+    )
+
+    async def create_pool(self, connection_params, *, loop=None):
+        connection_params = connection_params or {}
+        if 'server' in connection_params:
+            return connection_params['server']
+        return get_server(connection_params.get('dbname', 'default'))
+
+    async def acquire(self, pool):
+        return pool.connect()
+
+    async def release(self, pool, connection):
+        connection.close()
+
+    def close(self, connection):
+        connection.close()
+
+    async def execute(self, connection, statement):
+        await connection.execute(statement)
+
+    async def fetchone(self, connection, statement):
+        return await connection.execute(statement)
+
+    async def fetchall(self, connection, statement):
+        return await connection.fetchall(statement)
+
+    async def listen(self, connection, channel, statement=None):
+        await connection.execute(
+            statement or 'LISTEN {channel}'.format(channel=channel))
+
+    async def unlisten(self, connection, channel):
+        await connection.execute('UNLISTEN {channel}'.format(channel=channel))
+
+    def notifies(self, connection):
+        return connection.notifies
@@ -0,0 +1,156 @@
+'''
+=================
+pg_bawler.metrics
+=================
+
+Lightweight in-process metrics used by ``pg_bawler`` components.
+
+Metrics are kept in a :class:`MetricsRegistry`. Components publish into the
+module level :data:`REGISTRY` unless told otherwise and anybody interested
+(logging, exporter, bawlerd) can read the current state using
+:meth:`MetricsRegistry.snapshot`.
+'''
+import bisect
+import math
+
+#: Default histogram bucket upper bounds (in seconds)
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'),
+)
+
+
+def percentile(values, percent):
+    '''
+    Returns ``percent`` percentile of ``values`` (nearest rank) or ``None``
+    for no values.
+    '''
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Counter:
+    '''
+    Monotonically increasing value.
+    '''
+
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return {'type': 'counter', 'value': self.value}
+
+
+class Gauge:
+    '''
+    Value which may go up and down.
+    '''
+
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return {'type': 'gauge', 'value': self.value}
+
+
+class Histogram:
+    '''
+    Fixed buckets histogram.
+
+    Observing a value costs one bisect and two additions, so it's cheap enough
+    to be used on the notification hot path.
+    '''
+
+    __slots__ = ('name', 'buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, name, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != float('inf'):
+            self.buckets += (float('inf'), )
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percent):
+        '''
+        Returns upper bound of the bucket containing ``percent`` percentile
+        or ``None`` if nothing was observed yet.
+        '''
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+    def snapshot(self):
+        return {
+            'type': 'histogram',
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': [
+                ['+Inf' if math.isinf(bound) else bound, count]
+                for bound, count in zip(self.buckets, self.counts)
+            ],
+        }
+
+
+class MetricsRegistry:
+    '''
+    Named collection of metrics.
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get_or_create(self, metric_class, name, *args, **kwargs):
+        if name not in self.metrics:
+            self.metrics[name] = metric_class(name, *args, **kwargs)
+        metric = self.metrics[name]
+        if not isinstance(metric, metric_class):
+            raise TypeError(
+                'Metric {name} is already registered as {type}'.format(
+                    name=name, type=type(metric).__name__))
+        return metric
+
+    def counter(self, name):
+        return self._get_or_create(Counter, name)
+
+    def gauge(self, name):
+        return self._get_or_create(Gauge, name)
+
+    def histogram(self, name, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, buckets)
+
+    def snapshot(self):
+        return {
+            name: metric.snapshot()
+            for name, metric in sorted(self.metrics.items())
+        }
+
+
+#: Default registry
+REGISTRY = MetricsRegistry()
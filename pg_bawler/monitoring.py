@@ -0,0 +1,210 @@
+'''
+====================
+pg_bawler.monitoring
+====================
+
+Early warning for listeners falling behind.
+
+PostgreSQL keeps notifications not yet consumed by all listening sessions in
+a shared queue (8GB by default). Once it is full, every transaction executing
+``NOTIFY`` fails. :class:`NotificationQueueMonitor` periodically polls
+``pg_notification_queue_usage()``, compares rate of incoming handler work
+with rate of finished handlers and raises alerts before the queue fills up::
+
+    monitor = NotificationQueueMonitor(listener, interval=10)
+    monitor.add_alert_callback(page_somebody)
+    listener.queue_monitor = monitor
+    await listener.listen()
+
+PostgreSQL older than 9.5 doesn't have ``pg_notification_queue_usage()``,
+only handler rates are monitored there.
+
+Measurements are exported as gauges into :data:`pg_bawler.metrics.REGISTRY`
+(or the given registry):
+
+* ``<prefix>.notification_queue_usage`` - fraction of the queue in use
+* ``<prefix>.ingest_rate`` - handler tasks created per second
+* ``<prefix>.completion_rate`` - handler tasks finished per second
+* ``<prefix>.pending_handlers`` - handler tasks not finished yet
+
+Alert level is one of :data:`LEVELS`. Alert callbacks are called with the
+monitor and :class:`QueueStatus` whenever level changes, they may be
+coroutines and may e.g. engage load shedding. Current level is also available
+as :attr:`NotificationQueueMonitor.level`.
+'''
+import asyncio
+import collections
+import inspect
+import logging
+import time
+
+import pg_bawler.metrics
+
+LOGGER = logging.getLogger('pg_bawler.monitoring')
+
+#: Alert levels, from the least severe
+LEVELS = ('ok', 'warning', 'critical')
+
+QueueStatus = collections.namedtuple('QueueStatus', (
+    'usage',
+    'ingest_rate',
+    'completion_rate',
+    'pending_handlers',
+    'slow_consumer',
+    'level',
+))
+
+
+def log_alert(monitor, status):
+    '''
+    Default alert callback, logs level changes.
+    '''
+    log = {
+        'ok': LOGGER.info,
+        'warning': LOGGER.warning,
+        'critical': LOGGER.error,
+    }[status.level]
+    log(
+        'Notification queue %s: usage %.1f%%, ingest %.1f/s,'
+        ' completion %.1f/s, %s pending handlers%s',
+        status.level, (status.usage or 0) * 100, status.ingest_rate,
+        status.completion_rate, status.pending_handlers,
+        ', slow consumer' if status.slow_consumer else '')
+
+
+class NotificationQueueMonitor:
+    '''
+    Polls notification queue usage of ``listener``'s server.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param interval: Seconds between polls.
+    :param warning_threshold: Queue usage (``0`` - ``1``) raising warning.
+    :param critical_threshold: Queue usage raising critical alert.
+    :param slow_consumer_ratio: Listener is slow consumer when ingest rate
+        exceeds completion rate this many times while pending handlers
+        grow. Slow consumer raises at least warning.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry`, defaults to
+        :data:`pg_bawler.metrics.REGISTRY`.
+    :param prefix: Prefix of exported metric names.
+    '''
+
+    def __init__(
+        self,
+        listener,
+        *,
+        interval=10,
+        warning_threshold=0.5,
+        critical_threshold=0.8,
+        slow_consumer_ratio=1.2,
+        registry=None,
+        prefix='pg_bawler'
+    ):
+        self.listener = listener
+        self.interval = interval
+        self.warning_threshold = warning_threshold
+        self.critical_threshold = critical_threshold
+        self.slow_consumer_ratio = slow_consumer_ratio
+        registry = registry or pg_bawler.metrics.REGISTRY
+        self.usage_gauge = registry.gauge(
+            '{}.notification_queue_usage'.format(prefix))
+        self.ingest_gauge = registry.gauge('{}.ingest_rate'.format(prefix))
+        self.completion_gauge = registry.gauge(
+            '{}.completion_rate'.format(prefix))
+        self.pending_gauge = registry.gauge(
+            '{}.pending_handlers'.format(prefix))
+        self.alert_callbacks = [log_alert]
+        self.level = 'ok'
+        self.status = None
+        self._last = None
+        self._usage_supported = True
+
+    def add_alert_callback(self, callback):
+        '''
+        Adds ``callback`` called with monitor and :class:`QueueStatus` when
+        alert level changes.
+        '''
+        self.alert_callbacks.append(callback)
+
+    def remove_alert_callback(self, callback):
+        self.alert_callbacks.remove(callback)
+
+    async def fetch_usage(self):
+        '''
+        Returns ``pg_notification_queue_usage()`` or ``None`` when listener's
+        driver doesn't use the notification queue or server doesn't have
+        the function (PostgreSQL < 9.5).
+        '''
+        driver = self.listener.driver
+        if not driver.uses_notification_queue or not self._usage_supported:
+            return None
+        try:
+            row = await self.listener.pg_fetchone(
+                'SELECT pg_notification_queue_usage()')
+        except driver.connection_errors:
+            raise
+        except driver.errors:
+            self._usage_supported = False
+            LOGGER.warning(
+                'Server doesn\'t provide pg_notification_queue_usage(),'
+                ' monitoring only handler rates', exc_info=True)
+            return None
+        return float(row[0])
+
+    def get_level(self, usage, slow_consumer):
+        if usage is not None and usage >= self.critical_threshold:
+            return 'critical'
+        if slow_consumer or (
+            usage is not None and usage >= self.warning_threshold
+        ):
+            return 'warning'
+        return 'ok'
+
+    async def poll(self):
+        '''
+        Takes one measurement, updates gauges and calls alert callbacks if
+        level changed.
+
+        :returns: :class:`QueueStatus`
+        '''
+        usage = await self.fetch_usage()
+        now = time.monotonic()
+        started = self.listener.handlers_started
+        completed = self.listener.handlers_completed
+        pending = started - completed
+        ingest_rate = completion_rate = 0.0
+        slow_consumer = False
+        if self._last is not None:
+            last_time, last_started, last_completed, last_pending = self._last
+            elapsed = max(now - last_time, 1e-9)
+            ingest_rate = (started - last_started) / elapsed
+            completion_rate = (completed - last_completed) / elapsed
+            slow_consumer = pending > last_pending and (
+                ingest_rate > completion_rate * self.slow_consumer_ratio)
+        self._last = (now, started, completed, pending)
+        status = QueueStatus(
+            usage, ingest_rate, completion_rate, pending, slow_consumer,
+            self.get_level(usage, slow_consumer))
+        self.usage_gauge.set(usage)
+        self.ingest_gauge.set(ingest_rate)
+        self.completion_gauge.set(completion_rate)
+        self.pending_gauge.set(pending)
+        self.status = status
+        if status.level != self.level:
+            self.level = status.level
+            for callback in self.alert_callbacks:
+                result = callback(self, status)
+                if inspect.isawaitable(result):
+                    await result
+        return status
+
+    async def run(self):
+        '''
+        Polls every ``interval`` seconds until listener stops.
+        '''
+        while not self.listener.is_stopped:
+            try:
+                await self.poll()
+            except Exception:
+                # keep monitoring, listener reconnects on connection errors
+                LOGGER.exception('Failed to poll notification queue usage')
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,215 @@
+'''
+===================
+pg_bawler.recording
+===================
+
+Record notification streams to a compact append-only file and replay them.
+
+Record every notification received by a listener (before dispatch, with
+tracing envelope intact) using a tap::
+
+    recorder = NotificationRecorder('/var/tmp/stream.bawler')
+    listener.add_notification_tap(recorder)
+
+or record only some channels by registering recorder as handler::
+
+    listener.register_handler('foo', recorder.handle_notification)
+
+Replay recorded stream into listener's handlers, in real time, scaled or at
+maximum speed::
+
+    replayer = NotificationReplayer('/var/tmp/stream.bawler')
+    await replayer.replay(listener, speed=10)
+    await replayer.replay(listener, speed=None)
+
+File starts with :data:`MAGIC`, every record is length-prefixed::
+
+    <I length> <d timestamp> <i pid> <H channel length> channel payload
+'''
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+import pg_bawler.core
+
+#: File header
+MAGIC = b'PGBAWLR1'
+
+_LENGTH = struct.Struct('<I')
+_HEADER = struct.Struct('<diH')
+
+
+class PgBawlerRecordingError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised for files which are not pg_bawler recordings.
+    '''
+
+
+def pack_record(timestamp, notification):
+    channel = notification.channel.encode('utf-8')
+    payload = notification.payload.encode('utf-8')
+    pid = -1 if notification.pid is None else notification.pid
+    body_length = _HEADER.size + len(channel) + len(payload)
+    return b''.join((
+        _LENGTH.pack(body_length),
+        _HEADER.pack(timestamp, pid, len(channel)),
+        channel,
+        payload,
+    ))
+
+
+def iter_records(data, offset=0):
+    '''
+    Yields ``(timestamp, notification, end offset)`` of records from ``data``
+    (bytes-like) starting at ``offset``. Stops at truncated record.
+    '''
+    end = len(data)
+    while offset + _LENGTH.size <= end:
+        body_length, = _LENGTH.unpack_from(data, offset)
+        body_start = offset + _LENGTH.size
+        body_end = body_start + body_length
+        if body_length < _HEADER.size or body_end > end:
+            return
+        timestamp, pid, channel_length = _HEADER.unpack_from(data, body_start)
+        channel_end = body_start + _HEADER.size + channel_length
+        notification = pg_bawler.core.Notification(
+            None if pid == -1 else pid,
+            bytes(data[body_start + _HEADER.size:channel_end]).decode(
+                'utf-8'),
+            bytes(data[channel_end:body_end]).decode('utf-8'))
+        yield timestamp, notification, body_end
+        offset = body_end
+
+
+class NotificationRecorder:
+    '''
+    Appends notifications to a recording file with buffered writes.
+
+    :param path: Recording file, appended if exists.
+    :param buffer_size: Size of write buffer in bytes.
+    :param flush_interval: Maximal number of seconds records stay in buffer,
+        flushed by timer when recording from running event loop.
+    '''
+
+    def __init__(self, path, *, buffer_size=64 * 1024, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._file = open(path, 'ab', buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._last_flush = time.monotonic()
+        self._flush_handle = None
+
+    def __call__(self, notification):
+        self.record(notification)
+
+    async def handle_notification(self, notification, listener):
+        self.record(getattr(notification, 'notification', notification))
+
+    def record(self, notification, timestamp=None):
+        self._file.write(pack_record(
+            time.time() if timestamp is None else timestamp, notification))
+        self.count += 1
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        elif self._flush_handle is None:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # recording outside of event loop, flushed by the next record
+            # or close()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def _cancel_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    def flush(self):
+        self._cancel_flush()
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self._cancel_flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class NotificationReplayer:
+    '''
+    Reads recording file through ``mmap`` and feeds notifications into
+    listener's dispatch.
+    '''
+
+    #: Yield to the event loop after this many notifications at max speed
+    yield_every = 100
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        '''
+        Yields ``(timestamp, notification)`` tuples.
+        '''
+        with open(self.path, 'rb') as recording:
+            if os.fstat(recording.fileno()).st_size <= len(MAGIC):
+                if recording.read(len(MAGIC)) not in (MAGIC, b''):
+                    raise PgBawlerRecordingError(
+                        '{} is not a recording'.format(self.path))
+                return
+            data = mmap.mmap(recording.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if data[:len(MAGIC)] != MAGIC:
+                    raise PgBawlerRecordingError(
+                        '{} is not a recording'.format(self.path))
+                for timestamp, notification, _ in iter_records(
+                    data, len(MAGIC)
+                ):
+                    yield timestamp, notification
+            finally:
+                data.close()
+
+    async def replay(self, listener, *, speed=1.0, channels=None):
+        '''
+        Replays recording into ``listener``.
+
+        :param speed: ``1`` for real time, ``N`` for N times faster, ``None``
+            for maximum speed.
+        :param channels: Replay only given channels, by default all channels
+            registered in ``listener``.
+        :returns: Number of replayed notifications.
+        '''
+        channels = listener.registered_channels if channels is None else (
+            channels)
+        loop = asyncio.get_event_loop()
+        replayed = 0
+        first_timestamp = started = None
+        for timestamp, notification in self:
+            if notification.channel not in channels:
+                continue
+            if speed:
+                if first_timestamp is None:
+                    first_timestamp, started = timestamp, loop.time()
+                delay = (
+                    started + (timestamp - first_timestamp) / speed -
+                    loop.time())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif replayed % self.yield_every == 0:
+                await asyncio.sleep(0)
+            listener._dispatch(notification)
+            replayed += 1
+        return replayed
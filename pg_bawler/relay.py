@@ -0,0 +1,431 @@
+'''
+===============
+pg_bawler.relay
+===============
+
+Local fan-out of notifications over a Unix domain socket.
+
+Every process listening on PostgreSQL holds its own connection and its own
+``LISTEN`` registrations. :class:`RelayServer` lets one listener (usually
+bawlerd) keep the only database connection and rebroadcast notifications to
+any number of local processes::
+
+    listener.relay = RelayServer(listener, '/run/pg_bawler/clients.sock')
+    await listener.listen()
+
+Local processes use :class:`RelayListener` (or any listener with ``relay``
+driver), which behaves as ordinary
+:class:`pg_bawler.listener.NotificationListener`::
+
+    listener = RelayListener('/run/pg_bawler/clients.sock')
+    listener.register_handler('clients', handler)
+    await listener.register_channel('clients')
+    await listener.listen()
+
+Each subscriber receives only channels it listens on. Relay listens on a
+channel upstream when the first subscriber asks for it and stops when the
+last one leaves, channels registered on the relay's listener by other means
+stay untouched. Notifications are relayed as received, with tracing envelope
+intact.
+
+Subscribers which don't keep up must not slow down the others, so every
+subscriber has ``max_buffer`` bytes of outgoing buffer and notifications not
+fitting into it are dropped for that subscriber. Dropped notifications are
+counted in ``<prefix>.relay.dropped`` counter, relayed ones in
+``<prefix>.relay.sent`` and connected subscribers in
+``<prefix>.relay.subscribers`` gauge.
+
+Every frame is length-prefixed and typed::
+
+    <I body length> <B type> body
+
+Notification frame (:data:`NOTIFICATION`) body is::
+
+    <i pid> <H channel length> channel payload
+
+Subscriber sends :data:`LISTEN` / :data:`UNLISTEN` frames with channel as
+body and :data:`PING` frames with empty body, relay answers every one of them
+in order with :data:`OK` or :data:`ERROR` frame with error message as body.
+
+When relay's listener reconnects to the database, notifications sent
+meanwhile are lost for subscribers too. Relay sends :data:`RECONNECT` frame
+with empty body to every subscriber and their listeners run reconnect
+callbacks (see
+:meth:`pg_bawler.listener.ListenerMixin.add_reconnect_callback`).
+'''
+import asyncio
+import collections
+import logging
+import os
+import stat
+import struct
+
+import pg_bawler.core
+import pg_bawler.drivers
+import pg_bawler.listener
+import pg_bawler.metrics
+
+LOGGER = logging.getLogger('pg_bawler.relay')
+
+#: Frame types
+NOTIFICATION = ord('N')
+LISTEN = ord('L')
+UNLISTEN = ord('U')
+PING = ord('P')
+RECONNECT = ord('R')
+OK = ord('K')
+ERROR = ord('E')
+
+_FRAME = struct.Struct('<IB')
+_NOTIFICATION = struct.Struct('<iH')
+
+
+class PgBawlerRelayError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised when relay rejects request.
+    '''
+
+
+class PgBawlerRelayConnectionError(PgBawlerRelayError):
+    '''
+    Connection to relay is lost.
+    '''
+
+
+def pack_frame(frame_type, body=b''):
+    return _FRAME.pack(len(body), frame_type) + body
+
+
+def pack_notification(notification):
+    channel = notification.channel.encode('utf-8')
+    pid = -1 if notification.pid is None else notification.pid
+    return pack_frame(NOTIFICATION, b''.join((
+        _NOTIFICATION.pack(pid, len(channel)),
+        channel,
+        notification.payload.encode('utf-8'),
+    )))
+
+
+def unpack_notification(body):
+    pid, channel_length = _NOTIFICATION.unpack_from(body)
+    channel_end = _NOTIFICATION.size + channel_length
+    return pg_bawler.core.Notification(
+        pid,
+        body[_NOTIFICATION.size:channel_end].decode('utf-8'),
+        body[channel_end:].decode('utf-8'))
+
+
+async def read_frame(reader):
+    '''
+    Returns ``(type, body)`` of the next frame from ``reader``.
+    '''
+    body_length, frame_type = _FRAME.unpack(
+        await reader.readexactly(_FRAME.size))
+    return frame_type, await reader.readexactly(body_length)
+
+
+class RelaySubscriber:
+    '''
+    One connected subscriber.
+    '''
+
+    __slots__ = ('writer', 'channels', 'dropped')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.channels = set()
+        self.dropped = 0
+
+    def send(self, frame, max_buffer):
+        '''
+        Writes ``frame`` unless it would overflow ``max_buffer`` bytes of
+        outgoing buffer, returns whether it was written.
+        '''
+        transport = self.writer.transport
+        if transport.is_closing() or (
+            transport.get_write_buffer_size() + len(frame) > max_buffer
+        ):
+            return False
+        self.writer.write(frame)
+        return True
+
+
+class RelayServer:
+    '''
+    Relays notifications of ``listener`` to subscribers connected to Unix
+    socket at ``path``.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param path: Path of the socket, stale socket file is replaced.
+    :param max_buffer: Bytes of outgoing buffer per subscriber.
+    :param mode: Permissions of the socket file, ``None`` to keep umask
+        defaults.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry`, defaults to
+        :data:`pg_bawler.metrics.REGISTRY`.
+    :param prefix: Prefix of exported metric names.
+    '''
+
+    def __init__(
+        self,
+        listener,
+        path,
+        *,
+        max_buffer=1024 * 1024,
+        mode=None,
+        registry=None,
+        prefix='pg_bawler'
+    ):
+        self.listener = listener
+        self.path = path
+        self.max_buffer = max_buffer
+        self.mode = mode
+        registry = registry or pg_bawler.metrics.REGISTRY
+        self._sent_counter = registry.counter('{}.relay.sent'.format(prefix))
+        self._dropped_counter = registry.counter(
+            '{}.relay.dropped'.format(prefix))
+        self._subscribers_gauge = registry.gauge(
+            '{}.relay.subscribers'.format(prefix))
+        self.subscribers = set()
+        self._channel_subscribers = collections.defaultdict(set)
+        self._server = None
+
+    async def start(self):
+        '''
+        Starts accepting subscribers and relaying notifications.
+        '''
+        if self._server is not None:
+            return
+        if os.path.exists(self.path) and stat.S_ISSOCK(
+            os.stat(self.path).st_mode
+        ):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._handle_subscriber, path=self.path)
+        if self.mode is not None:
+            os.chmod(self.path, self.mode)
+        self.listener.add_notification_tap(self.publish)
+        self.listener.add_reconnect_callback(self.upstream_reconnected)
+        LOGGER.info('Relaying notifications on %s', self.path)
+
+    def close(self):
+        '''
+        Stops accepting subscribers and disconnects the connected ones.
+        '''
+        if self._server is None:
+            return
+        self.listener.remove_notification_tap(self.publish)
+        self.listener.remove_reconnect_callback(self.upstream_reconnected)
+        self._server.close()
+        self._server = None
+        for subscriber in self.subscribers:
+            subscriber.writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def publish(self, notification):
+        '''
+        Sends ``notification`` to subscribers of its channel.
+        '''
+        subscribers = self._channel_subscribers.get(notification.channel)
+        if not subscribers:
+            return
+        frame = pack_notification(notification)
+        for subscriber in subscribers:
+            if subscriber.send(frame, self.max_buffer):
+                self._sent_counter.inc()
+            else:
+                subscriber.dropped += 1
+                self._dropped_counter.inc()
+
+    def upstream_reconnected(self, listener):
+        '''
+        Tells subscribers that notifications may have been missed.
+        '''
+        frame = pack_frame(RECONNECT)
+        for subscriber in self.subscribers:
+            if not subscriber.send(frame, self.max_buffer):
+                subscriber.dropped += 1
+                self._dropped_counter.inc()
+
+    async def _handle_subscriber(self, reader, writer):
+        subscriber = RelaySubscriber(writer)
+        self.subscribers.add(subscriber)
+        self._subscribers_gauge.set(len(self.subscribers))
+        LOGGER.debug('Subscriber connected to %s', self.path)
+        errors = (PgBawlerRelayError, ) + tuple(self.listener.driver.errors)
+        try:
+            while True:
+                try:
+                    frame_type, body = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                try:
+                    await self._handle_request(subscriber, frame_type, body)
+                except errors as exc:
+                    writer.write(pack_frame(ERROR, str(exc).encode('utf-8')))
+                except Exception as exc:
+                    LOGGER.exception(
+                        'Failed to handle request of subscriber on %s',
+                        self.path)
+                    writer.write(pack_frame(ERROR, str(exc).encode('utf-8')))
+                else:
+                    writer.write(pack_frame(OK))
+        finally:
+            self.subscribers.discard(subscriber)
+            self._subscribers_gauge.set(len(self.subscribers))
+            for channel in list(subscriber.channels):
+                await self._unsubscribe(subscriber, channel)
+            writer.close()
+            if subscriber.dropped:
+                LOGGER.warning(
+                    'Subscriber disconnected from %s,'
+                    ' %s notification(s) dropped for it',
+                    self.path, subscriber.dropped)
+
+    async def _handle_request(self, subscriber, frame_type, body):
+        if frame_type == PING:
+            return
+        channel = body.decode('utf-8')
+        if frame_type == LISTEN:
+            await self._subscribe(subscriber, channel)
+        elif frame_type == UNLISTEN:
+            channels = list(subscriber.channels) if channel == '*' else [
+                channel]
+            for channel in channels:
+                await self._unsubscribe(subscriber, channel)
+        else:
+            raise PgBawlerRelayError(
+                'Unknown frame type {!r}'.format(frame_type))
+
+    def has_subscribers(self, channel):
+        return bool(self._channel_subscribers.get(channel))
+
+    async def _subscribe(self, subscriber, channel):
+        await self.listener.acquire_channel(channel)
+        subscriber.channels.add(channel)
+        self._channel_subscribers[channel].add(subscriber)
+
+    async def _unsubscribe(self, subscriber, channel):
+        subscriber.channels.discard(channel)
+        subscribers = self._channel_subscribers.get(channel)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._channel_subscribers[channel]
+            await self.listener.release_channel(channel)
+
+
+class RelayConnection:
+    '''
+    Subscriber's connection to :class:`RelayServer`.
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.notifies = pg_bawler.drivers.NotifiesQueue()
+        self.closed = False
+        self._replies = collections.deque()
+        self._reader_task = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                frame_type, body = await read_frame(self.reader)
+                if frame_type == NOTIFICATION:
+                    self.notifies.put_nowait(unpack_notification(body))
+                elif frame_type == RECONNECT:
+                    self.notifies.put_nowait(
+                        pg_bawler.drivers.UPSTREAM_RECONNECTED)
+                elif frame_type in (OK, ERROR) and self._replies:
+                    reply = self._replies.popleft()
+                    if reply.done():
+                        continue
+                    if frame_type == OK:
+                        reply.set_result(None)
+                    else:
+                        reply.set_exception(
+                            PgBawlerRelayError(body.decode('utf-8')))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self._lost()
+
+    def _lost(self):
+        if self.closed:
+            return
+        self.closed = True
+        exc = PgBawlerRelayConnectionError('relay closed the connection')
+        self.notifies.put_nowait(exc)
+        while self._replies:
+            reply = self._replies.popleft()
+            if not reply.done():
+                reply.set_exception(exc)
+
+    async def request(self, frame_type, body=b''):
+        '''
+        Sends request frame and waits for relay's answer.
+        '''
+        if self.closed:
+            raise PgBawlerRelayConnectionError('connection already closed')
+        reply = asyncio.get_event_loop().create_future()
+        self._replies.append(reply)
+        self.writer.write(pack_frame(frame_type, body))
+        await reply
+
+    def close(self):
+        self._reader_task.cancel()
+        self.writer.close()
+        self._lost()
+
+
+class RelayDriver(pg_bawler.drivers.Driver):
+    '''
+    Driver connecting to :class:`RelayServer` socket given as ``path`` in
+    connection params. Supports only ``LISTEN``, ``UNLISTEN`` and
+    ``SELECT 1`` health checks.
+    '''
+
+    name = 'relay'
+    errors = (PgBawlerRelayError, OSError)
+    connection_errors = (PgBawlerRelayConnectionError, OSError)
+    uses_notification_queue = False
+
+    async def create_pool(self, connection_params, *, loop=None):
+        return connection_params['path']
+
+    async def acquire(self, pool):
+        return RelayConnection(*await asyncio.open_unix_connection(pool))
+
+    async def release(self, pool, connection):
+        connection.close()
+
+    def close(self, connection):
+        connection.close()
+
+    async def execute(self, connection, statement):
+        await self.fetchone(connection, statement)
+
+    async def fetchone(self, connection, statement):
+        if statement.strip().rstrip(';').upper() != 'SELECT 1':
+            raise PgBawlerRelayError(
+                'Unsupported statement: {}'.format(statement))
+        await connection.request(PING)
+        return (1, )
+
+    async def listen(self, connection, channel, statement=None):
+        await connection.request(LISTEN, channel.encode('utf-8'))
+
+    async def unlisten(self, connection, channel):
+        await connection.request(UNLISTEN, channel.encode('utf-8'))
+
+    def notifies(self, connection):
+        return connection.notifies
+
+
+class RelayListener(pg_bawler.listener.NotificationListener):
+    '''
+    Listener receiving notifications from :class:`RelayServer` at ``path``.
+    '''
+
+    def __init__(self, path, *, loop=None):
+        super().__init__({'path': path}, loop=loop, driver='relay')
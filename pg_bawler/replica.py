@@ -0,0 +1,331 @@
+'''
+=================
+pg_bawler.replica
+=================
+
+In-memory replica of a table kept up to date by change notifications.
+
+Replica loads the whole table once and then applies ``INSERT``, ``UPDATE``,
+``DELETE`` and ``TRUNCATE`` notifications produced by triggers from
+``pg_bawler.gen_sql``. Lookups by primary key or by declared secondary
+indexes are dictionary lookups without database round trips::
+
+    countries = TableReplica(
+        'countries', key_columns=('code', ), indexes=('name', ))
+    await countries.attach(listener)
+
+    countries.get('SK')
+    countries.lookup('name', 'Slovakia')
+
+Snapshot is taken with ``COPY`` when driver supports it (asyncpg), otherwise
+with ``SELECT`` (aiopg). Rows are selected as ``row_to_json`` so they have the
+same types as rows in notifications. Notifications received while snapshot
+is loading are applied after it. Replica takes a new snapshot whenever
+listener reconnects, because notifications sent meanwhile are lost. Failed
+snapshot is retried every ``reconnect_interval`` of the listener until it
+succeeds or listener stops.
+
+Aggregated ``TRANSACTION`` notifications of ``gen_sql --per-transaction``
+triggers carry only keys (``--key-column`` has to match ``key_columns``).
+Deleted rows are removed right away, inserted and updated ones are selected
+by their keys, notifications received meanwhile are applied after them.
+
+Rows are stored as named tuples of ``columns`` (taken from the first row
+unless given), so each row costs about as much as a tuple of its values.
+Columns which aren't valid identifiers are renamed to ``_<position>`` in the
+named tuple, index their values by position (``row[position]``).
+Notifications carry only the new row, so primary keys are expected not to
+change.
+'''
+import asyncio
+import collections
+import csv
+import io
+import json
+import logging
+
+import pg_bawler.events
+
+LOGGER = logging.getLogger('pg_bawler.replica')
+
+
+def _as_columns(spec):
+    return (spec, ) if isinstance(spec, str) else tuple(spec)
+
+
+class TableReplica:
+    '''
+    Replica of ``table``.
+
+    :param table: Table name, used in snapshot query.
+    :param channel: Notification channel of the table, defaults to
+        ``table``.
+    :param key_columns: Columns forming primary key.
+    :param columns: Stored columns, defaults to columns of the first row.
+    :param indexes: Secondary indexes, column name or tuple of column names
+        each.
+    '''
+
+    SNAPSHOT_QUERY_TPL = 'SELECT row_to_json(t)::text FROM {table} t'
+    ROWS_QUERY_TPL = (
+        'SELECT row_to_json(t)::text FROM {table} t'
+        ' WHERE ({columns}) IN (SELECT {columns}'
+        ' FROM json_populate_recordset(NULL::{table}, \'{keys}\'))')
+
+    def __init__(
+        self,
+        table,
+        *,
+        channel=None,
+        key_columns=('id', ),
+        columns=None,
+        indexes=()
+    ):
+        self.table = table
+        self.channel = channel or table
+        self.key_columns = tuple(key_columns)
+        self.row_class = None
+        self.columns = None
+        if columns is not None:
+            self._set_columns(columns)
+        self.indexes = {
+            _as_columns(spec): collections.defaultdict(set)
+            for spec in indexes
+        }
+        self.rows = {}
+        self._loading = 0
+        self._pending = []
+        # keys of rows changed by TRANSACTION notifications to select
+        self._stale = set()
+        self._retry_task = None
+
+    @property
+    def is_loading(self):
+        '''
+        Snapshot or changed rows are being selected, notifications are
+        applied after.
+        '''
+        return bool(self._loading)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows.values())
+
+    def _set_columns(self, columns):
+        # invalid identifiers (``from``, ``_ver``) are renamed in the named
+        # tuple, so values are stored and indexed by position of the column
+        self.columns = tuple(columns)
+        self._positions = {
+            column: position for position, column in enumerate(self.columns)
+        }
+        self.row_class = collections.namedtuple(
+            'Row', self.columns, rename=True)
+
+    def _make_row(self, data):
+        if self.row_class is None:
+            self._set_columns(list(data))
+        return self.row_class._make(
+            data.get(column) for column in self.columns)
+
+    def _key(self, data):
+        return tuple(data.get(column) for column in self.key_columns)
+
+    def get(self, *key, default=None):
+        '''
+        Returns row with primary ``key`` values.
+        '''
+        return self.rows.get(key, default)
+
+    def lookup(self, index, *values):
+        '''
+        Returns list of rows with ``values`` in columns of ``index``.
+        '''
+        keys = self.indexes[_as_columns(index)].get(values, ())
+        return [self.rows[key] for key in keys]
+
+    def _index_values(self, columns, row):
+        return tuple(row[self._positions[column]] for column in columns)
+
+    def _put(self, key, row):
+        old = self.rows.get(key)
+        if old is not None:
+            self._unindex(key, old)
+        self.rows[key] = row
+        for columns, index in self.indexes.items():
+            index[self._index_values(columns, row)].add(key)
+
+    def _unindex(self, key, row):
+        for columns, index in self.indexes.items():
+            values = self._index_values(columns, row)
+            keys = index[values]
+            keys.discard(key)
+            if not keys:
+                del index[values]
+
+    def _remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self._unindex(key, row)
+
+    def clear(self):
+        self.rows.clear()
+        for index in self.indexes.values():
+            index.clear()
+
+    def load_rows(self, rows):
+        '''
+        Replaces content with ``rows`` (dictionaries).
+        '''
+        self.clear()
+        for data in rows:
+            self._put(self._key(data), self._make_row(data))
+
+    async def _fetch_snapshot(self, listener):
+        driver = listener.driver
+        query = self.SNAPSHOT_QUERY_TPL.format(table=self.table)
+        try:
+            async with listener.pg_lock:
+                data = await driver.copy_out(
+                    await listener.pg_connection(), query)
+        except NotImplementedError:
+            lines = [row[0] for row in await listener.pg_fetchall(query)]
+        else:
+            lines = [
+                row[0] for row in csv.reader(
+                    io.StringIO(data.decode('utf-8')))
+            ]
+        return [pg_bawler.events.json_loads(line) for line in lines]
+
+    async def _fetch_rows(self, listener, keys):
+        query = self.ROWS_QUERY_TPL.format(
+            table=self.table,
+            columns=', '.join(self.key_columns),
+            keys=json.dumps([
+                dict(zip(self.key_columns, key)) for key in keys
+            ]).replace('\'', '\'\''))
+        return [
+            pg_bawler.events.json_loads(row[0])
+            for row in await listener.pg_fetchall(query)
+        ]
+
+    def _apply_pending(self):
+        pending, self._pending = self._pending, []
+        for event in pending:
+            self.apply(event)
+        return len(pending)
+
+    async def snapshot(self, listener):
+        '''
+        Loads the whole table, applying notifications received meanwhile
+        afterwards.
+        '''
+        self._loading += 1
+        try:
+            # rows changed so far are in the snapshot
+            self._stale.clear()
+            self.load_rows(await self._fetch_snapshot(listener))
+        finally:
+            self._loading -= 1
+        applied = 0 if self.is_loading else self._apply_pending()
+        LOGGER.info(
+            'Loaded %s rows of %s, applied %s notifications',
+            len(self.rows), self.table, applied)
+        await self.refresh(listener)
+
+    async def refresh(self, listener):
+        '''
+        Selects rows changed by ``TRANSACTION`` notifications, applying
+        notifications received meanwhile afterwards.
+        '''
+        while self._stale and not self.is_loading:
+            keys, self._stale = self._stale, set()
+            self._loading += 1
+            try:
+                rows = await self._fetch_rows(listener, keys)
+            except Exception:
+                self._stale |= keys
+                raise
+            else:
+                for data in rows:
+                    key = self._key(data)
+                    keys.discard(key)
+                    self._put(key, self._make_row(data))
+                # deleted since
+                for key in keys:
+                    self._remove(key)
+            finally:
+                self._loading -= 1
+                if not self.is_loading:
+                    self._apply_pending()
+
+    def apply(self, event):
+        '''
+        Applies :class:`pg_bawler.events.ChangeEvent`. Rows inserted or
+        updated by ``TRANSACTION`` notification are only marked to be
+        selected by :meth:`refresh`.
+        '''
+        if self.is_loading:
+            self._pending.append(event)
+        elif event.op == pg_bawler.events.TRANSACTION:
+            for op, data in event.changes:
+                key = self._key(data)
+                if op == 'DELETE':
+                    self._stale.discard(key)
+                    self._remove(key)
+                else:
+                    self._stale.add(key)
+        elif event.op == 'TRUNCATE':
+            self.clear()
+        elif event.op == 'DELETE':
+            self._remove(self._key(event.row))
+        elif event.op in ('INSERT', 'UPDATE'):
+            row = event.row
+            self._put(self._key(row), self._make_row(row))
+        else:
+            LOGGER.warning(
+                'Ignoring notification from %s without operation: %s',
+                event.channel, event.payload)
+
+    async def handle_notification(self, notification, listener):
+        self.apply(notification)
+        if self._stale:
+            await self.refresh(listener)
+
+    async def handle_reconnect(self, listener):
+        LOGGER.info('Listener reconnected, reloading %s', self.table)
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+        try:
+            await self.snapshot(listener)
+        except Exception:
+            LOGGER.exception(
+                'Reloading %s failed, retrying in %s seconds',
+                self.table, listener.reconnect_interval)
+            self._retry_task = listener.loop.create_task(
+                self._retry_snapshot(listener))
+
+    async def _retry_snapshot(self, listener):
+        while not listener.is_stopped:
+            await asyncio.sleep(listener.reconnect_interval)
+            try:
+                await self.snapshot(listener)
+            except Exception:
+                LOGGER.exception(
+                    'Reloading %s failed, retrying in %s seconds',
+                    self.table, listener.reconnect_interval)
+            else:
+                self._retry_task = None
+                return
+
+    async def attach(self, listener):
+        '''
+        Starts listening on replica's channel, takes snapshot and registers
+        re-snapshot on ``listener``'s reconnect.
+        '''
+        listener.register_handler(self.channel, self.handle_notification)
+        listener.add_reconnect_callback(self.handle_reconnect)
+        await listener.register_channel(self.channel)
+        await self.snapshot(listener)
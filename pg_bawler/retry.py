@@ -0,0 +1,214 @@
+'''
+===============
+pg_bawler.retry
+===============
+
+Retries of failed handlers.
+
+Without retry scheduler, exception raised by handler is logged and the
+notification is lost for that handler. :class:`RetryScheduler` runs the
+handler again for the same notification after delay given by handler's
+:class:`RetryPolicy`::
+
+    listener.retry = RetryScheduler(
+        listener,
+        default_policy=RetryPolicy(max_attempts=5, base_delay=1),
+        policies={index_in_elastic: RetryPolicy(max_attempts=20)},
+        dead_letter='/var/lib/pg_bawler/dead_letter.bawler')
+
+All pending retries of a listener share one heap and one event loop timer,
+so each pending retry costs just a heap entry. Notifications whose handler
+failed ``max_attempts`` times are appended to ``dead_letter`` file (format of
+:mod:`pg_bawler.recording`) and may be replayed later with
+:class:`pg_bawler.recording.NotificationReplayer`. Retries still pending when
+listener stops are written to the dead letter file as well.
+
+Only exceptions are retried, handlers cancelled by ``handler_timeout`` are
+not.
+
+Scheduler exports ``<prefix>.retry.scheduled`` and
+``<prefix>.retry.dead_lettered`` counters and ``<prefix>.retry.pending``
+gauge.
+'''
+import heapq
+import itertools
+import logging
+import random
+
+import pg_bawler.metrics
+import pg_bawler.recording
+
+LOGGER = logging.getLogger('pg_bawler.retry')
+
+
+class RetryPolicy:
+    '''
+    Exponential backoff.
+
+    :param max_attempts: Number of attempts including the first one.
+    :param base_delay: Seconds before the first retry.
+    :param multiplier: Each following delay is this many times longer.
+    :param max_delay: Maximal delay in seconds.
+    :param jitter: Delay is randomly shortened by up to this fraction.
+    '''
+
+    __slots__ = (
+        'max_attempts', 'base_delay', 'multiplier', 'max_delay', 'jitter')
+
+    def __init__(
+        self,
+        *,
+        max_attempts=5,
+        base_delay=1,
+        multiplier=2,
+        max_delay=300,
+        jitter=0.1
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_delay(self, attempt, random_value=None):
+        '''
+        Returns seconds to wait after failed ``attempt`` (starting at 1).
+        '''
+        delay = min(
+            self.base_delay * self.multiplier ** (attempt - 1),
+            self.max_delay)
+        if self.jitter:
+            delay *= 1 - self.jitter * (
+                random.random() if random_value is None else random_value)
+        return delay
+
+
+class RetryScheduler:
+    '''
+    Schedules retries of ``listener``'s failed handlers.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param policies: Mapping of handlers to :class:`RetryPolicy`.
+    :param default_policy: Policy of handlers not in ``policies``, ``None``
+        to not retry them.
+    :param dead_letter: Path of dead letter file, ``None`` to only log
+        notifications which exhausted their retries.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry`, defaults to
+        :data:`pg_bawler.metrics.REGISTRY`.
+    :param prefix: Prefix of exported metric names.
+    '''
+
+    def __init__(
+        self,
+        listener,
+        *,
+        policies=None,
+        default_policy=RetryPolicy(),
+        dead_letter=None,
+        registry=None,
+        prefix='pg_bawler'
+    ):
+        self.listener = listener
+        self.policies = dict(policies or {})
+        self.default_policy = default_policy
+        self.dead_letter = dead_letter
+        registry = registry or pg_bawler.metrics.REGISTRY
+        self._scheduled_counter = registry.counter(
+            '{}.retry.scheduled'.format(prefix))
+        self._dead_lettered_counter = registry.counter(
+            '{}.retry.dead_lettered'.format(prefix))
+        self._pending_gauge = registry.gauge(
+            '{}.retry.pending'.format(prefix))
+        self._heap = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_due = None
+        self._recorder = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def get_policy(self, handler):
+        return self.policies.get(handler, self.default_policy)
+
+    def handler_failed(self, handler, notification, attempt, exc):
+        '''
+        Schedules retry of ``handler`` or dead letters ``notification``.
+        '''
+        policy = self.get_policy(handler)
+        if policy is None or attempt >= policy.max_attempts:
+            LOGGER.error(
+                'Handler %s failed %s time(s), giving up on notification'
+                ' from %s: %s', handler, attempt, notification.channel,
+                notification.payload, exc_info=exc)
+            self.write_dead_letter(notification)
+            return
+        delay = policy.get_delay(attempt)
+        LOGGER.warning(
+            'Handler %s failed (attempt %s of %s), retrying in %.2f seconds:'
+            ' %r', handler, attempt, policy.max_attempts, delay, exc)
+        self.schedule(
+            self.listener.loop.time() + delay, handler, notification,
+            attempt + 1)
+
+    def schedule(self, due, handler, notification, attempt):
+        heapq.heappush(
+            self._heap,
+            (due, next(self._sequence), handler, notification, attempt))
+        self._scheduled_counter.inc()
+        self._pending_gauge.set(len(self._heap))
+        self._set_timer()
+
+    def _set_timer(self):
+        if not self._heap:
+            return
+        due = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer_due <= due:
+                return
+            self._timer.cancel()
+        self._timer_due = due
+        self._timer = self.listener.loop.call_at(due, self._run_due)
+
+    def _run_due(self):
+        self._timer = self._timer_due = None
+        if self.listener.is_stopped:
+            return
+        now = self.listener.loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, handler, notification, attempt = heapq.heappop(self._heap)
+            self.listener._start_handler(
+                handler(notification, self.listener), handler, notification,
+                attempt)
+        self._pending_gauge.set(len(self._heap))
+        self._set_timer()
+
+    def write_dead_letter(self, notification):
+        self._dead_lettered_counter.inc()
+        if self.dead_letter is None:
+            return
+        if self._recorder is None:
+            self._recorder = pg_bawler.recording.NotificationRecorder(
+                self.dead_letter)
+        # handlers get events wrapping the received notification
+        self._recorder.record(
+            getattr(notification, 'notification', notification))
+        self._recorder.flush()
+
+    def close(self):
+        '''
+        Cancels the timer and dead letters pending retries.
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_due = None
+        if self._heap:
+            LOGGER.warning(
+                'Writing %s pending retries to dead letter file',
+                len(self._heap))
+        while self._heap:
+            self.write_dead_letter(heapq.heappop(self._heap)[3])
+        self._pending_gauge.set(0)
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
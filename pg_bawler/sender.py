@@ -3,22 +3,264 @@
 pg_bawler.sender
 ================
 
+Send notifications, used also as a load generator::
+
+    $ python -m pg_bawler.sender --dsn "..." --count 100000 --rate 5000 \\
+        --connections 4 --payload-size 256 foo bar
+    $ cat payloads.txt | python -m pg_bawler.sender --dsn "..." \\
+        --payload-file - foo
+
+Prints achieved rate and percentiles of ``send()`` latency when finished.
 '''
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import sys
+import time
+
 import pg_bawler.core
+import pg_bawler.metrics
+import pg_bawler.tracing
+
+
+LOGGER = logging.getLogger('pg_bawler.sender')
 
 
 class SenderMixin:
 
     NOTIFY_SEND_TPL = 'SELECT pg_notify(\'{channel}\', \'{payload}\')'
+    NOTIFY_ENVELOPE_SEND_TPL = (
+        'SELECT pg_notify(\'{channel}\','
+        ' \'{prefix}\' || extract(epoch from clock_timestamp())'
+        ' || \' \' || txid_current() || \' {origin}\' || E\'\\n\''
+        ' || \'{payload}\')')
+
+    #: Wrap payloads with :mod:`pg_bawler.tracing` envelope
+    envelope = False
+    #: Origin recorded in the envelope, defaults to ``hostname:pid``
+    origin = None
+
+    def get_origin(self):
+        if self.origin is None:
+            return '{}:{}'.format(socket.gethostname(), os.getpid())
+        return self.origin
 
     def get_notify_statement(self, *, channel, payload):
+        if self.envelope:
+            return self.NOTIFY_ENVELOPE_SEND_TPL.format(
+                channel=channel,
+                payload=payload,
+                prefix=pg_bawler.tracing.ENVELOPE_PREFIX,
+                origin=self.get_origin())
         return self.NOTIFY_SEND_TPL.format(channel=channel, payload=payload)
 
     async def send(self, *, channel, payload):
-        async with (await self.pg_connection()).cursor() as pg_cursor:
-            await pg_cursor.execute(
-                self.get_notify_statement(channel=channel, payload=payload))
+        await self.pg_execute(
+            self.get_notify_statement(channel=channel, payload=payload))
 
 
 class NotificationSender(pg_bawler.core.BawlerBase, SenderMixin):
     pass
+
+
+def synthetic_payloads(size):
+    '''
+    Yields payloads of ``size`` characters starting with sequence number.
+    '''
+    for number in itertools.count():
+        prefix = '{} '.format(number)
+        yield prefix + 'x' * max(0, size - len(prefix))
+
+
+def read_payloads(paths):
+    '''
+    Returns non-empty lines of files at ``paths`` (``-`` for stdin).
+    '''
+    payloads = []
+    for path in paths:
+        if path == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(path, encoding='utf-8') as payload_file:
+                lines = payload_file.read().splitlines()
+        payloads.extend(line for line in lines if line)
+    return payloads
+
+
+async def generate_load(
+    connection_params,
+    *,
+    channels,
+    payloads,
+    count,
+    rate=None,
+    connections=1,
+    driver=None,
+    envelope=False,
+    sender_class=NotificationSender
+):
+    '''
+    Sends ``count`` notifications over ``connections`` concurrent senders,
+    round robin to ``channels``.
+
+    :param payloads: Iterable of payloads, used in order.
+    :param rate: Target notifications per second of all senders together,
+        ``None`` to send as fast as possible.
+    :returns: Dictionary with numbers of sent and failed notifications,
+        elapsed time, achieved rate and percentiles of ``send()`` latency.
+    '''
+    payloads = iter(payloads)
+    numbers = iter(range(count))
+    latencies = []
+    errors = 0
+    loop = asyncio.get_event_loop()
+
+    async def worker():
+        nonlocal errors
+        async with sender_class(connection_params, driver=driver) as sender:
+            sender.envelope = envelope
+            for number in numbers:
+                if rate:
+                    delay = started + number / rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                payload = next(payloads).replace('\'', '\'\'')
+                sent = time.perf_counter()
+                try:
+                    await sender.send(
+                        channel=channels[number % len(channels)],
+                        payload=payload)
+                except sender.driver.errors:
+                    LOGGER.exception('Failed to send notification')
+                    errors += 1
+                    await sender.drop_connection()
+                else:
+                    latencies.append(time.perf_counter() - sent)
+
+    started = loop.time()
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    elapsed = loop.time() - started
+    return {
+        'sent': len(latencies),
+        'errors': errors,
+        'elapsed': elapsed,
+        'rate': len(latencies) / elapsed if elapsed else None,
+        'latency_p50': pg_bawler.metrics.percentile(latencies, 50),
+        'latency_p90': pg_bawler.metrics.percentile(latencies, 90),
+        'latency_p99': pg_bawler.metrics.percentile(latencies, 99),
+        'latency_max': max(latencies, default=None),
+    }
+
+
+def get_default_cli_args_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--log-level',
+        metavar='LOG_LEVEL',
+        default='WARNING',
+        choices="FATAL CIRTICAL ERROR WARNING INFO DEBUG".split(),
+        help='Log level. One of: FATAL, CIRTICAL, ERROR, WARNING, INFO, DEBUG')
+    parser.add_argument(
+        '--dsn',
+        metavar='DSN',
+        required=True,
+        help='Connection string. e.g. `dbname=test user=postgres`')
+    parser.add_argument(
+        '--driver',
+        metavar='DRIVER', default=None,
+        help='Database driver. One of: aiopg, asyncpg, memory')
+    parser.add_argument(
+        '--loop',
+        metavar='LOOP', default='asyncio',
+        help=(
+            'Event loop implementation. One of: asyncio, uvloop'
+            ' or `module:factory` path.'))
+    parser.add_argument(
+        '--payload-file',
+        metavar='FILE', action='append', default=[],
+        help=(
+            'Send lines of FILE (`-` for stdin) as payloads instead of'
+            ' synthetic ones, may be given multiple times.'))
+    parser.add_argument(
+        '--payload-size',
+        metavar='BYTES', type=int, default=64,
+        help='Size of synthetic payloads.')
+    parser.add_argument(
+        '--count',
+        metavar='COUNT', type=int, default=None,
+        help=(
+            'Number of notifications to send. Defaults to number of lines'
+            ' in payload files or 1000 for synthetic payloads.'))
+    parser.add_argument(
+        '--rate',
+        metavar='RATE', type=float, default=None,
+        help='Target notifications per second, as fast as possible if unset.')
+    parser.add_argument(
+        '--connections',
+        metavar='N', type=int, default=1,
+        help='Number of concurrent connections.')
+    parser.add_argument(
+        '--envelope',
+        action='store_true',
+        default=False,
+        help='Wrap payloads with pg_bawler.tracing envelope.')
+    parser.add_argument(
+        'channels',
+        metavar='CHANNEL', type=str, nargs='+',
+        help='Name of channel to send to, sent round robin to all channels.')
+    return parser
+
+
+def format_report(report):
+    lines = [
+        'sent: {sent} errors: {errors} elapsed: {elapsed:.3f}s'.format(
+            **report),
+        'rate: {} notifications/s'.format(
+            '-' if report['rate'] is None else '{:.1f}'.format(
+                report['rate'])),
+    ]
+    for name in ('p50', 'p90', 'p99', 'max'):
+        latency = report['latency_' + name]
+        lines.append('latency {}: {}'.format(
+            name, '-' if latency is None else '{:.3f}ms'.format(
+                latency * 1000)))
+    return '\n'.join(lines)
+
+
+def main(*argv, loop=None):
+    args = get_default_cli_args_parser().parse_args(argv or sys.argv[1:])
+    logging.basicConfig(
+        format='[%(asctime)s][%(name)s][%(levelname)s]: %(message)s',
+        level=args.log_level.upper())
+    if args.payload_file:
+        payloads = read_payloads(args.payload_file)
+        if not payloads:
+            raise SystemExit('No payloads to send')
+        count = len(payloads) if args.count is None else args.count
+        payloads = itertools.cycle(payloads)
+    else:
+        payloads = synthetic_payloads(args.payload_size)
+        count = 1000 if args.count is None else args.count
+    loop = loop or pg_bawler.core.new_event_loop(args.loop)
+    try:
+        report = loop.run_until_complete(generate_load(
+            {'dsn': args.dsn},
+            channels=args.channels,
+            payloads=payloads,
+            count=count,
+            rate=args.rate,
+            connections=args.connections,
+            driver=args.driver,
+            envelope=args.envelope))
+    finally:
+        loop.close()
+    sys.stdout.write(format_report(report) + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
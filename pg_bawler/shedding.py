@@ -0,0 +1,271 @@
+'''
+==================
+pg_bawler.shedding
+==================
+
+Admission control and load shedding for overloaded listeners.
+
+:class:`AdmissionController` sits between receiving notification and
+dispatching it to handlers. It keeps at most ``max_inflight`` handler tasks
+running, queues the rest per channel and dispatches queued notifications
+from channels with higher ``priority`` first, so a burst on a low-value
+channel doesn't delay critical ones::
+
+    listener.admission = AdmissionController(
+        listener,
+        max_inflight=50,
+        queue_threshold=1000,
+        latency_threshold=0.5,
+        policies={
+            'cache_invalidation': ChannelPolicy(priority=10),
+            'audit': ChannelPolicy(policy='sample', percent=10),
+            'search_index': ChannelPolicy(policy='coalesce'),
+        })
+
+Listener is overloaded when queued notifications reach ``queue_threshold``,
+average handler duration exceeds ``latency_threshold`` or its
+:class:`pg_bawler.monitoring.NotificationQueueMonitor` reports critical
+level. While overloaded, notifications of each channel are shed according
+to its policy (one of :data:`POLICIES`):
+
+* ``none`` - never shed (default)
+* ``drop-newest`` - drop incoming notification
+* ``drop-oldest`` - drop the oldest queued notification of the channel
+* ``sample`` - admit only ``percent`` % of incoming notifications
+* ``coalesce`` - replace queued notification of the same row with the
+  incoming one, rows are identified by table and
+  :attr:`pg_bawler.events.ChangeEvent.keys` (payload without tracing
+  envelope for notifications without keys)
+
+Shed notifications are counted in ``<prefix>.shed.<channel>`` counters and
+number of queued notifications in ``<prefix>.dispatch_queue_depth`` gauge.
+'''
+import collections
+import itertools
+import random
+
+import pg_bawler.core
+import pg_bawler.events
+import pg_bawler.metrics
+import pg_bawler.tracing
+
+#: Shedding policies
+POLICIES = ('none', 'drop-newest', 'drop-oldest', 'sample', 'coalesce')
+
+
+class PgBawlerSheddingError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised for invalid shedding configuration.
+    '''
+
+
+class ChannelPolicy:
+    '''
+    Priority and shedding policy of one channel.
+
+    :param priority: Channels with higher priority are dispatched first.
+    :param policy: One of :data:`POLICIES`.
+    :param percent: Percentage of notifications admitted by ``sample``
+        policy.
+    '''
+
+    __slots__ = ('priority', 'policy', 'percent')
+
+    def __init__(self, *, priority=0, policy='none', percent=100):
+        if policy not in POLICIES:
+            raise PgBawlerSheddingError(
+                'Unknown shedding policy {!r}'.format(policy))
+        self.priority = priority
+        self.policy = policy
+        self.percent = percent
+
+
+class AdmissionController:
+    '''
+    Queues and sheds notifications of ``listener``.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param max_inflight: Maximal number of running handler tasks.
+    :param queue_threshold: Number of queued notifications making listener
+        overloaded.
+    :param latency_threshold: Average handler duration in seconds making
+        listener overloaded, ``None`` to ignore handler duration.
+    :param policies: Mapping of channel names to :class:`ChannelPolicy`.
+    :param default_policy: Policy of channels not in ``policies``.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry`, defaults to
+        :data:`pg_bawler.metrics.REGISTRY`.
+    :param prefix: Prefix of exported metric names.
+    :param seed: Seed of random generator used by ``sample`` policy.
+    '''
+
+    #: Weight of the last handler duration in the moving average
+    latency_smoothing = 0.2
+
+    def __init__(
+        self,
+        listener,
+        *,
+        max_inflight=100,
+        queue_threshold=1000,
+        latency_threshold=None,
+        policies=None,
+        default_policy=None,
+        registry=None,
+        prefix='pg_bawler',
+        seed=None
+    ):
+        self.listener = listener
+        self.max_inflight = max_inflight
+        self.queue_threshold = queue_threshold
+        self.latency_threshold = latency_threshold
+        self.policies = dict(policies or {})
+        self.default_policy = default_policy or ChannelPolicy()
+        self.registry = registry or pg_bawler.metrics.REGISTRY
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.handler_latency = 0.0
+        self.queue_depth = 0
+        self.shed_counts = collections.Counter()
+        self._queues = {}
+        self._coalesced = collections.defaultdict(dict)
+        self._sequence = itertools.count()
+        self._depth_gauge = self.registry.gauge(
+            '{}.dispatch_queue_depth'.format(prefix))
+        self._shed_counters = {}
+
+    def get_policy(self, channel):
+        return self.policies.get(channel, self.default_policy)
+
+    @property
+    def inflight(self):
+        return (
+            self.listener.handlers_started - self.listener.handlers_completed)
+
+    @property
+    def is_overloaded(self):
+        if self.queue_depth >= self.queue_threshold:
+            return True
+        if self.latency_threshold is not None and (
+            self.handler_latency >= self.latency_threshold
+        ):
+            return True
+        monitor = self.listener.queue_monitor
+        return monitor is not None and monitor.level == 'critical'
+
+    def coalesce_key(self, notification):
+        '''
+        Returns key identifying row changed by ``notification``.
+        '''
+        event = getattr(notification, 'event', None)
+        if isinstance(event, pg_bawler.events.ChangeEvent):
+            # already decoded when filtering the notification
+            payload = event.payload
+        else:
+            envelope, payload = pg_bawler.tracing.parse_envelope(
+                notification.payload)
+            event = pg_bawler.events.ChangeEvent(
+                pg_bawler.core.Notification(
+                    notification.pid, notification.channel, payload),
+                envelope, self.listener.event_key_columns)
+        try:
+            key = (event.table, event.keys)
+            hash(key)
+        except (TypeError, ValueError):
+            # not a row change, e.g. custom or TRANSACTION payload
+            return payload
+        if None in key[1]:
+            return payload
+        return key
+
+    def shed(self, notification):
+        '''
+        Drops ``notification`` and counts it.
+        '''
+        channel = notification.channel
+        self.listener._processed(notification)
+        self.shed_counts[channel] += 1
+        if channel not in self._shed_counters:
+            self._shed_counters[channel] = self.registry.counter(
+                '{}.shed.{}'.format(self.prefix, channel))
+        self._shed_counters[channel].inc()
+
+    def submit(self, notification):
+        '''
+        Dispatches ``notification``, queues it or sheds it.
+        '''
+        if not self.queue_depth and self.inflight < self.max_inflight:
+            self.listener._dispatch(notification)
+            return
+        channel = notification.channel
+        policy = self.get_policy(channel)
+        queue = self._queues.get(channel)
+        if queue is None:
+            queue = self._queues[channel] = collections.deque()
+        if policy.policy != 'none' and self.is_overloaded:
+            if policy.policy == 'drop-newest':
+                self.shed(notification)
+                return
+            if policy.policy == 'sample' and (
+                self.random.random() * 100 >= policy.percent
+            ):
+                self.shed(notification)
+                return
+            if policy.policy == 'coalesce':
+                entry = self._coalesced[channel].get(
+                    self.coalesce_key(notification))
+                if entry is not None:
+                    # keep position of the queued one, but the latest data
+                    self.shed(entry[1])
+                    entry[1] = notification
+                    return
+            if policy.policy == 'drop-oldest' and queue:
+                self.queue_depth -= 1
+                self.shed(queue.popleft()[1])
+        # [sequence, notification, coalesce key]
+        entry = [next(self._sequence), notification, None]
+        if policy.policy == 'coalesce':
+            entry[2] = key = self.coalesce_key(notification)
+            self._coalesced[channel][key] = entry
+        queue.append(entry)
+        self.queue_depth += 1
+        self._depth_gauge.set(self.queue_depth)
+        self.pump()
+
+    def _pop(self):
+        best = best_key = None
+        for channel, queue in self._queues.items():
+            if queue:
+                key = (-self.get_policy(channel).priority, queue[0][0])
+                if best_key is None or key < best_key:
+                    best, best_key = channel, key
+        entry = self._queues[best].popleft()
+        if entry[2] is not None and (
+            self._coalesced[best].get(entry[2]) is entry
+        ):
+            del self._coalesced[best][entry[2]]
+        self.queue_depth -= 1
+        return entry[1]
+
+    def pump(self):
+        '''
+        Dispatches queued notifications while there is room for handlers.
+        Nothing is dispatched once the listener is stopped, queued
+        notifications are abandoned.
+        '''
+        if self.listener.is_stopped:
+            return
+        dispatched = False
+        while self.queue_depth and self.inflight < self.max_inflight:
+            self.listener._dispatch(self._pop())
+            dispatched = True
+        if dispatched:
+            self._depth_gauge.set(self.queue_depth)
+
+    def handler_done(self, duration):
+        '''
+        Called by listener when handler task finishes.
+        '''
+        self.handler_latency += self.latency_smoothing * (
+            duration - self.handler_latency)
+        if self.queue_depth:
+            self.pump()
@@ -0,0 +1,324 @@
+'''
+===============
+pg_bawler.spool
+===============
+
+Disk-backed spool between receiving notifications and dispatching them.
+
+While handlers are backed up (``max_inflight`` handler tasks running, e.g.
+because Elasticsearch is down and handlers hang or retry), received
+notifications are kept in memory up to ``memory_limit``, the rest spills to
+memory-mapped segment files in ``directory``. Spooled notifications are
+dispatched in order as soon as handlers catch up::
+
+    listener.spool = NotificationSpool(
+        listener, '/var/spool/pg_bawler/clients',
+        memory_limit=10000, max_segments=64)
+
+Disk usage is capped to ``max_segments`` segments of ``segment_size`` bytes,
+notifications not fitting are dropped and counted. Consumed segments are
+removed and read position is kept in ``position`` file, so spool resumes
+after restart. Notifications held in memory are written to disk on
+:meth:`NotificationSpool.close` (called by listener's ``stop()``), but are
+lost if the process crashes.
+
+Segments use record format of :mod:`pg_bawler.recording`.
+
+Spool exports ``<prefix>.spool.memory`` and ``<prefix>.spool.disk`` gauges
+and ``<prefix>.spool.dropped`` counter.
+'''
+import collections
+import logging
+import mmap
+import os
+import time
+
+import pg_bawler.metrics
+import pg_bawler.recording
+
+LOGGER = logging.getLogger('pg_bawler.spool')
+
+SEGMENT_SUFFIX = '.spool'
+POSITION_FILENAME = 'position'
+
+#: Sequence number of the first segment of empty spool. Notifications held in
+#: memory are spilled on close to segments preceding the existing ones, so
+#: numbering starts high enough to never go negative.
+FIRST_SEGMENT = 1 << 32
+
+
+class SpoolSegment:
+    '''
+    Fixed size memory-mapped file with records appended one after another,
+    the rest of the file is zero filled.
+    '''
+
+    def __init__(self, directory, sequence, size=None):
+        self.sequence = sequence
+        self.path = os.path.join(
+            directory, '{:016d}{}'.format(sequence, SEGMENT_SUFFIX))
+        if size is None:
+            self._file = open(self.path, 'r+b')
+            size = os.fstat(self._file.fileno()).st_size
+        else:
+            self._file = open(self.path, 'w+b')
+            self._file.truncate(size)
+        self.size = size
+        self.data = mmap.mmap(self._file.fileno(), size)
+        self.write_offset = self.count = 0
+        for _, _, end in pg_bawler.recording.iter_records(self.data):
+            self.write_offset = end
+            self.count += 1
+
+    def append(self, record):
+        '''
+        Appends packed ``record``, returns ``False`` if it doesn't fit.
+        '''
+        end = self.write_offset + len(record)
+        if end > self.size:
+            return False
+        self.data[self.write_offset:end] = record
+        self.write_offset = end
+        self.count += 1
+        return True
+
+    def read(self, offset, limit):
+        '''
+        Returns up to ``limit`` notifications starting at ``offset`` and
+        offset following them.
+        '''
+        notifications = []
+        if limit <= 0:
+            return notifications, offset
+        for _, notification, end in pg_bawler.recording.iter_records(
+            self.data, offset
+        ):
+            notifications.append(notification)
+            offset = end
+            if len(notifications) >= limit:
+                break
+        return notifications, offset
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class NotificationSpool:
+    '''
+    Spool of ``listener``'s notifications.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param directory: Directory of segment files, created if missing.
+    :param memory_limit: Maximal number of notifications held in memory.
+    :param max_inflight: Notifications are spooled while this many handler
+        tasks are running.
+    :param segment_size: Size of segment file in bytes.
+    :param max_segments: Maximal number of segment files.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry`, defaults to
+        :data:`pg_bawler.metrics.REGISTRY`.
+    :param prefix: Prefix of exported metric names.
+    '''
+
+    def __init__(
+        self,
+        listener,
+        directory,
+        *,
+        memory_limit=10000,
+        max_inflight=100,
+        segment_size=16 * 1024 * 1024,
+        max_segments=64,
+        registry=None,
+        prefix='pg_bawler'
+    ):
+        self.listener = listener
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.max_inflight = max_inflight
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        registry = registry or pg_bawler.metrics.REGISTRY
+        self._memory_gauge = registry.gauge('{}.spool.memory'.format(prefix))
+        self._disk_gauge = registry.gauge('{}.spool.disk'.format(prefix))
+        self._dropped_counter = registry.counter(
+            '{}.spool.dropped'.format(prefix))
+        self.memory = collections.deque()
+        self.segments = collections.deque()
+        self.read_offset = 0
+        self.disk_count = 0
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._open_segments()
+
+    def __len__(self):
+        return len(self.memory) + self.disk_count
+
+    @property
+    def position_path(self):
+        return os.path.join(self.directory, POSITION_FILENAME)
+
+    def _open_segments(self):
+        sequences = sorted(
+            int(filename[:-len(SEGMENT_SUFFIX)])
+            for filename in os.listdir(self.directory)
+            if filename.endswith(SEGMENT_SUFFIX)
+        )
+        read_sequence = None
+        if os.path.exists(self.position_path):
+            with open(self.position_path) as position_file:
+                read_sequence, self.read_offset = map(
+                    int, position_file.read().split())
+        for sequence in sequences:
+            segment = SpoolSegment(self.directory, sequence)
+            if read_sequence is not None and sequence < read_sequence:
+                segment.remove()
+                continue
+            self.segments.append(segment)
+        if not self.segments or self.segments[0].sequence != read_sequence:
+            self.read_offset = 0
+        for segment in self.segments:
+            self.disk_count += segment.count
+        if self.segments:
+            # records of the first segment before read position are consumed
+            unread, _ = self.segments[0].read(
+                self.read_offset, float('inf'))
+            self.disk_count -= self.segments[0].count - len(unread)
+            LOGGER.info(
+                'Resuming spool %s with %s notification(s)',
+                self.directory, self.disk_count)
+        self._update_gauges()
+
+    def _save_position(self):
+        if not self.segments:
+            if os.path.exists(self.position_path):
+                os.remove(self.position_path)
+            return
+        tmp_path = self.position_path + '.tmp'
+        with open(tmp_path, 'w') as position_file:
+            position_file.write('{} {}'.format(
+                self.segments[0].sequence, self.read_offset))
+        os.replace(tmp_path, self.position_path)
+
+    def _update_gauges(self):
+        self._memory_gauge.set(len(self.memory))
+        self._disk_gauge.set(self.disk_count)
+
+    def _new_segment(self, sequence, size=None):
+        return SpoolSegment(
+            self.directory, sequence, max(size or 0, self.segment_size))
+
+    def _write(self, notification):
+        record = pg_bawler.recording.pack_record(time.time(), notification)
+        if not self.segments or not self.segments[-1].append(record):
+            if len(self.segments) >= self.max_segments:
+                self._dropped_counter.inc()
+                LOGGER.error(
+                    'Spool %s is full, dropping notification from %s',
+                    self.directory, notification.channel)
+                return
+            sequence = (
+                self.segments[-1].sequence + 1 if self.segments
+                else FIRST_SEGMENT)
+            self.segments.append(self._new_segment(sequence, len(record)))
+            self.segments[-1].append(record)
+        self.disk_count += 1
+
+    def _load(self):
+        '''
+        Moves notifications from disk to memory.
+        '''
+        while self.segments and len(self.memory) < self.memory_limit:
+            segment = self.segments[0]
+            notifications, self.read_offset = segment.read(
+                self.read_offset, self.memory_limit - len(self.memory))
+            self.memory.extend(notifications)
+            self.disk_count -= len(notifications)
+            if self.read_offset < segment.write_offset:
+                break
+            self.segments.popleft().remove()
+            self.read_offset = 0
+        self._save_position()
+
+    def submit(self, notification):
+        '''
+        Dispatches ``notification`` or spools it.
+        '''
+        if not self.memory and not self.disk_count and (
+            self._has_capacity()
+        ):
+            self.listener._admit(notification)
+            return
+        if self.disk_count or len(self.memory) >= self.memory_limit:
+            self._write(notification)
+        else:
+            self.memory.append(notification)
+        self.pump()
+
+    def _has_capacity(self):
+        return not self.listener.is_stopped and (
+            self.listener.handlers_started -
+            self.listener.handlers_completed < self.max_inflight)
+
+    def pump(self):
+        '''
+        Dispatches spooled notifications while handlers have capacity.
+        '''
+        while self._has_capacity() and (self.memory or self.disk_count):
+            if not self.memory:
+                self._load()
+                if not self.memory:
+                    break
+            self.listener._admit(self.memory.popleft())
+        self._update_gauges()
+
+    def close(self):
+        '''
+        Writes notifications held in memory to disk and closes segments.
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        if self.memory:
+            self._spill_memory()
+        for segment in self.segments:
+            segment.close()
+        self._save_position()
+
+    def _spill_memory(self):
+        # memory holds notifications older than all spooled ones, they are
+        # written to new segments preceding the existing ones
+        if self.segments and self.read_offset:
+            unread, _ = self.segments[0].read(
+                self.read_offset, float('inf'))
+            self.segments.popleft().remove()
+            self.memory.extend(unread)
+            self.disk_count -= len(unread)
+            self.read_offset = 0
+        records = [
+            pg_bawler.recording.pack_record(time.time(), notification)
+            for notification in self.memory
+        ]
+        chunks = [[]]
+        chunk_size = 0
+        for record in records:
+            if chunks[-1] and chunk_size + len(record) > self.segment_size:
+                chunks.append([])
+                chunk_size = 0
+            chunks[-1].append(record)
+            chunk_size += len(record)
+        first = (
+            self.segments[0].sequence if self.segments
+            else FIRST_SEGMENT + len(chunks))
+        for number, chunk in enumerate(reversed(chunks), 1):
+            segment = self._new_segment(
+                first - number, sum(len(record) for record in chunk))
+            for record in chunk:
+                segment.append(record)
+            self.segments.appendleft(segment)
+        self.disk_count += len(self.memory)
+        self.memory.clear()
@@ -0,0 +1,192 @@
+'''
+======================
+pg_bawler.subscription
+======================
+
+Pull-based consumption of notifications.
+
+Instead of registering handler called for every notification, consumer may
+iterate over :meth:`pg_bawler.listener.ListenerMixin.subscribe` at its own
+pace while the listener runs ``listen()``::
+
+    async for event in listener.subscribe('clients', maxsize=1000):
+        await index_in_elastic(event)
+
+Every subscription has its own buffer of ``maxsize`` events. Subscriptions of
+the same channel share one ``LISTEN``, channel is listened on when the first
+subscription starts iterating and unlistened when the last one is closed,
+unless the channel has registered handlers. Buffers are filled directly by
+the listener, no task is created per event.
+
+Subscription is closed when its iterator is closed, e.g. by leaving
+``async for`` loop, or explicitly with :meth:`Subscription.aclose` or
+``async with``::
+
+    async with listener.subscribe('clients') as subscription:
+        event = await subscription.get()
+
+When buffer is full, ``overflow`` policy (one of :data:`OVERFLOW_POLICIES`)
+decides:
+
+* ``error`` - subscription is closed and iteration raises
+  :class:`PgBawlerSubscriptionOverflow` after the buffered events (default)
+* ``drop-newest`` - incoming event is dropped
+* ``drop-oldest`` - the oldest buffered event is dropped
+
+Dropped events are counted in :attr:`Subscription.dropped`.
+'''
+import asyncio
+import collections
+import logging
+
+import pg_bawler.core
+
+LOGGER = logging.getLogger('pg_bawler.subscription')
+
+#: Overflow policies
+OVERFLOW_POLICIES = ('error', 'drop-newest', 'drop-oldest')
+
+
+class PgBawlerSubscriptionError(pg_bawler.core.PgBawlerException):
+    '''
+    Raised for invalid subscription configuration.
+    '''
+
+
+class PgBawlerSubscriptionOverflow(PgBawlerSubscriptionError):
+    '''
+    Raised by subscription with ``error`` overflow policy which couldn't keep
+    up.
+    '''
+
+
+class Subscription:
+    '''
+    Buffered subscription of ``listener``'s ``channel``.
+
+    :param listener: :class:`pg_bawler.listener.ListenerMixin` instance.
+    :param channel: Name of the channel.
+    :param maxsize: Maximal number of buffered events.
+    :param overflow: One of :data:`OVERFLOW_POLICIES`.
+    '''
+
+    def __init__(self, listener, channel, *, maxsize=1000, overflow='error'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise PgBawlerSubscriptionError(
+                'Unknown overflow policy {!r}'.format(overflow))
+        self.listener = listener
+        self.channel = channel
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.buffer = collections.deque()
+        self.dropped = 0
+        self.closed = False
+        self._started = False
+        self._error = None
+        self._waiter = None
+        listener.subscriptions.setdefault(channel, []).append(self)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def put(self, event):
+        '''
+        Buffers ``event``, called by listener.
+        '''
+        if self.closed:
+            return
+        if len(self.buffer) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == 'drop-newest':
+                return
+            if self.overflow == 'drop-oldest':
+                self.buffer.popleft()
+            else:
+                LOGGER.error(
+                    'Subscription of %s overflowed %s buffered events,'
+                    ' closing it', self.channel, self.maxsize)
+                self._error = PgBawlerSubscriptionOverflow(
+                    'Subscription of {} overflowed {} buffered events'.format(
+                        self.channel, self.maxsize))
+                self.close()
+                return
+        self.buffer.append(event)
+        self._wake_up()
+
+    def _wake_up(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def start(self):
+        '''
+        Makes sure listener listens on the channel.
+        '''
+        if self._started or self.closed:
+            return
+        self._started = True
+        await self.listener.acquire_channel(self.channel)
+
+    async def get(self):
+        '''
+        Returns next event, waiting for it if buffer is empty.
+
+        :raises StopAsyncIteration: Subscription is closed.
+        :raises PgBawlerSubscriptionOverflow: Subscription overflowed.
+        '''
+        await self.start()
+        while not self.buffer:
+            if self._error is not None:
+                raise self._error
+            if self.closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self.buffer.popleft()
+
+    async def _iterate(self):
+        try:
+            while True:
+                try:
+                    event = await self.get()
+                except StopAsyncIteration:
+                    return
+                yield event
+        finally:
+            await self.aclose()
+
+    def __aiter__(self):
+        # iterator is async generator, so leaving ``async for`` closes
+        # subscription once the generator is finalized
+        return self._iterate()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    def close(self):
+        '''
+        Stops buffering events, buffered events may still be read.
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        subscriptions = self.listener.subscriptions.get(self.channel, [])
+        if self in subscriptions:
+            subscriptions.remove(self)
+        if not subscriptions:
+            self.listener.subscriptions.pop(self.channel, None)
+        self._wake_up()
+
+    async def aclose(self):
+        '''
+        Closes subscription and unlistens the channel if nothing else uses
+        it.
+        '''
+        self.close()
+        await self.listener.release_channel(self.channel)
@@ -1,5 +1,11 @@
 CREATE TRIGGER {{ trigger_name }}
     AFTER INSERT OR UPDATE OR DELETE ON {{ table_name }}
     FOR EACH ROW EXECUTE PROCEDURE {{ trigger_fn_name }}();
+{%- if per_transaction %}
+CREATE CONSTRAINT TRIGGER {{ flush_trigger_name }}
+    AFTER INSERT OR UPDATE OR DELETE ON {{ table_name }}
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE PROCEDURE {{ flush_fn_name }}();
+{%- endif %}
 
 
@@ -1,3 +1,6 @@
 DROP TRIGGER IF EXISTS {{ trigger_name }} ON {{ table_name }};
+{%- if per_transaction %}
+DROP TRIGGER IF EXISTS {{ flush_trigger_name }} ON {{ table_name }};
+{%- endif %}
 
 
@@ -0,0 +1,31 @@
+CREATE OR REPLACE FUNCTION {{ schema|quote_ident }}.{{ trigger_fn_name|quote_ident }}() RETURNS TRIGGER AS $$
+    DECLARE
+	row RECORD;
+	channel TEXT;
+    BEGIN
+        IF (TG_OP = 'DELETE')
+	THEN
+		row := OLD;
+	ELSE
+		row := NEW;
+        END IF;
+        IF (TG_NARGS > 0)
+	THEN
+		channel := TG_ARGV[0];
+	ELSE
+		channel := TG_TABLE_NAME;
+        END IF;
+{%- if envelope %}
+        PERFORM pg_notify(channel,
+		'{{ envelope_prefix }}' || extract(epoch from clock_timestamp())
+		|| ' ' || txid_current()
+		|| ' ' || TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME
+		|| E'\n' || TG_OP || ' ' || to_json(row)::text);
+{%- else %}
+        PERFORM pg_notify(channel, TG_OP || ' ' || to_json(row)::text);
+{%- endif %}
+	RETURN row;
+    END;
+$$ LANGUAGE plpgsql;
+
+
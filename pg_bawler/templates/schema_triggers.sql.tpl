@@ -0,0 +1,32 @@
+DO $$
+    DECLARE
+	tbl RECORD;
+    BEGIN
+        FOR tbl IN
+		SELECT table_schema, table_name
+		FROM information_schema.tables
+		WHERE table_schema = {{ schema|quote_literal }}
+			AND table_name LIKE {{ table_pattern|quote_literal }}
+			AND table_type = 'BASE TABLE'
+		ORDER BY table_name
+        LOOP
+{%- if drop %}
+		EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I.%I',
+			{{ trigger_name|quote_literal }},
+			tbl.table_schema, tbl.table_name);
+{%- endif %}
+{%- if create %}
+		EXECUTE format(
+			'CREATE TRIGGER %I'
+			' AFTER INSERT OR UPDATE OR DELETE ON %I.%I'
+			' FOR EACH ROW EXECUTE PROCEDURE %I.%I(%L)',
+			{{ trigger_name|quote_literal }},
+			tbl.table_schema, tbl.table_name,
+			{{ schema|quote_literal }}, {{ trigger_fn_name|quote_literal }},
+			{{ channel_prefix|quote_literal }} || tbl.table_name);
+{%- endif %}
+        END LOOP;
+    END;
+$$;
+
+
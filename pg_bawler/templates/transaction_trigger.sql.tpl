@@ -0,0 +1,92 @@
+CREATE OR REPLACE FUNCTION {{ trigger_fn_name }}() RETURNS TRIGGER AS $$
+    DECLARE
+	row RECORD;
+    BEGIN
+        IF (TG_OP = 'DELETE')
+	THEN
+		row := OLD;
+	ELSE
+		row := NEW;
+        END IF;
+        IF to_regclass('pg_temp.bawler_tx_changes') IS NULL
+	THEN
+		CREATE TEMP TABLE bawler_tx_changes (
+			id BIGSERIAL,
+			channel TEXT,
+			op TEXT,
+			key JSONB
+		) ON COMMIT DELETE ROWS;
+        END IF;
+        INSERT INTO pg_temp.bawler_tx_changes (channel, op, key)
+		VALUES ('{{ channel }}', TG_OP, jsonb_build_object(
+{%- for column in key_columns %}
+			'{{ column }}', row.{{ column }}{% if not loop.last %},{% endif %}
+{%- endfor %}));
+	RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION {{ flush_fn_name }}() RETURNS TRIGGER AS $$
+    DECLARE
+	change RECORD;
+	changes TEXT := '';
+	last_id TEXT;
+    BEGIN
+        -- fires for every changed row at commit, the first one sends
+        -- all changes of the transaction, the rest return right away
+        -- unless rows were changed since (SET CONSTRAINTS ... IMMEDIATE)
+        IF to_regclass('pg_temp.bawler_tx_changes') IS NULL
+	THEN
+		RETURN NULL;
+        END IF;
+        SELECT last_value::text INTO last_id
+		FROM pg_temp.bawler_tx_changes_id_seq;
+        IF current_setting('{{ flush_setting }}', true) = last_id
+	THEN
+		RETURN NULL;
+        END IF;
+        -- the last operation of every key, in order of the last changes
+        FOR change IN
+		SELECT entry FROM (
+			SELECT DISTINCT ON (key) id,
+				json_build_array(op, key)::text AS entry
+			FROM pg_temp.bawler_tx_changes
+			WHERE channel = '{{ channel }}'
+			ORDER BY key, id DESC
+		) AS last_changes
+		ORDER BY id
+        LOOP
+		-- 'TRANSACTION [' || changes || ']' fits into {{ chunk_size }} bytes
+		IF changes <> '' AND octet_length(changes)
+			+ octet_length(change.entry) + 15 > {{ chunk_size }}
+		THEN
+			PERFORM pg_notify('{{ channel }}',
+				'TRANSACTION [' || changes || ']');
+			changes := '';
+		END IF;
+		IF octet_length(change.entry) + 14 > {{ max_payload_size }}
+		THEN
+			-- pg_notify would fail and abort the commit
+			RAISE WARNING 'pg_bawler: key too long to notify %: %',
+				'{{ channel }}', change.entry;
+		ELSIF changes = ''
+		THEN
+			changes := change.entry;
+		ELSE
+			changes := changes || ',' || change.entry;
+		END IF;
+        END LOOP;
+        IF changes <> ''
+	THEN
+		PERFORM pg_notify('{{ channel }}',
+			'TRANSACTION [' || changes || ']');
+        END IF;
+        DELETE FROM pg_temp.bawler_tx_changes
+		WHERE channel = '{{ channel }}';
+        PERFORM set_config('{{ flush_setting }}', last_id, true);
+	RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+
+
@@ -1,6 +1,9 @@
 CREATE OR REPLACE FUNCTION {{ trigger_fn_name }}() RETURNS TRIGGER AS $$
     DECLARE
 	row RECORD;
+{%- if shards %}
+	channel TEXT;
+{%- endif %}
     BEGIN
         IF (TG_OP = 'DELETE')
 	THEN
@@ -8,7 +11,24 @@ CREATE OR REPLACE FUNCTION {{ trigger_fn_name }}() RETURNS TRIGGER AS $$
 	ELSE
 		row := NEW;
         END IF;
-        PERFORM pg_notify('{{ channel }}', TG_OP || ' ' || to_json(row)::text);
+{%- if shards %}
+        channel := '{{ channel }}_' || (((hashtext(concat_ws(',',
+{%- for column in shard_key %} row.{{ column }}{% if not loop.last %},{% endif %}{% endfor %}))
+		% {{ shards }}) + {{ shards }}) % {{ shards }});
+{%- endif %}
+{%- if envelope %}
+        PERFORM pg_notify({% if shards %}channel{% else %}'{{ channel }}'{% endif %},
+		'{{ envelope_prefix }}' || extract(epoch from clock_timestamp())
+		|| ' ' || txid_current()
+{%- if origin %}
+		|| ' ' || '{{ origin }}'
+{%- else %}
+		|| ' ' || TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME
+{%- endif %}
+		|| E'\n' || TG_OP || ' ' || to_json(row)::text);
+{%- else %}
+        PERFORM pg_notify({% if shards %}channel{% else %}'{{ channel }}'{% endif %}, TG_OP || ' ' || to_json(row)::text);
+{%- endif %}
 	RETURN row;
     END;
 $$ LANGUAGE plpgsql;
@@ -0,0 +1,103 @@
+'''
+=================
+pg_bawler.tracing
+=================
+
+End-to-end latency tracing of notifications.
+
+Triggers generated with ``python -m pg_bawler.gen_sql --envelope`` and
+senders with ``envelope = True`` prepend an envelope line to the payload::
+
+    @bawler <clock_timestamp epoch> <txid> <origin>
+    INSERT {"id": 1, ...}
+
+Listener strips the envelope before handing the notification to handlers
+and, if it has :class:`LatencyTracer` configured, records latencies of
+sampled notifications into histograms.
+'''
+import collections
+import random
+import time
+
+import pg_bawler.metrics
+
+#: Payload prefix marking enveloped notification
+ENVELOPE_PREFIX = '@bawler '
+
+Envelope = collections.namedtuple('Envelope', 'timestamp txid origin')
+
+
+def wrap_envelope(payload, *, timestamp, txid, origin):
+    '''
+    Builds enveloped payload on python side. Mostly useful for tests, database
+    side of things is handled in generated triggers and sender statement.
+    '''
+    return '{prefix}{timestamp} {txid} {origin}\n{payload}'.format(
+        prefix=ENVELOPE_PREFIX,
+        timestamp=timestamp,
+        txid=txid,
+        origin=origin,
+        payload=payload)
+
+
+def parse_envelope(payload):
+    '''
+    Splits ``payload`` into :class:`Envelope` and the original payload.
+
+    :returns: Tuple ``(envelope, payload)``, ``envelope`` is ``None`` if
+        ``payload`` is not enveloped.
+    '''
+    if not payload.startswith(ENVELOPE_PREFIX):
+        return None, payload
+    header, separator, body = payload.partition('\n')
+    if not separator:
+        return None, payload
+    try:
+        _, timestamp, txid, origin = header.split(' ', 3)
+        envelope = Envelope(float(timestamp), int(txid), origin)
+    except ValueError:
+        return None, payload
+    return envelope, body
+
+
+class LatencyTracer:
+    '''
+    Records latencies of sampled enveloped notifications.
+
+    * ``db_to_listener`` - from ``clock_timestamp()`` in the database to
+      the moment listener received the notification. Includes clock skew
+      between database server and listener host.
+    * ``listener_to_handler`` - from receiving the notification to the moment
+      handler finished.
+
+    :param sample_rate: Fraction of enveloped notifications to trace.
+    :param registry: :class:`pg_bawler.metrics.MetricsRegistry` to publish
+        histograms into.
+    :param prefix: Prefix of published histogram names.
+    '''
+
+    def __init__(self, sample_rate=0.01, *, registry=None, prefix='pg_bawler'):
+        self.sample_rate = sample_rate
+        registry = registry or pg_bawler.metrics.REGISTRY
+        self.db_to_listener = registry.histogram(
+            '{}.db_to_listener_seconds'.format(prefix))
+        self.listener_to_handler = registry.histogram(
+            '{}.listener_to_handler_done_seconds'.format(prefix))
+
+    def should_sample(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def observe_received(self, envelope, received_at=None):
+        received_at = time.time() if received_at is None else received_at
+        self.db_to_listener.observe(max(0.0, received_at - envelope.timestamp))
+
+    async def trace_handler(self, coro, received_monotonic):
+        '''
+        Awaits handler's ``coro`` and records time since
+        ``received_monotonic``.
+        '''
+        try:
+            return await coro
+        finally:
+            self.listener_to_handler.observe(
+                time.monotonic() - received_monotonic)
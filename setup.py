@@ -9,9 +9,18 @@ setuptools.setup(
     long_description=open('README.rst').read(),
     packages=setuptools.find_packages(),
     install_requires=[],
+    extras_require={
+        'asyncpg': ['asyncpg'],
+        'uvloop': ['uvloop'],
+    },
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 )
@@ -2,7 +2,18 @@ import io
 import os
 from textwrap import dedent
 
+import pg_bawler.drivers
+import pg_bawler.groups
+import pg_bawler.listener
 from pg_bawler import bawlerd
+from pg_bawler.bawlerd import daemon
+
+
+def handler_factory(**config):
+    async def handler(notification, listener):
+        pass
+    handler.config = config
+    return handler
 
 
 class TestBawlerdConfig:
@@ -67,3 +78,194 @@ class TestBawlerdConfig:
         merged = bawlerd.conf._merge_configs(base, precede)
         assert merged['handlers']['default']['level'] == 'DEBUG'
         assert merged['handlers']['default']['class'] == 'logging.StreamHandler'  # NOQA
+
+
+class TestBawlerdDaemon:
+
+    def test_build_listener(self, event_loop):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'aiopg',
+                'listen_timeout': 10,
+                'channels': [
+                    {
+                        'name': 'clients',
+                        'handlers': [
+                            {'call': 'pg_bawler.listener:default_handler'},
+                            {
+                                'call': 'test_bawlerd:handler_factory',
+                                'config': {'key': 'value'},
+                            },
+                        ],
+                    },
+                    {'name': 'contracts'},
+                ],
+            },
+            {'listen_timeout': 40, 'stop_on_timeout': True},
+            loop=event_loop)
+        assert isinstance(listener.driver, pg_bawler.drivers.AiopgDriver)
+        assert listener.listen_timeout == 10
+        assert listener.stop_on_timeout
+        handlers = listener.registered_channels['clients']
+        assert handlers[0] is pg_bawler.listener.default_handler
+        assert handlers[1].config == {'key': 'value'}
+        assert listener.registered_channels['contracts'] == []
+
+    def test_build_listener_monitor(self, event_loop):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'monitor': {
+                    'interval': 1,
+                    'critical_threshold': 0.5,
+                    'alerts': [{
+                        'call': 'test_bawlerd:handler_factory',
+                        'config': {'key': 'value'},
+                    }],
+                },
+            },
+            loop=event_loop)
+        monitor = listener.queue_monitor
+        assert monitor.listener is listener
+        assert monitor.interval == 1
+        assert monitor.critical_threshold == 0.5
+        assert monitor.alert_callbacks[-1].config == {'key': 'value'}
+
+    def test_build_listener_admission(self, event_loop):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'channels': [
+                    {'name': 'clients', 'priority': 10},
+                    {
+                        'name': 'audit',
+                        'shedding': 'sample',
+                        'sample_percent': 5,
+                    },
+                ],
+            },
+            {'admission': {'max_inflight': 20}},
+            loop=event_loop)
+        admission = listener.admission
+        assert admission.max_inflight == 20
+        assert admission.get_policy('clients').priority == 10
+        assert admission.get_policy('audit').policy == 'sample'
+        assert admission.get_policy('audit').percent == 5
+
+    def test_build_listener_spool(self, event_loop, tmpdir):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'spool': {'directory': str(tmpdir), 'memory_limit': 5},
+            },
+            loop=event_loop)
+        assert listener.spool.directory == str(tmpdir)
+        assert listener.spool.memory_limit == 5
+        listener.spool.close()
+
+    def test_build_listener_filters(self, event_loop):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'channels': [{
+                    'name': 'clients',
+                    'handlers': [{
+                        'call': 'test_bawlerd:handler_factory',
+                        'config': {},
+                        'match': {'op': 'DELETE'},
+                        'project': ['id'],
+                    }],
+                }],
+            },
+            loop=event_loop)
+        handler, = listener.registered_channels['clients']
+        event_filter, = listener.handler_filters[('clients', handler)]
+        assert event_filter.project == ('id', )
+        assert event_filter.match is not None
+
+    def test_build_listener_group(self, event_loop):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'group': {'members': 2, 'member': 1},
+                'channels': [{
+                    'name': 'clients',
+                    'shards': 4,
+                    'handlers': [{'call': 'test_bawlerd:handler_factory'}],
+                }],
+            },
+            loop=event_loop)
+        assert sorted(listener.registered_channels) == [
+            'clients_1', 'clients_3']
+        assert len(listener.registered_channels['clients_1']) == 1
+
+    def test_build_listener_advisory_group(self, event_loop):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'group': {'mode': 'advisory', 'interval': 1},
+                'channels': [{'name': 'clients', 'shards': 4}],
+            },
+            loop=event_loop)
+        group, = listener.consumer_groups
+        assert isinstance(group, pg_bawler.groups.AdvisoryLockGroup)
+        assert group.interval == 1
+        assert not listener.registered_channels
+
+    def test_build_listener_relay(self, event_loop, tmpdir):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'relay': {
+                    'path': str(tmpdir.join('relay.sock')),
+                    'max_buffer': 4096,
+                },
+            },
+            loop=event_loop)
+        assert listener.relay.path == str(tmpdir.join('relay.sock'))
+        assert listener.relay.max_buffer == 4096
+
+    def test_build_listener_retry(self, event_loop, tmpdir):
+        listener = daemon.build_listener(
+            {
+                'connection_params': {'dbname': 'clients'},
+                'driver': 'memory',
+                'retry': {
+                    'dead_letter': str(tmpdir.join('dead.bawler')),
+                    'max_attempts': 3,
+                },
+                'channels': [{
+                    'name': 'clients',
+                    'handlers': [
+                        {
+                            'call': 'test_bawlerd:handler_factory',
+                            'config': {},
+                            'retry': {'max_attempts': 10},
+                        },
+                        {
+                            'call': 'test_bawlerd:handler_factory',
+                            'config': {},
+                            'retry': None,
+                        },
+                        {
+                            'call': 'test_bawlerd:handler_factory',
+                            'config': {},
+                        },
+                    ],
+                }],
+            },
+            loop=event_loop)
+        retry = listener.retry
+        first, second, third = listener.registered_channels['clients']
+        assert retry.dead_letter == str(tmpdir.join('dead.bawler'))
+        assert retry.get_policy(first).max_attempts == 10
+        assert retry.get_policy(second) is None
+        assert retry.get_policy(third).max_attempts == 3
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.events
+import pg_bawler.metrics
+from pg_bawler.cache import NotificationCache
+from pg_bawler.listener import NotificationListener
+
+
+class Loader:
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+        self.version = 0
+
+    async def __call__(self, table, key):
+        self.calls.append((table, key))
+        await self.release.wait()
+        return '{}:{}:{}'.format(table, key[0], self.version)
+
+
+def event(payload, channel='users'):
+    return pg_bawler.events.ChangeEvent(
+        pg_bawler.core.Notification(1, channel, payload))
+
+
+@pytest.fixture
+def registry():
+    return pg_bawler.metrics.MetricsRegistry()
+
+
+@pytest.fixture
+def loader():
+    return Loader()
+
+
+@pytest.fixture
+def cache(loader, registry):
+    return NotificationCache(loader, maxsize=2, registry=registry)
+
+
+@pytest.mark.asyncio
+async def test_read_through_and_lru(cache, loader, registry):
+    assert await cache.get('users', 1) == 'users:1:0'
+    assert await cache.get('users', (1, )) == 'users:1:0'
+    await cache.get('users', 2)
+    await cache.get('users', 1)
+    await cache.get('users', 3)
+    assert ('users', 1) in cache
+    assert ('users', 2) not in cache
+    assert loader.calls == [
+        ('users', (1, )), ('users', (2, )), ('users', (3, ))]
+    snapshot = registry.snapshot()
+    assert snapshot['pg_bawler.cache.hits']['value'] == 2
+    assert snapshot['pg_bawler.cache.misses']['value'] == 3
+    assert snapshot['pg_bawler.cache.evictions']['value'] == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl(loader, registry):
+    cache = NotificationCache(loader, ttl=0.01, registry=registry)
+    await cache.get('users', 1)
+    await asyncio.sleep(0.02)
+    await cache.get('users', 1)
+    assert len(loader.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_coalesced_load(cache, loader):
+    loader.release.clear()
+    waiters = [
+        asyncio.ensure_future(cache.get('users', 1)) for _ in range(5)]
+    await asyncio.sleep(0)
+    loader.release.set()
+    assert await asyncio.gather(*waiters) == ['users:1:0'] * 5
+    assert len(loader.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_load(cache, loader):
+    loader.release.clear()
+    waiter = asyncio.ensure_future(cache.get('users', 1))
+    await asyncio.sleep(0)
+    await cache.handle_notification(event('UPDATE {"id": 1}'), None)
+    loader.release.set()
+    assert await waiter == 'users:1:0'
+    assert ('users', 1) not in cache
+
+
+@pytest.mark.asyncio
+async def test_notifications_evict(cache, loader, registry):
+    await cache.get('users', 1)
+    await cache.get('users', 2)
+    await cache.handle_notification(event('UPDATE {"id": 1}'), None)
+    assert ('users', 1) not in cache
+    assert ('users', 2) in cache
+    await cache.handle_notification(event('TRUNCATE {}'), None)
+    assert not len(cache)
+    await cache.get('users', 2)
+    await cache.handle_notification(event('not json'), None)
+    assert not len(cache)
+    assert registry.snapshot()['pg_bawler.cache.invalidations'][
+        'value'] == 3
+
+
+@pytest.mark.asyncio
+async def test_transaction_notification_evicts_listed_keys(cache):
+    await cache.get('users', 1)
+    await cache.get('users', 2)
+    await cache.handle_notification(event(
+        'TRANSACTION [["UPDATE", {"id": 1}], ["DELETE", {"id": 3}]]'), None)
+    assert ('users', 1) not in cache
+    assert ('users', 2) in cache
+
+
+@pytest.mark.asyncio
+async def test_flush_on_reconnect(cache):
+    listener = NotificationListener({}, driver='memory')
+    listener.reconnect_interval = 0
+    cache.attach(listener, 'users')
+    await listener.register_channel('users')
+    await cache.get('users', 1)
+    (await listener.pg_connection()).break_connection()
+    await listener._listen()
+    assert not len(cache)
+    assert listener.registered_channels['users'] == [
+        cache.handle_notification]
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_flush_after_failed_reconnect_callback(cache):
+    listener = NotificationListener({}, driver='memory')
+    listener.reconnect_interval = 0
+
+    async def failing(listener):
+        raise RuntimeError('boom')
+
+    listener.add_reconnect_callback(failing)
+    cache.attach(listener, 'users')
+    await listener.register_channel('users')
+    await cache.get('users', 1)
+    (await listener.pg_connection()).break_connection()
+    await listener._listen()
+    assert not len(cache)
+    # listener keeps listening
+    await cache.get('users', 1)
+    listener.driver.notifies(await listener.pg_connection()).put_nowait(
+        pg_bawler.core.Notification(1, 'users', 'DELETE {"id": 1}'))
+    await listener._listen()
+    await listener.drain()
+    assert ('users', 1) not in cache
+    await listener.drop_connection()
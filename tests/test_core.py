@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 import pg_bawler.core
@@ -7,3 +9,22 @@ import pg_bawler.core
 async def test_drop_connection_has_cache_attr():
     base = pg_bawler.core.BawlerBase(None)
     await base.drop_connection()
+
+
+def test_new_event_loop():
+    loop = pg_bawler.core.new_event_loop('asyncio')
+    try:
+        assert asyncio.get_event_loop() is loop
+    finally:
+        loop.close()
+
+
+def test_new_event_loop_not_available():
+    with pytest.raises(pg_bawler.core.PgBawlerException):
+        pg_bawler.core.new_event_loop('nonexistent_loop_module:new_loop')
+
+
+@pytest.mark.asyncio
+async def test_loop_defaults_to_running_loop():
+    base = pg_bawler.core.BawlerBase(None)
+    assert base.loop is asyncio.get_event_loop()
@@ -0,0 +1,66 @@
+import pytest
+
+import pg_bawler.drivers
+
+
+def test_get_driver():
+    driver = pg_bawler.drivers.get_driver()
+    assert isinstance(driver, pg_bawler.drivers.AiopgDriver)
+    assert pg_bawler.drivers.get_driver(driver) is driver
+    assert isinstance(
+        pg_bawler.drivers.get_driver('pg_bawler.drivers:AiopgDriver'),
+        pg_bawler.drivers.AiopgDriver)
+    assert isinstance(
+        pg_bawler.drivers.get_driver(pg_bawler.drivers.AiopgDriver),
+        pg_bawler.drivers.AiopgDriver)
+
+
+def test_get_unknown_driver():
+    with pytest.raises(pg_bawler.drivers.PgBawlerDriverError):
+        pg_bawler.drivers.get_driver('nonexistent')
+
+
+def test_drivers_get_own_instances():
+    assert (
+        pg_bawler.drivers.get_driver('aiopg') is not
+        pg_bawler.drivers.get_driver('aiopg'))
+
+
+@pytest.mark.parametrize('params, expected', [
+    (
+        {'dsn': 'dbname=test user=postgres host=db port=5433'},
+        {'database': 'test', 'user': 'postgres', 'host': 'db', 'port': 5433},
+    ),
+    (
+        {'dsn': 'postgres://postgres@db/test'},
+        {'dsn': 'postgres://postgres@db/test'},
+    ),
+    (
+        {'dbname': 'test', 'user': 'postgres', 'password': ''},
+        {'database': 'test', 'user': 'postgres', 'password': ''},
+    ),
+    (
+        {'dbname': 'test', 'minsize': 0, 'maxsize': 4},
+        {'database': 'test', 'min_size': 0, 'max_size': 4},
+    ),
+])
+def test_get_asyncpg_connection_params(params, expected):
+    assert pg_bawler.drivers.get_asyncpg_connection_params(params) == expected
+
+
+@pytest.mark.asyncio
+async def test_asyncpg_pool_size(monkeypatch):
+    pytest.importorskip('asyncpg')
+    driver = pg_bawler.drivers.get_driver('asyncpg')
+    calls = []
+
+    async def create_pool(**kwargs):
+        calls.append(kwargs)
+
+    monkeypatch.setattr(driver.asyncpg, 'create_pool', create_pool)
+    await driver.create_pool({'dbname': 'test'})
+    await driver.create_pool({'dbname': 'test', 'minsize': 5})
+    assert calls == [
+        {'loop': None, 'database': 'test', 'min_size': 1, 'max_size': 2},
+        {'loop': None, 'database': 'test', 'min_size': 5, 'max_size': 5},
+    ]
@@ -0,0 +1,88 @@
+import pytest
+
+import pg_bawler.core
+import pg_bawler.events
+import pg_bawler.tracing
+
+
+def make_event(payload, envelope=None, **kwargs):
+    return pg_bawler.events.ChangeEvent(
+        pg_bawler.core.Notification(42, 'foo', payload), envelope, **kwargs)
+
+
+def test_change_event():
+    event = make_event('UPDATE {"id": 1, "name": "bar"}')
+    assert event.pid == 42
+    assert event.channel == 'foo'
+    assert event.op == 'UPDATE'
+    assert event.row == {'id': 1, 'name': 'bar'}
+    assert event.keys == (1, )
+    assert event.table == 'foo'
+    assert event.schema is None
+
+
+def test_change_event_decodes_once(monkeypatch):
+    calls = []
+
+    def loads(data):
+        calls.append(data)
+        return {'id': 1}
+
+    monkeypatch.setattr(pg_bawler.events, 'json_loads', loads)
+    event = make_event('INSERT {"id": 1}')
+    assert event.row is event.row
+    assert event.keys == (1, )
+    assert calls == ['{"id": 1}']
+
+
+def test_change_event_without_operation():
+    event = make_event('{"id": 1}')
+    assert event.op is None
+    assert event.row == {'id': 1}
+
+
+def test_change_event_envelope_origin():
+    event = make_event(
+        'DELETE {"tenant": 1, "code": "x"}',
+        pg_bawler.tracing.Envelope(0.0, 1, 'billing.invoices'),
+        key_columns=('tenant', 'code'))
+    assert event.schema == 'billing'
+    assert event.table == 'invoices'
+    assert event.keys == (1, 'x')
+    assert 'DELETE' in repr(event)
+
+
+def test_change_event_sender_origin():
+    event = make_event(
+        'DELETE {"id": 1}',
+        pg_bawler.tracing.Envelope(0.0, 1, 'web1.example.com:123'))
+    assert event.schema is None
+    assert event.table == 'foo'
+
+
+def test_change_event_has_no_dict():
+    assert not hasattr(make_event('INSERT {}'), '__dict__')
+
+
+def test_transaction_changes():
+    event = make_event(
+        'TRANSACTION [["INSERT", {"id": 1}], ["DELETE", {"id": 2}]]')
+    assert event.op == 'TRANSACTION'
+    assert event.changes == [('INSERT', {'id': 1}), ('DELETE', {'id': 2})]
+    assert make_event('UPDATE {"id": 1}').changes == [('UPDATE', {'id': 1})]
+    with pytest.raises(ValueError):
+        event.keys
+    with pytest.raises(ValueError):
+        make_event('UPDATE [1]').keys
+
+
+def test_change_event_behaves_as_notification():
+    notification = pg_bawler.core.Notification(42, 'foo', 'INSERT {}')
+    event = pg_bawler.events.ChangeEvent(notification)
+    pid, channel, payload = event
+    assert (pid, channel, payload) == notification
+    assert event[2] == event[-1] == 'INSERT {}'
+    assert event == notification
+    assert event == pg_bawler.events.ChangeEvent(notification)
+    assert event != pg_bawler.core.Notification(42, 'foo', 'DELETE {}')
+    assert {event: 1}[notification] == 1
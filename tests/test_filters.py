@@ -0,0 +1,188 @@
+import json
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.events
+import pg_bawler.memory
+import pg_bawler.metrics
+from pg_bawler.filters import compile_filter
+from pg_bawler.filters import compile_match
+from pg_bawler.filters import PgBawlerFilterError
+from pg_bawler.listener import NotificationListener
+from pg_bawler.shedding import AdmissionController
+
+
+def make_event(payload, channel='clients'):
+    return pg_bawler.events.ChangeEvent(
+        pg_bawler.core.Notification(1, channel, payload))
+
+
+def test_match_rules():
+    match = compile_match({
+        'op': ['INSERT', 'UPDATE'],
+        'table': 'clients',
+        'columns': {
+            'status': {'in': ['active', 'pending']},
+            'amount': {'gt': 100, 'le': 1000},
+            'deleted': False,
+        },
+    })
+    row = '{"status": "active", "amount": 200, "deleted": false}'
+    assert match(make_event('INSERT ' + row))
+    assert not match(make_event('DELETE ' + row))
+    assert not match(make_event('INSERT ' + row, channel='contracts'))
+    assert not match(make_event(
+        'UPDATE {"status": "closed", "amount": 200, "deleted": false}'))
+    assert not match(make_event(
+        'UPDATE {"status": "active", "amount": null, "deleted": false}'))
+    assert not match(make_event('UPDATE not json'))
+
+
+def test_op_match_does_not_decode_row(monkeypatch):
+    monkeypatch.setattr(pg_bawler.events, 'json_loads', None)
+    assert not compile_match({'op': 'DELETE'})(make_event('INSERT {}'))
+
+
+def test_match_transaction():
+    match = compile_match({'op': 'TRANSACTION'})
+    event = make_event('TRANSACTION [["INSERT", {"id": 1}]]')
+    assert match(event)
+    assert not match(make_event('INSERT {"id": 1}'))
+    assert not compile_match({'columns': {'id': 1}})(event)
+    assert compile_filter(project=['id'])(event) is event
+
+
+def test_invalid_rules():
+    with pytest.raises(PgBawlerFilterError):
+        compile_match({'operation': 'INSERT'})
+    with pytest.raises(PgBawlerFilterError):
+        compile_match({'op': 'UPSERT'})
+    with pytest.raises(PgBawlerFilterError):
+        compile_match({'columns': {'id': {'like': '%'}}})
+
+
+def test_projection():
+    event_filter = compile_filter(project=['id', 'status'])
+    event = event_filter(make_event(
+        'UPDATE {"id": 1, "status": "active", "note": "long text"}'))
+    assert event.op == 'UPDATE'
+    assert event.row == {'id': 1, 'status': 'active'}
+    assert event.keys == (1, )
+
+
+@pytest.mark.asyncio
+async def test_filtered_events_create_no_tasks():
+    listener = NotificationListener(
+        {'server': pg_bawler.memory.MemoryServer()}, driver='memory')
+    received = []
+
+    async def handler(event, listener):
+        received.append(event.row)
+
+    listener.register_handler(
+        'clients', handler,
+        event_filter=compile_filter({'op': 'INSERT'}, ['id']))
+    listener._dispatch(pg_bawler.core.Notification(
+        1, 'clients', 'UPDATE {"id": 1, "name": "foo"}'))
+    assert listener.handlers_started == 0
+    assert listener.events_filtered == 1
+    listener._dispatch(pg_bawler.core.Notification(
+        1, 'clients', 'INSERT {"id": 2, "name": "bar"}'))
+    await listener.drain()
+    assert received == [{'id': 2}]
+
+    listener.unregister_handler('clients', handler)
+    assert not listener.handler_filters
+
+
+@pytest.mark.asyncio
+async def test_filtered_before_admission():
+    listener = NotificationListener(
+        {'server': pg_bawler.memory.MemoryServer()}, driver='memory')
+    listener.admission = AdmissionController(
+        listener, max_inflight=0, registry=pg_bawler.metrics.MetricsRegistry())
+
+    async def handler(event, listener):
+        pass
+
+    listener.register_handler(
+        'clients', handler, event_filter=compile_filter({'op': 'INSERT'}))
+    listener.register_handler(
+        'clients', handler, event_filter=compile_filter({'op': 'DELETE'}))
+    await listener.register_channel('clients')
+    notifies = listener.driver.notifies(await listener.pg_connection())
+    for op in ('UPDATE', 'INSERT', 'DELETE'):
+        notifies.put_nowait(pg_bawler.core.Notification(
+            1, 'clients', op + ' {"id": 1}'))
+        await listener._listen()
+    # UPDATE wasn't queued, the same handler keeps both of its filters
+    assert listener.admission.queue_depth == 2
+    assert listener.events_filtered == 2
+    listener.admission.max_inflight = 10
+    listener.admission.pump()
+    assert listener.handlers_started == 2
+    assert listener.events_filtered == 4
+    await listener.drain()
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_filtered_once(monkeypatch):
+    decoded = []
+
+    def json_loads(body):
+        decoded.append(body)
+        return json.loads(body)
+
+    monkeypatch.setattr(pg_bawler.events, 'json_loads', json_loads)
+    listener = NotificationListener(
+        {'server': pg_bawler.memory.MemoryServer()}, driver='memory')
+    listener.admission = AdmissionController(
+        listener, max_inflight=0, registry=pg_bawler.metrics.MetricsRegistry())
+    events = []
+
+    async def handler(event, listener):
+        events.append(event.row)
+
+    listener.register_handler(
+        'clients', handler,
+        event_filter=compile_filter({'columns': {'status': 'active'}}))
+    await listener.register_channel('clients')
+    notifies = listener.driver.notifies(await listener.pg_connection())
+    for status in ('active', 'closed'):
+        notifies.put_nowait(pg_bawler.core.Notification(
+            1, 'clients', 'UPDATE {{"status": "{}"}}'.format(status)))
+        await listener._listen()
+    listener.admission.max_inflight = 10
+    listener.admission.pump()
+    await listener.drain()
+    assert events == [{'status': 'active'}]
+    assert len(decoded) == 2
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_refiltered_after_handlers_changed():
+    listener = NotificationListener(
+        {'server': pg_bawler.memory.MemoryServer()}, driver='memory')
+    listener.admission = AdmissionController(
+        listener, max_inflight=0, registry=pg_bawler.metrics.MetricsRegistry())
+    events = []
+
+    async def handler(event, listener):
+        events.append(event.op)
+
+    listener.register_handler(
+        'clients', handler, event_filter=compile_filter({'op': 'INSERT'}))
+    await listener.register_channel('clients')
+    notifies = listener.driver.notifies(await listener.pg_connection())
+    notifies.put_nowait(pg_bawler.core.Notification(
+        1, 'clients', 'INSERT {"id": 1}'))
+    await listener._listen()
+    listener.unregister_handler('clients', handler)
+    listener.admission.max_inflight = 10
+    listener.admission.pump()
+    await listener.drain()
+    assert events == []
+    await listener.drop_connection()
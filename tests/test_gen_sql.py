@@ -1,7 +1,13 @@
 #!/usr/bin/env python
+import hashlib
+import json
+import select
 import sys
 from io import StringIO
 
+import psycopg2
+import pytest
+
 from pg_bawler import gen_sql
 
 
@@ -33,3 +39,179 @@ def test_no_create(monkeypatch):
     gen_sql.main('--no-create', 'foo')
     sql = stdout.getvalue()
     assert 'CREATE TRIGGER' not in sql
+
+
+def test_envelope(monkeypatch):
+    stdout = StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    gen_sql.main('--envelope', '--origin', 'billing', 'foo')
+    sql = stdout.getvalue()
+    assert 'clock_timestamp()' in sql
+    assert 'txid_current()' in sql
+    assert '\'billing\'' in sql
+
+
+def test_shards(monkeypatch):
+    stdout = StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    gen_sql.main(
+        '--shards', '8', '--shard-key', 'tenant', '--shard-key', 'id',
+        '--envelope', 'foo')
+    sql = stdout.getvalue()
+    assert 'hashtext(concat_ws(\',\', row.tenant, row.id))' in sql
+    assert '% 8) + 8) % 8' in sql
+    assert 'pg_notify(channel,' in sql
+
+
+def test_per_transaction(monkeypatch):
+    stdout = StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    gen_sql.main(
+        '--per-transaction', '--key-column', 'id', '--chunk-size', '4000',
+        'foo')
+    sql = stdout.getvalue()
+    assert 'CREATE CONSTRAINT TRIGGER bawler_trigger_foo_flush' in sql
+    assert 'DEFERRABLE INITIALLY DEFERRED' in sql
+    assert 'bawler_trigger_fn_foo_flush()' in sql
+    assert '\'id\', row.id' in sql
+    assert 'octet_length(change.entry) + 15 > 4000' in sql
+    assert 'ORDER BY key, id DESC' in sql
+    assert sql.count('pg_bawler.flushed_{}'.format(
+        hashlib.md5(b'foo').hexdigest())) == 2
+    assert 'DROP TRIGGER IF EXISTS bawler_trigger_foo_flush ON foo' in sql
+
+
+def test_per_transaction_chunk_size_limits():
+    for chunk_size in ('10', '8000'):
+        with pytest.raises(SystemExit):
+            gen_sql.main(
+                '--per-transaction', '--chunk-size', chunk_size, 'foo')
+
+
+def test_per_transaction_wide_keys(pg_server):
+    args = gen_sql.get_default_cli_args_parser().parse_args(
+        ['--per-transaction', 'bawler_wide_keys'])
+    context = gen_sql.create_context_from_args(args)
+    listening = psycopg2.connect(**pg_server['pg_params'])
+    listening.autocommit = True
+    writing = psycopg2.connect(**pg_server['pg_params'])
+    try:
+        with listening.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE bawler_wide_keys (id TEXT PRIMARY KEY)')
+            cursor.execute(gen_sql.get_trigger_function_code(
+                context,
+                tpl_name=gen_sql.get_trigger_function_template(context)))
+            cursor.execute(gen_sql.get_create_trigger_statement(context))
+            cursor.execute('LISTEN bawler_wide_keys')
+        keys = ['{:03}'.format(number) + 'x' * 500 for number in range(40)]
+        with writing.cursor() as cursor:
+            for key in keys:
+                cursor.execute(
+                    'INSERT INTO bawler_wide_keys VALUES (%s)', (key, ))
+            cursor.execute(
+                'DELETE FROM bawler_wide_keys WHERE id = %s', (keys[0], ))
+            cursor.execute(
+                'DELETE FROM bawler_wide_keys WHERE id = %s', (keys[1], ))
+            cursor.execute(
+                'INSERT INTO bawler_wide_keys VALUES (%s)', (keys[1], ))
+        writing.commit()
+        while select.select([listening], [], [], 1) != ([], [], []):
+            listening.poll()
+        payloads = [notify.payload for notify in listening.notifies]
+        assert len(payloads) > 1
+        assert all(len(payload.encode('utf-8')) < 8000 for payload in payloads)
+        changes = [
+            (op, key['id'])
+            for payload in payloads
+            for op, key in json.loads(payload[len('TRANSACTION '):])
+        ]
+        # the last operation of each key, in order of the last changes
+        assert changes == (
+            [('INSERT', key) for key in keys[2:]] +
+            [('DELETE', keys[0]), ('INSERT', keys[1])])
+    finally:
+        writing.close()
+        with listening.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS bawler_wide_keys')
+        listening.close()
+
+
+def test_per_transaction_bulk_flushes_once(pg_server):
+    args = gen_sql.get_default_cli_args_parser().parse_args(
+        ['--per-transaction', 'bawler_bulk'])
+    context = gen_sql.create_context_from_args(args)
+    listening = psycopg2.connect(**pg_server['pg_params'])
+    listening.autocommit = True
+    writing = psycopg2.connect(**pg_server['pg_params'])
+    try:
+        with listening.cursor() as cursor:
+            cursor.execute('CREATE TABLE bawler_bulk (id INT PRIMARY KEY)')
+            cursor.execute(gen_sql.get_trigger_function_code(
+                context,
+                tpl_name=gen_sql.get_trigger_function_template(context)))
+            cursor.execute(gen_sql.get_create_trigger_statement(context))
+            cursor.execute('LISTEN bawler_bulk')
+        with writing.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO bawler_bulk SELECT generate_series(1, 5000)')
+            # fires 5000 deferred triggers now
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute(
+                'SELECT seq_scan FROM pg_stat_xact_user_tables'
+                ' WHERE relname = \'bawler_tx_changes\'')
+            # one select and one delete, not one select per row
+            assert cursor.fetchone()[0] <= 2
+            # rows changed after the flush are sent too
+            cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            cursor.execute('DELETE FROM bawler_bulk WHERE id = 1')
+        writing.commit()
+        while select.select([listening], [], [], 1) != ([], [], []):
+            listening.poll()
+        changes = [
+            op
+            for notify in listening.notifies
+            for op, _ in json.loads(notify.payload[len('TRANSACTION '):])
+        ]
+        assert changes.count('INSERT') == 5000
+        assert changes[-1] == 'DELETE'
+    finally:
+        writing.close()
+        with listening.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS bawler_bulk')
+        listening.close()
+
+
+def test_schema(monkeypatch):
+    stdout = StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    gen_sql.main(
+        '--schema', 'bil"ling', '--channel-prefix', 'billing_', 'inv%')
+    sql = stdout.getvalue()
+    assert sql.count('CREATE OR REPLACE FUNCTION') == 1
+    assert '"bil""ling"."bawler_trigger_fn"()' in sql
+    assert 'channel := TG_ARGV[0];' in sql
+    assert 'table_schema = \'bil"ling\'' in sql
+    assert 'table_name LIKE \'inv%\'' in sql
+    assert '\'billing_\' || tbl.table_name' in sql
+    assert 'DROP TRIGGER IF EXISTS %I ON %I.%I' in sql
+
+
+def test_schema_only_drop(monkeypatch):
+    stdout = StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    gen_sql.main('--schema', 'public', '--only-drop')
+    sql = stdout.getvalue()
+    assert 'CREATE OR REPLACE FUNCTION' not in sql
+    assert 'table_name LIKE \'%\'' in sql
+    assert 'CREATE TRIGGER' not in sql
+
+
+def test_schema_rejects_shards():
+    with pytest.raises(SystemExit):
+        gen_sql.main('--schema', 'public', '--shards', '4')
+
+
+def test_shards_require_envelope():
+    with pytest.raises(SystemExit):
+        gen_sql.main('--shards', '4', 'foo')
@@ -0,0 +1,181 @@
+import asyncio
+import random
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.memory
+from pg_bawler.groups import AdvisoryLockGroup
+from pg_bawler.groups import assign_shards
+from pg_bawler.groups import ConsumerGroup
+from pg_bawler.groups import PgBawlerGroupError
+from pg_bawler.groups import shard_channels
+from pg_bawler.listener import NotificationListener
+
+
+@pytest.fixture
+def server():
+    return pg_bawler.memory.MemoryServer()
+
+
+def make_listener(server):
+    return NotificationListener({'server': server}, driver='memory')
+
+
+def test_assign_shards():
+    assert assign_shards(8, 3, 0) == [0, 3, 6]
+    assert assign_shards(8, 3, 2) == [2, 5]
+    assert sorted(
+        shard for member in range(3) for shard in assign_shards(8, 3, member)
+    ) == list(range(8))
+    with pytest.raises(PgBawlerGroupError):
+        assign_shards(8, 3, 3)
+    assert shard_channels('foo', 2) == ['foo_0', 'foo_1']
+
+
+@pytest.mark.asyncio
+async def test_members_split_shards(server):
+    received = {}
+    listeners = []
+    for member in range(2):
+        listener = make_listener(server)
+
+        async def handler(event, listener, member=member):
+            received.setdefault(member, []).append(event.channel)
+
+        group = ConsumerGroup(
+            listener, 'foo', shards=4, members=2, member=member)
+        group.register_handler(handler)
+        await group.join()
+        listeners.append(listener)
+        assert group.channels == ['foo_{}'.format(member), 'foo_{}'.format(
+            member + 2)]
+
+    for channel in shard_channels('foo', 4):
+        assert len(server.listeners[channel]) == 1
+    for listener in listeners:
+        for channel in shard_channels('foo', 4):
+            if channel in listener.registered_channels:
+                listener._dispatch(
+                    pg_bawler.core.Notification(1, channel, 'INSERT {}'))
+        await listener.drain()
+        await listener.drop_connection()
+    assert received == {0: ['foo_0', 'foo_2'], 1: ['foo_1', 'foo_3']}
+
+
+@pytest.mark.asyncio
+async def test_shard_notifications_handled_in_order(server):
+    listener = make_listener(server)
+    events = []
+
+    async def handler(event, listener):
+        events.append(('start', event.channel, event.payload))
+        # the first change takes the longest
+        await asyncio.sleep(0.01 / int(event.payload))
+        events.append(('end', event.channel, event.payload))
+
+    group = ConsumerGroup(listener, 'foo', shards=2)
+    group.register_handler(handler)
+    tasks = []
+    for payload in ('1', '2', '3', '4'):
+        listener._dispatch(pg_bawler.core.Notification(1, 'foo_0', payload))
+        tasks.extend(listener.handler_tasks - set(tasks))
+    listener._dispatch(pg_bawler.core.Notification(1, 'foo_1', '5'))
+    # cancelled waiting one doesn't let the next run before the running one
+    await asyncio.sleep(0)
+    tasks[1].cancel()
+    await listener.drain()
+    shard = [event for event in events if event[1] == 'foo_0']
+    assert shard == [
+        (state, 'foo_0', payload)
+        for payload in ('1', '3', '4') for state in ('start', 'end')]
+    # other shard doesn't wait
+    assert events[1] == ('start', 'foo_1', '5')
+    assert not listener._ordered_tails
+
+
+@pytest.mark.asyncio
+async def test_advisory_lock_group_rebalances_and_fails_over(server):
+    groups = []
+    for _ in range(2):
+        listener = make_listener(server)
+        listener.reconnect_interval = 0
+        groups.append(AdvisoryLockGroup(
+            listener, 'foo', shards=4, interval=60, lock_key=7))
+    first, second = groups
+
+    await first.rebalance()
+    assert first.assigned == {0, 1, 2, 3}
+    assert len(server.advisory_locks) == 4
+
+    # new member joins, the first one hands over half of its shards
+    await second.rebalance()
+    assert second.members == 2
+    assert not second.assigned
+    await first.rebalance()
+    await second.rebalance()
+    assert len(first.assigned) == len(second.assigned) == 2
+    assert first.assigned.isdisjoint(second.assigned)
+    for shard in second.assigned:
+        channel = 'foo_{}'.format(shard)
+        assert channel in second.listener.registered_channels
+        assert channel not in first.listener.registered_channels
+        assert len(server.listeners[channel]) == 1
+
+    # session of the first member ends, the second takes over
+    await first.listener.drop_connection()
+    await second.rebalance()
+    assert second.members == 1
+    assert second.assigned == {0, 1, 2, 3}
+    await second.listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_advisory_lock_group_reconnect(server):
+    listener = make_listener(server)
+    listener.reconnect_interval = 0
+    group = AdvisoryLockGroup(listener, 'foo', shards=2, lock_key=7)
+    await group.rebalance()
+    connection = await listener.pg_connection()
+    connection.break_connection()
+    # shard 0 is taken by another session meanwhile
+    other = server.connect()
+    server._advisory_lock(other, 'pg_try_advisory_lock', (7, 1))
+    listened = []
+    # runs before group's callback, shards aren't listened on unchecked
+    listener.reconnect_callbacks.insert(0, lambda listener: listened.append(
+        bool(server.listeners['foo_0'] or server.listeners['foo_1'])))
+    await listener._listen()
+    assert listened == [False]
+    assert group.assigned == {1}
+    assert 'foo_0' not in listener.registered_channels
+    assert not server.listeners['foo_0']
+    assert server.listeners['foo_1']
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_advisory_lock_group_shares_connection(server, monkeypatch):
+    server.latency = 0.001
+    # concurrent rebalancing would claim the same shards
+    monkeypatch.setattr(random, 'randrange', lambda stop: 0)
+    listener = make_listener(server)
+    listener.reconnect_interval = 0
+    group = AdvisoryLockGroup(listener, 'foo', shards=4, lock_key=7)
+
+    async def handler(event, listener):
+        pass
+
+    group.register_handler(handler)
+    await asyncio.gather(
+        group.rebalance(),
+        group.handle_reconnect(listener),
+        listener.register_channel('bar'),
+        listener.pg_fetchone('SELECT 1'))
+    assert group.assigned == {0, 1, 2, 3}
+    for shard in range(4):
+        assert server.listeners['foo_{}'.format(shard)]
+        # claimed once
+        assert listener.registered_channels['foo_{}'.format(shard)] == [
+            handler]
+    await listener.drop_connection()
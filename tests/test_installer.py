@@ -0,0 +1,200 @@
+import psycopg2
+import pytest
+
+import pg_bawler.installer
+import pg_bawler.memory
+from pg_bawler import gen_sql
+from pg_bawler.installer import expected_functions
+from pg_bawler.installer import expected_triggers
+from pg_bawler.installer import plan_changes
+from pg_bawler.installer import TriggerInstaller
+
+
+def make_context(*argv):
+    return gen_sql.create_context_from_args(
+        gen_sql.get_default_cli_args_parser().parse_args(argv))
+
+
+def installed(context):
+    functions = {
+        name: source
+        for name, (source, _) in expected_functions(context).items()
+    }
+    triggers = {
+        name: definition
+        for name, (definition, _) in expected_triggers(context).items()
+    }
+    return functions, triggers
+
+
+class CatalogInstaller(TriggerInstaller):
+    '''
+    Installer reading catalog from dictionaries and recording statements.
+    '''
+
+    def __init__(self, context, functions, triggers, *, fail_on=None):
+        super().__init__({}, context, driver='memory')
+        self.functions = functions
+        self.triggers = triggers
+        self.fail_on = fail_on
+        self.executed = []
+
+    async def pg_fetchone(self, statement):
+        for name, source in self.functions.items():
+            if '\'{}()\''.format(name) in statement:
+                return (source, )
+        return None
+
+    async def pg_fetchall(self, statement):
+        return [
+            (name, ) + definition
+            for name, definition in self.triggers.items()
+        ]
+
+    async def pg_execute(self, statement):
+        self.executed.append(statement)
+        if self.fail_on is not None and statement.startswith(self.fail_on):
+            raise pg_bawler.memory.PgBawlerMemoryStatementError(statement)
+
+
+def test_default_tpl_loader_is_cached():
+    assert gen_sql.get_default_tpl_loader() is gen_sql.get_default_tpl_loader()
+
+
+def test_plan_fresh_table():
+    context = make_context('foo')
+    statements = plan_changes(context, {}, {})
+    assert len(statements) == 2
+    assert statements[0].startswith(
+        'CREATE OR REPLACE FUNCTION bawler_trigger_fn_foo()')
+    assert statements[0].endswith('LANGUAGE plpgsql;')
+    assert statements[1].startswith('CREATE TRIGGER bawler_trigger_foo')
+
+
+def test_plan_up_to_date():
+    context = make_context('--per-transaction', 'foo')
+    assert plan_changes(context, *installed(context)) == []
+
+
+def test_plan_changed_function_keeps_trigger():
+    functions, triggers = installed(make_context('foo'))
+    statements = plan_changes(
+        make_context('--envelope', 'foo'), functions, triggers)
+    assert len(statements) == 1
+    assert 'clock_timestamp()' in statements[0]
+
+
+def test_plan_drops_stale_flush_trigger():
+    functions, triggers = installed(make_context('--per-transaction', 'foo'))
+    statements = plan_changes(make_context('foo'), functions, triggers)
+    assert 'DROP TRIGGER bawler_trigger_foo_flush ON foo;' in statements
+    # main trigger calls the replaced function, so it's kept
+    assert not [s for s in statements if s.startswith('CREATE TRIGGER')]
+
+
+def test_plan_recreates_changed_trigger():
+    context = make_context('foo')
+    functions, triggers = installed(context)
+    triggers['bawler_trigger_foo'] = ('other_fn', 29, False, False)
+    assert plan_changes(context, functions, triggers) == [
+        'DROP TRIGGER bawler_trigger_foo ON foo;',
+        expected_triggers(context)['bawler_trigger_foo'][1],
+    ]
+
+
+def test_plan_mixed_case_names():
+    context = make_context('--per-transaction', 'MyTable')
+    functions, triggers = installed(context)
+    # as returned by pg_trigger and pg_proc
+    triggers = {
+        name.lower(): (function, ) + tuple(rest)
+        for name, (function, *rest) in triggers.items()
+    }
+    assert plan_changes(context, functions, triggers) == []
+
+    context = make_context('--trigger', '"MyTrigger"', 'foo')
+    functions, triggers = installed(context)
+    assert set(triggers) == {'"MyTrigger"'}
+    triggers = {'MyTrigger': triggers['"MyTrigger"']}
+    assert plan_changes(context, functions, triggers) == []
+
+
+@pytest.mark.asyncio
+async def test_install_in_one_transaction():
+    installer = CatalogInstaller(make_context('foo'), {}, {})
+    installer.lock_timeout = 1.5
+    statements = await installer.install()
+    assert installer.executed == (
+        ['BEGIN', 'SET LOCAL lock_timeout = \'1500ms\''] +
+        statements + ['COMMIT'])
+
+    context = make_context('foo')
+    installer = CatalogInstaller(context, *installed(context))
+    assert await installer.install() == []
+    assert installer.executed[-1] == 'COMMIT'
+
+
+@pytest.mark.asyncio
+async def test_install_rolls_back():
+    installer = CatalogInstaller(
+        make_context('foo'), {}, {}, fail_on='CREATE TRIGGER')
+    with pytest.raises(pg_bawler.memory.PgBawlerMemoryStatementError):
+        await installer.install()
+    assert installer.executed[-1] == 'ROLLBACK'
+    assert 'COMMIT' not in installer.executed
+
+
+@pytest.mark.asyncio
+async def test_install_keeps_error_when_rollback_fails():
+
+    class DisconnectedInstaller(CatalogInstaller):
+
+        async def pg_execute(self, statement):
+            if statement == 'ROLLBACK':
+                raise pg_bawler.memory.PgBawlerMemoryConnectionError(
+                    'connection already closed')
+            await super().pg_execute(statement)
+
+    installer = DisconnectedInstaller(
+        make_context('foo'), {}, {}, fail_on='CREATE TRIGGER')
+    with pytest.raises(pg_bawler.memory.PgBawlerMemoryStatementError):
+        await installer.install()
+    assert 'COMMIT' not in installer.executed
+
+
+@pytest.mark.asyncio
+async def test_install_on_server(pg_server):
+    connection = psycopg2.connect(**pg_server['pg_params'])
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute('CREATE TABLE bawler_installed (id INT PRIMARY KEY)')
+    try:
+        for argv, changes in [
+            ((), 2),
+            ((), 0),
+            (('--per-transaction', ), 3),
+            (('--per-transaction', ), 0),
+            ((), 2),
+        ]:
+            installer = TriggerInstaller(
+                pg_server['pg_params'],
+                make_context(*argv, 'bawler_installed'))
+            async with installer:
+                assert len(await installer.install()) == changes
+                # what's installed is what's expected
+                assert await installer.plan() == []
+        cursor.execute(
+            'SELECT tgname FROM pg_trigger'
+            ' WHERE tgrelid = \'bawler_installed\'::regclass')
+        assert cursor.fetchall() == [('bawler_trigger_bawler_installed', )]
+    finally:
+        cursor.execute('DROP TABLE bawler_installed')
+        cursor.execute(
+            'DROP FUNCTION IF EXISTS bawler_trigger_fn_bawler_installed(),'
+            ' bawler_trigger_fn_bawler_installed_flush()')
+        connection.close()
+
+
+def test_main_rejects_schema():
+    with pytest.raises(SystemExit):
+        pg_bawler.installer.main('--dsn', 'dbname=foo', '--schema', 'public')
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 import argparse
+import asyncio
+import io
+import json
 
 import psycopg2
 import pytest
@@ -36,11 +39,103 @@ def test_register_handlers():
     assert listener.registered_channels['channel'] == ['handler']
 
 
+@pytest.fixture
+def memory_listener():
+    return NotificationListener({}, driver='memory')
+
+
+@pytest.mark.asyncio
+async def test_handler_tasks_tracked(memory_listener):
+    release = asyncio.Event()
+
+    async def handler(notification, listener):
+        await release.wait()
+
+    memory_listener.register_handler('foo', handler)
+    memory_listener._dispatch(pg_bawler.core.Notification(1, 'foo', 'x'))
+    assert len(memory_listener.handler_tasks) == 1
+    release.set()
+    await asyncio.sleep(0.01)
+    assert not memory_listener.handler_tasks
+    assert memory_listener.handlers_completed == 1
+
+
+@pytest.mark.asyncio
+async def test_handler_timeout(memory_listener):
+    cancelled = []
+
+    async def handler(notification, listener):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(notification.payload)
+            raise
+
+    memory_listener.handler_timeout = 0.01
+    memory_listener.register_handler('foo', handler)
+    memory_listener._dispatch(pg_bawler.core.Notification(1, 'foo', 'x'))
+    await asyncio.sleep(0.05)
+    assert cancelled == ['x']
+    assert not memory_listener.handler_tasks
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_handlers(memory_listener):
+    finished = []
+
+    async def handler(notification, listener):
+        await asyncio.sleep(float(notification.payload))
+        finished.append(notification.payload)
+
+    async def stopping_handler(notification, listener):
+        await listener.stop(drain_timeout=0.05)
+
+    memory_listener.register_handler('foo', handler)
+    memory_listener.register_handler('stop', stopping_handler)
+    for payload in ('0', '0.01', '10'):
+        memory_listener._dispatch(
+            pg_bawler.core.Notification(1, 'foo', payload))
+    memory_listener._dispatch(pg_bawler.core.Notification(1, 'stop', ''))
+    await asyncio.sleep(0.1)
+    assert memory_listener.is_stopped
+    assert finished == ['0', '0.01']
+    assert not memory_listener.handler_tasks
+
+
 def test_default_cli_parser():
     parser = pg_bawler.listener.get_default_cli_args_parser()
     assert isinstance(parser, argparse.ArgumentParser)
 
 
+def test_cli_parser_multiple_channels():
+    parser = pg_bawler.listener.get_default_cli_args_parser()
+    args = parser.parse_args(['--dsn', '', '--format', 'jsonl', 'foo', 'bar'])
+    assert args.channels == ['foo', 'bar']
+    assert args.format == 'jsonl'
+    assert args.handler is None
+
+
+@pytest.mark.asyncio
+async def test_json_lines_handler():
+    stream = io.StringIO()
+    handler = pg_bawler.listener.JsonLinesHandler(
+        stream, buffer_lines=2, flush_interval=0.01)
+    notification = pg_bawler.core.Notification(1, 'foo', 'INSERT {"id": 1}')
+    await handler.handle_notification(notification, None)
+    assert stream.getvalue() == ''
+    await handler.handle_notification(notification, None)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    line = json.loads(lines[0])
+    assert line['channel'] == 'foo'
+    assert line['pid'] == 1
+    assert line['payload'] == 'INSERT {"id": 1}'
+    await handler.handle_notification(notification, None)
+    await asyncio.sleep(0.05)
+    assert len(stream.getvalue().splitlines()) == 3
+    assert handler.count == 3
+
+
 def test_resolve_handler():
     handler = pg_bawler.listener.resolve_handler(
         'pg_bawler.listener:default_handler')
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import struct
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.drivers
+import pg_bawler.events
+import pg_bawler.logical
+import pg_bawler.memory
+import pg_bawler.tracing
+from pg_bawler.listener import NotificationListener
+
+
+def cstring(value):
+    return value.encode('utf-8') + b'\0'
+
+
+def pgoutput_relation(relation_id, schema, table, columns):
+    message = b'R' + struct.pack('>I', relation_id)
+    message += cstring(schema) + cstring(table) + struct.pack('>b', ord('d'))
+    message += struct.pack('>h', len(columns))
+    for name, type_oid in columns:
+        message += struct.pack('>b', 0) + cstring(name)
+        message += struct.pack('>Ii', type_oid, -1)
+    return message
+
+
+def pgoutput_tuple(values):
+    data = struct.pack('>h', len(values))
+    for value in values:
+        if value is None:
+            data += b'n'
+        else:
+            value = value.encode('utf-8')
+            data += b't' + struct.pack('>i', len(value)) + value
+    return data
+
+
+def test_pgoutput_decoder():
+    decoder = pg_bawler.logical.PgOutputDecoder()
+    assert decoder(struct.pack('>cQqI', b'B', 1, 0, 777)) == []
+    assert decoder(pgoutput_relation(
+        16384, 'public', 'foo',
+        [('id', 23), ('name', 25), ('active', 16), ('extra', 3802)])) == []
+
+    insert = b'I' + struct.pack('>I', 16384) + b'N' + pgoutput_tuple(
+        ['1', 'bar', 't', '{"a": 1}'])
+    change, = decoder(insert)
+    assert change.schema == 'public'
+    assert change.table == 'foo'
+    assert change.op == 'INSERT'
+    assert change.row == {
+        'id': 1, 'name': 'bar', 'active': True, 'extra': {'a': 1}}
+    assert change.xid == 777
+    assert change.timestamp == 946684800.0
+
+    update = (
+        b'U' + struct.pack('>I', 16384) +
+        b'K' + pgoutput_tuple(['1', None, None, None]) +
+        b'N' + pgoutput_tuple(['2', 'baz', 'f', None]))
+    change, = decoder(update)
+    assert change.op == 'UPDATE'
+    assert change.row == {
+        'id': 2, 'name': 'baz', 'active': False, 'extra': None}
+
+    delete = b'D' + struct.pack('>I', 16384) + b'K' + pgoutput_tuple(['2'])
+    change, = decoder(delete)
+    assert change.op == 'DELETE'
+    assert change.row == {'id': 2}
+
+
+def test_wal2json_v1_decoder():
+    decoder = pg_bawler.logical.Wal2JsonDecoder()
+    changes = decoder(json.dumps({'xid': 5, 'change': [
+        {
+            'kind': 'insert', 'schema': 'public', 'table': 'foo',
+            'columnnames': ['id', 'name'], 'columnvalues': [1, 'bar'],
+        },
+        {
+            'kind': 'delete', 'schema': 'public', 'table': 'foo',
+            'oldkeys': {'keynames': ['id'], 'keyvalues': [1]},
+        },
+        {'kind': 'message', 'prefix': 'x', 'content': 'y'},
+    ]}))
+    assert [(change.op, change.row, change.xid) for change in changes] == [
+        ('INSERT', {'id': 1, 'name': 'bar'}, 5),
+        ('DELETE', {'id': 1}, 5),
+    ]
+
+
+def test_wal2json_v2_decoder():
+    decoder = pg_bawler.logical.Wal2JsonDecoder()
+    assert decoder(json.dumps({'action': 'B', 'xid': 9})) == []
+    change, = decoder(json.dumps({
+        'action': 'U', 'schema': 'public', 'table': 'foo',
+        'columns': [{'name': 'id', 'type': 'integer', 'value': 1}],
+        'identity': [{'name': 'id', 'type': 'integer', 'value': 1}],
+    }))
+    assert (change.op, change.row, change.xid) == ('UPDATE', {'id': 1}, 9)
+    assert decoder(json.dumps({'action': 'C'})) == []
+
+
+class FakeCursor:
+
+    def __init__(self):
+        self.feedback = []
+
+    def send_feedback(self, **kwargs):
+        self.feedback.append(kwargs)
+
+
+class FakeConnection:
+
+    closed = 0
+
+    def __init__(self):
+        self._cursor = FakeCursor()
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def stream(event_loop):
+    driver = pg_bawler.drivers.get_driver(
+        {'name': 'logical', 'plugin': 'wal2json', 'feedback_interval': 10})
+    stream = pg_bawler.logical.ReplicationStream(
+        driver, FakeConnection(), loop=event_loop)
+    stream.started = True
+    stream.channels.add('foo')
+    return stream
+
+
+def wal2json_insert(table, row_id):
+    return json.dumps({'action': 'I', 'schema': 'public', 'table': table,
+                       'columns': [{'name': 'id', 'value': row_id}]})
+
+
+@pytest.mark.asyncio
+async def test_replication_stream(stream):
+    stream._enqueue(100, wal2json_insert('ignored', 1))
+    assert stream.processed_lsn == 100
+    stream._enqueue(200, wal2json_insert('foo', 2))
+    stream._enqueue(300, wal2json_insert('foo', 3))
+    notification = await stream.get()
+    assert notification.channel == 'foo'
+    assert stream.processed_lsn == 100
+    stream.processed(notification)
+    assert stream.processed_lsn == 200
+
+    envelope, payload = pg_bawler.tracing.parse_envelope(notification.payload)
+    event = pg_bawler.events.ChangeEvent(
+        notification._replace(payload=payload), envelope)
+    assert event.op == 'INSERT'
+    assert event.row == {'id': 2}
+    assert (event.schema, event.table) == ('public', 'foo')
+
+    stream._send_feedback()
+    assert stream.cursor.feedback == [{'flush_lsn': 200, 'force': True}]
+    stream.close()
+
+
+@pytest.mark.asyncio
+async def test_replication_stream_confirms_in_order(stream):
+    stream._enqueue(200, wal2json_insert('foo', 2))
+    stream._enqueue(300, wal2json_insert('foo', 3))
+    first = await stream.get()
+    second = await stream.get()
+    stream.processed(second)
+    assert stream.processed_lsn == 0
+    stream._enqueue(400, wal2json_insert('ignored', 4))
+    assert stream.processed_lsn == 0
+    stream.processed(first)
+    assert stream.processed_lsn == 300
+    # changes of one message are processed together
+    stream._enqueue(500, json.dumps({'xid': 5, 'change': [
+        {
+            'kind': 'insert', 'schema': 'public', 'table': 'foo',
+            'columnnames': ['id'], 'columnvalues': [row_id],
+        } for row_id in (5, 6)]}))
+    stream.processed(await stream.get())
+    assert stream.processed_lsn == 300
+    stream.processed(await stream.get())
+    assert stream.processed_lsn == 500
+    stream.close()
+
+
+class ConfirmingMemoryDriver(pg_bawler.memory.MemoryDriver):
+
+    confirms_processed = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.processed_notifications = []
+
+    def processed(self, connection, notification):
+        self.processed_notifications.append(notification.payload)
+
+
+@pytest.mark.asyncio
+async def test_listener_reports_processed_after_handlers():
+    driver = ConfirmingMemoryDriver()
+    listener = NotificationListener(
+        {'server': pg_bawler.memory.MemoryServer()}, driver=driver)
+    await listener.pg_connection()
+    release = asyncio.Event()
+
+    async def handler(event, listener):
+        await release.wait()
+
+    listener.register_handler('foo', handler)
+    listener._dispatch(pg_bawler.core.Notification(1, 'foo', 'first'))
+    listener._dispatch(pg_bawler.core.Notification(1, 'bar', 'unhandled'))
+    assert driver.processed_notifications == ['unhandled']
+    await asyncio.sleep(0)
+    assert driver.processed_notifications == ['unhandled']
+    release.set()
+    await listener.drain()
+    assert driver.processed_notifications == ['unhandled', 'first']
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_replication_stream_error(stream):
+    stream._fail(stream.driver.connection_errors[0]('lost'))
+    with pytest.raises(stream.driver.connection_errors[0]):
+        await stream.get()
+
+
+def test_unsupported_plugin():
+    with pytest.raises(pg_bawler.drivers.PgBawlerDriverError):
+        pg_bawler.logical.LogicalDecodingDriver(plugin='test_decoding')
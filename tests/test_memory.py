@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.listener
+import pg_bawler.memory
+from pg_bawler.listener import NotificationListener
+from pg_bawler.sender import NotificationSender
+
+
+@pytest.fixture
+def server():
+    return pg_bawler.memory.MemoryServer(seed=1)
+
+
+@pytest.fixture
+def connection_params(server):
+    return {'server': server}
+
+
+@pytest.mark.asyncio
+async def test_simple_listen(connection_params):
+    async with NotificationListener(
+        connection_params, driver='memory'
+    ) as nl:
+        async with NotificationSender(
+            connection_params, driver='memory'
+        ) as ns:
+            await nl.register_channel(channel='pg_bawler_test')
+            await ns.send(channel='pg_bawler_test', payload='aaa')
+            await ns.send(channel='other', payload='bbb')
+            notification = await nl.get_notification()
+            assert notification.channel == 'pg_bawler_test'
+            assert notification.payload == 'aaa'
+            assert nl.driver.notifies(await nl.pg_connection()).empty()
+
+
+@pytest.mark.asyncio
+async def test_handlers(connection_params):
+    received = []
+
+    async def handler(notification, listener):
+        received.append(notification.payload)
+        if len(received) == 100:
+            await listener.stop()
+
+    nl = NotificationListener(connection_params, driver='memory')
+    nl.listen_timeout = 0.01
+    nl.register_handler('foo', handler)
+    await nl.register_channel('foo')
+    async with NotificationSender(connection_params, driver='memory') as ns:
+        for number in range(100):
+            await ns.send(channel='foo', payload=str(number))
+    await asyncio.wait_for(nl.listen(), 1)
+    assert received == [str(number) for number in range(100)]
+
+
+@pytest.mark.asyncio
+async def test_latency(connection_params, server):
+    server.latency = 0.01
+    async with NotificationListener(
+        connection_params, driver='memory'
+    ) as nl:
+        nl.listen_timeout = 0.005
+        await nl.register_channel('foo')
+        server.notify('foo', 'late')
+        assert await nl.get_notification() is None
+        nl.listen_timeout = 1
+        assert (await nl.get_notification()).payload == 'late'
+
+
+@pytest.mark.asyncio
+async def test_reconnect_after_drop(connection_params, server):
+    async with NotificationListener(
+        connection_params, driver='memory'
+    ) as nl:
+        nl.reconnect_interval = 0
+        await nl.register_channel('foo')
+        server.drop_connections()
+        await nl._listen()
+        server.notify('foo', 'after reconnect')
+        assert (await nl.get_notification()).payload == 'after reconnect'
+
+
+@pytest.mark.asyncio
+async def test_unable_to_reconnect(connection_params, server):
+    async with NotificationListener(
+        connection_params, driver='memory'
+    ) as nl:
+        nl.reconnect_interval = 0
+        nl.reconnect_attempts = 3
+        await nl.register_channel('foo')
+        server.stop()
+        with pytest.raises(
+            pg_bawler.listener.PgBawlerListenerConnectionError
+        ):
+            await nl._listen()
+
+
+@pytest.mark.asyncio
+async def test_injected_failures(connection_params, server):
+    server.failure_rate = 1
+    async with NotificationSender(connection_params, driver='memory') as ns:
+        with pytest.raises(pg_bawler.memory.PgBawlerMemoryConnectionError):
+            await ns.send(channel='foo', payload='lost')
+
+
+@pytest.mark.asyncio
+async def test_injected_timeouts(connection_params, server):
+    server.timeout_rate = 1
+    server.statement_timeout = 0
+    async with NotificationSender(connection_params, driver='memory') as ns:
+        with pytest.raises(pg_bawler.memory.PgBawlerMemoryTimeoutError):
+            await ns.send(channel='foo', payload='timeout')
+
+
+@pytest.mark.asyncio
+async def test_reconnect_after_health_check_timeout(
+    connection_params, server
+):
+    async with NotificationListener(
+        connection_params, driver='memory'
+    ) as nl:
+        nl.listen_timeout = 0.001
+        nl.reconnect_interval = 0.01
+        await nl.register_channel('foo')
+        server.timeout_rate = 1
+        server.statement_timeout = 0
+        asyncio.get_event_loop().call_later(
+            0.005, setattr, server, 'timeout_rate', 0)
+        await nl._listen()
+        server.notify('foo', 'after timeout')
+        nl.listen_timeout = 1
+        assert (await nl.get_notification()).payload == 'after timeout'
+
+
+@pytest.mark.asyncio
+async def test_unsupported_statement(connection_params):
+    async with NotificationSender(connection_params, driver='memory') as ns:
+        with pytest.raises(pg_bawler.memory.PgBawlerMemoryStatementError):
+            await ns.pg_execute('DELETE FROM foo')
+
+
+@pytest.mark.asyncio
+async def test_shared_server_by_name():
+    params = {'dbname': 'test_shared_server_by_name'}
+    async with NotificationListener(params, driver='memory') as nl:
+        assert (await nl.pg_pool()) is pg_bawler.memory.get_server(
+            'test_shared_server_by_name')
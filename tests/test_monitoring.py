@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.memory
+import pg_bawler.metrics
+from pg_bawler.listener import NotificationListener
+from pg_bawler.monitoring import NotificationQueueMonitor
+
+
+def test_counter_and_gauge():
+    registry = pg_bawler.metrics.MetricsRegistry()
+    registry.counter('sent').inc()
+    registry.counter('sent').inc(2)
+    registry.gauge('usage').set(0.5)
+    assert registry.snapshot() == {
+        'sent': {'type': 'counter', 'value': 3},
+        'usage': {'type': 'gauge', 'value': 0.5},
+    }
+
+
+@pytest.fixture
+def server():
+    return pg_bawler.memory.MemoryServer()
+
+
+@pytest.fixture
+def listener(server):
+    return NotificationListener({'server': server}, driver='memory')
+
+
+@pytest.mark.asyncio
+async def test_queue_usage_levels(server, listener):
+    registry = pg_bawler.metrics.MetricsRegistry()
+    monitor = NotificationQueueMonitor(
+        listener, warning_threshold=0.5, critical_threshold=0.8,
+        registry=registry)
+    alerts = []
+
+    async def alert(monitor, status):
+        alerts.append(status.level)
+
+    monitor.add_alert_callback(alert)
+    assert (await monitor.poll()).level == 'ok'
+    server.queue_usage = 0.6
+    assert (await monitor.poll()).level == 'warning'
+    server.queue_usage = 0.9
+    status = await monitor.poll()
+    assert status.level == 'critical'
+    assert status.usage == 0.9
+    await monitor.poll()
+    server.queue_usage = 0.1
+    await monitor.poll()
+    assert alerts == ['warning', 'critical', 'ok']
+    assert registry.snapshot()['pg_bawler.notification_queue_usage'][
+        'value'] == 0.1
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer(server, listener):
+    release = asyncio.Event()
+
+    async def handler(notification, listener):
+        await release.wait()
+
+    listener.register_handler('foo', handler)
+    monitor = NotificationQueueMonitor(
+        listener, registry=pg_bawler.metrics.MetricsRegistry())
+    await monitor.poll()
+    for _ in range(10):
+        listener._dispatch(pg_bawler.core.Notification(1, 'foo', 'x'))
+    await asyncio.sleep(0.01)
+    status = await monitor.poll()
+    assert status.slow_consumer
+    assert status.level == 'warning'
+    assert status.pending_handlers == 10
+    assert status.ingest_rate > 0
+    release.set()
+    await asyncio.sleep(0.01)
+    status = await monitor.poll()
+    assert not status.slow_consumer
+    assert status.pending_handlers == 0
+    assert status.completion_rate > 0
+
+
+@pytest.mark.asyncio
+async def test_monitor_runs_while_listening(server, listener):
+    monitor = NotificationQueueMonitor(
+        listener, interval=0.01, registry=pg_bawler.metrics.MetricsRegistry())
+    listener.queue_monitor = monitor
+    listener.listen_timeout = 0.01
+    listen_task = asyncio.ensure_future(listener.listen())
+    server.queue_usage = 0.9
+    await asyncio.sleep(0.05)
+    assert monitor.level == 'critical'
+    await listener.stop()
+    await listen_task
+
+
+@pytest.mark.asyncio
+async def test_poll_shares_connection_with_listener(server, listener):
+    server.latency = 0.001
+    monitor = NotificationQueueMonitor(
+        listener, registry=pg_bawler.metrics.MetricsRegistry())
+    status, _, health = await asyncio.gather(
+        monitor.poll(),
+        listener.register_channel('foo'),
+        listener.pg_fetchone('SELECT 1'))
+    assert status.usage == 0.0
+    assert health == (1, )
+    await listener.drop_connection()
+
+
+class OldServerDriver(pg_bawler.memory.MemoryDriver):
+
+    async def fetchone(self, connection, statement):
+        if 'pg_notification_queue_usage' in statement:
+            raise pg_bawler.memory.PgBawlerMemoryStatementError(
+                'function pg_notification_queue_usage() does not exist')
+        return await super().fetchone(connection, statement)
+
+
+@pytest.mark.asyncio
+async def test_server_without_queue_usage(server):
+    listener = NotificationListener(
+        {'server': server}, driver=OldServerDriver())
+    monitor = NotificationQueueMonitor(
+        listener, registry=pg_bawler.metrics.MetricsRegistry())
+    assert (await monitor.poll()).usage is None
+    assert (await monitor.poll()).level == 'ok'
+    await listener.drop_connection()
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.memory
+import pg_bawler.recording
+from pg_bawler.listener import NotificationListener
+
+
+@pytest.fixture
+def recording_path(tmpdir):
+    return str(tmpdir.join('stream.bawler'))
+
+
+@pytest.fixture
+def recording(recording_path):
+    with pg_bawler.recording.NotificationRecorder(recording_path) as recorder:
+        for number in range(10):
+            recorder.record(
+                pg_bawler.core.Notification(
+                    number, 'foo' if number % 2 else 'bar',
+                    'INSERT {{"id": {}, "name": "ž"}}'.format(number)),
+                timestamp=1000 + number * 0.001)
+        recorder.record(
+            pg_bawler.core.Notification(None, 'foo', ''), timestamp=1000.01)
+    return recording_path
+
+
+def test_record_and_read(recording):
+    records = list(pg_bawler.recording.NotificationReplayer(recording))
+    assert len(records) == 11
+    timestamp, notification = records[1]
+    assert timestamp == 1000.001
+    assert notification == (1, 'foo', 'INSERT {"id": 1, "name": "ž"}')
+    assert records[-1][1] == (None, 'foo', '')
+
+
+def test_append_and_truncated_record(recording):
+    with pg_bawler.recording.NotificationRecorder(recording) as recorder:
+        recorder.record(pg_bawler.core.Notification(1, 'foo', 'appended'))
+    with open(recording, 'ab') as recording_file:
+        recording_file.write(b'\xff\x00')
+    records = list(pg_bawler.recording.NotificationReplayer(recording))
+    assert records[-1][1].payload == 'appended'
+
+
+@pytest.mark.asyncio
+async def test_flush_after_interval_without_traffic(recording_path):
+    with pg_bawler.recording.NotificationRecorder(
+        recording_path, flush_interval=0.01
+    ) as recorder:
+        recorder.record(pg_bawler.core.Notification(1, 'foo', 'buffered'))
+        assert not list(pg_bawler.recording.NotificationReplayer(
+            recording_path))
+        await asyncio.sleep(0.02)
+        timestamp, notification = next(iter(
+            pg_bawler.recording.NotificationReplayer(recording_path)))
+        assert notification.payload == 'buffered'
+
+
+def test_not_a_recording(recording_path):
+    with open(recording_path, 'wb') as recording_file:
+        recording_file.write(b'something else entirely')
+    with pytest.raises(pg_bawler.recording.PgBawlerRecordingError):
+        list(pg_bawler.recording.NotificationReplayer(recording_path))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('speed', [None, 1, 100])
+async def test_replay(recording, speed):
+    received = []
+
+    async def handler(notification, listener):
+        received.append(notification.payload)
+
+    listener = NotificationListener(None, driver='memory')
+    listener.register_handler('foo', handler)
+    replayer = pg_bawler.recording.NotificationReplayer(recording)
+    assert await replayer.replay(listener, speed=speed) == 6
+    await asyncio.sleep(0)
+    assert len(received) == 6
+    assert received[0] == 'INSERT {"id": 1, "name": "ž"}'
+
+
+@pytest.mark.asyncio
+async def test_recorder_as_tap(recording_path):
+    server = pg_bawler.memory.MemoryServer()
+    recorder = pg_bawler.recording.NotificationRecorder(recording_path)
+    async with NotificationListener(
+        {'server': server}, driver='memory'
+    ) as listener:
+        listener.add_notification_tap(recorder)
+        await listener.register_channel('foo')
+        server.notify('foo', 'tapped', pid=7)
+        await listener._listen()
+        listener.remove_notification_tap(recorder)
+    recorder.close()
+    (_, notification), = pg_bawler.recording.NotificationReplayer(
+        recording_path)
+    assert notification == (7, 'foo', 'tapped')
@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.memory
+import pg_bawler.metrics
+from pg_bawler.listener import NotificationListener
+from pg_bawler.relay import pack_notification
+from pg_bawler.relay import PgBawlerRelayConnectionError
+from pg_bawler.relay import RelayListener
+from pg_bawler.relay import RelayServer
+from pg_bawler.relay import RelaySubscriber
+from pg_bawler.relay import unpack_notification
+
+
+@pytest.fixture
+def server():
+    return pg_bawler.memory.MemoryServer()
+
+
+@pytest.fixture
+def upstream(server):
+    listener = NotificationListener({'server': server}, driver='memory')
+    listener.listen_timeout = 0.1
+    return listener
+
+
+@pytest.fixture
+def registry():
+    return pg_bawler.metrics.MetricsRegistry()
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+def test_notification_frame_roundtrip():
+    notification = pg_bawler.core.Notification(42, 'kanál', 'pay\x00load')
+    frame = pack_notification(notification)
+    assert unpack_notification(frame[5:]) == notification
+
+
+@pytest.mark.asyncio
+async def test_relay_fans_out_subscribed_channels(
+    server, upstream, registry, tmp_path
+):
+    path = str(tmp_path / 'relay.sock')
+    upstream.relay = RelayServer(upstream, path, registry=registry)
+    upstream_task = asyncio.ensure_future(upstream.listen())
+    await settle()
+
+    received = {'foo': [], 'bar': []}
+    clients = []
+    for channel in ('foo', 'bar'):
+        client = RelayListener(path)
+        client.listen_timeout = 0.1
+
+        async def handler(notification, listener, channel=channel):
+            received[channel].append(notification.payload)
+
+        client.register_handler(channel, handler)
+        await client.register_channel(channel)
+        clients.append((client, asyncio.ensure_future(client.listen())))
+    assert len(server.listeners['foo']) == len(server.listeners['bar']) == 1
+
+    server.notify('foo', 'first')
+    server.notify('bar', 'second')
+    server.notify('baz', 'ignored')
+    await settle()
+    assert received == {'foo': ['first'], 'bar': ['second']}
+    assert registry.counter('pg_bawler.relay.sent').value == 2
+    assert registry.gauge('pg_bawler.relay.subscribers').value == 2
+
+    # the last subscriber of a channel leaving stops listening upstream
+    client, task = clients.pop()
+    await client.stop()
+    await task
+    await settle()
+    assert not server.listeners['bar']
+    assert 'bar' not in upstream.registered_channels
+    assert server.listeners['foo']
+
+    await upstream.stop()
+    await upstream_task
+    client, task = clients.pop()
+    await client.stop()
+    await task
+
+
+@pytest.mark.asyncio
+async def test_client_loses_relay(upstream, registry, tmp_path):
+    path = str(tmp_path / 'relay.sock')
+    relay = RelayServer(upstream, path, registry=registry)
+    await relay.start()
+    client = RelayListener(path)
+    await client.register_channel('foo')
+    connection = await client.pg_connection()
+    assert await client.pg_fetchone('SELECT 1') == (1, )
+    relay.close()
+    with pytest.raises(PgBawlerRelayConnectionError):
+        await asyncio.wait_for(
+            client.driver.notifies(connection).get(), 1)
+    await client.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_subscribers_and_upstream_reconnect(
+    server, upstream, registry, tmp_path
+):
+    server.latency = 0.001
+    upstream.reconnect_interval = 0
+    path = str(tmp_path / 'relay.sock')
+    upstream.relay = RelayServer(upstream, path, registry=registry)
+    upstream_task = asyncio.ensure_future(upstream.listen())
+    await settle()
+
+    clients = [RelayListener(path) for _ in range(5)]
+    reconnected = []
+    for client in clients:
+        client.listen_timeout = 0.1
+        client.add_reconnect_callback(reconnected.append)
+    # LISTEN statements of all subscribers share the upstream connection
+    await asyncio.gather(*(
+        client.register_channel('channel{}'.format(index))
+        for index, client in enumerate(clients)))
+    assert len(upstream.relay.subscribers) == 5
+    assert all(
+        server.listeners['channel{}'.format(index)]
+        for index in range(5))
+    tasks = [asyncio.ensure_future(client.listen()) for client in clients]
+
+    (await upstream.pg_connection()).break_connection()
+    await settle()
+    assert sorted(map(id, reconnected)) == sorted(map(id, clients))
+    assert server.listeners['channel0']
+
+    for client, task in zip(clients, tasks):
+        await client.stop()
+        await task
+    await upstream.stop()
+    await upstream_task
+
+
+class FakeTransport:
+
+    def __init__(self, buffered):
+        self.buffered = buffered
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+
+class FakeWriter:
+
+    def __init__(self, buffered):
+        self.transport = FakeTransport(buffered)
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+
+def test_slow_subscriber_drops(upstream, registry, tmp_path):
+    relay = RelayServer(
+        upstream, str(tmp_path / 'relay.sock'), max_buffer=100,
+        registry=registry)
+    fast = RelaySubscriber(FakeWriter(0))
+    slow = RelaySubscriber(FakeWriter(90))
+    relay._channel_subscribers['foo'].update((fast, slow))
+    relay.publish(pg_bawler.core.Notification(1, 'foo', 'x' * 20))
+    relay.publish(pg_bawler.core.Notification(1, 'bar', 'x' * 20))
+    assert len(fast.writer.frames) == 1
+    assert slow.writer.frames == []
+    assert slow.dropped == 1
+    assert registry.counter('pg_bawler.relay.dropped').value == 1
@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.events
+import pg_bawler.memory
+from pg_bawler.listener import NotificationListener
+from pg_bawler.replica import TableReplica
+
+COUNTRIES = [
+    {'code': 'SK', 'name': 'Slovakia', 'region': 'EU'},
+    {'code': 'CZ', 'name': 'Czechia', 'region': 'EU'},
+    {'code': 'US', 'name': 'United States', 'region': 'NA'},
+]
+
+
+def event(payload):
+    return pg_bawler.events.ChangeEvent(
+        pg_bawler.core.Notification(1, 'countries', payload))
+
+
+@pytest.fixture
+def server():
+    server = pg_bawler.memory.MemoryServer()
+    server.tables['countries'] = list(COUNTRIES)
+    return server
+
+
+@pytest.fixture
+def listener(server):
+    listener = NotificationListener({'server': server}, driver='memory')
+    listener.reconnect_interval = 0
+    return listener
+
+
+@pytest.fixture
+def replica():
+    return TableReplica(
+        'countries', key_columns=('code', ), indexes=('region', ))
+
+
+@pytest.mark.asyncio
+async def test_snapshot_and_lookups(listener, replica):
+    await replica.attach(listener)
+    assert len(replica) == 3
+    assert replica.get('SK').name == 'Slovakia'
+    assert replica.get('XX') is None
+    assert sorted(row.code for row in replica.lookup('region', 'EU')) == [
+        'CZ', 'SK']
+    assert replica.lookup('region', 'AF') == []
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_apply_changes(replica):
+    replica.load_rows(COUNTRIES)
+    replica.apply(event(
+        'UPDATE {"code": "US", "name": "USA", "region": "EU"}'))
+    replica.apply(event('DELETE {"code": "SK", "name": "", "region": "EU"}'))
+    replica.apply(event(
+        'INSERT {"code": "AT", "name": "Austria", "region": "EU"}'))
+    assert replica.get('US').name == 'USA'
+    assert replica.get('SK') is None
+    assert sorted(row.code for row in replica.lookup('region', 'EU')) == [
+        'AT', 'CZ', 'US']
+    assert replica.lookup('region', 'NA') == []
+    replica.apply(event('TRUNCATE {}'))
+    assert not len(replica)
+    assert not replica.indexes[('region', )]
+
+
+@pytest.mark.asyncio
+async def test_transaction_notifications(server, listener, replica):
+    await replica.attach(listener)
+    server.tables['countries'] = [
+        {'code': 'SK', 'name': 'Slovensko', 'region': 'EU'},
+        {'code': 'CZ', 'name': 'Czechia', 'region': 'EU'},
+        {'code': 'AT', 'name': 'Austria', 'region': 'EU'},
+    ]
+    await replica.handle_notification(event(
+        'TRANSACTION [["UPDATE", {"code": "SK"}], ["DELETE", {"code": "US"}],'
+        ' ["INSERT", {"code": "AT"}], ["UPDATE", {"code": "XX"}]]'),
+        listener)
+    assert replica.get('SK').name == 'Slovensko'
+    assert replica.get('AT').name == 'Austria'
+    assert replica.get('US') is None
+    assert replica.get('XX') is None
+    assert replica.lookup('region', 'NA') == []
+    assert not replica.is_loading
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_notifications_during_refresh_applied_after(
+    server, listener, replica, monkeypatch
+):
+    await replica.attach(listener)
+    fetch_rows = replica._fetch_rows
+
+    async def slow_fetch_rows(listener, keys):
+        rows = await fetch_rows(listener, keys)
+        replica.apply(event(
+            'UPDATE {"code": "SK", "name": "Slovakia", "region": "EU"}'))
+        await asyncio.sleep(0)
+        return rows
+
+    monkeypatch.setattr(replica, '_fetch_rows', slow_fetch_rows)
+    server.tables['countries'] = [
+        {'code': 'SK', 'name': 'Slovensko', 'region': 'EU'}]
+    await replica.handle_notification(
+        event('TRANSACTION [["UPDATE", {"code": "SK"}]]'), listener)
+    assert replica.get('SK').name == 'Slovakia'
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_compound_index(replica):
+    replica = TableReplica(
+        'countries', key_columns=('code', ), indexes=[('region', 'name')],
+        columns=('code', 'name', 'region'))
+    replica.load_rows(COUNTRIES)
+    assert replica.lookup(('region', 'name'), 'EU', 'Czechia')[0].code == 'CZ'
+
+
+def test_columns_not_valid_identifiers():
+    replica = TableReplica('routes', indexes=('from', ('class', '_ver')))
+    replica.load_rows([
+        {'id': 1, 'from': 'BA', 'class': 'first', '_ver': 2},
+        {'id': 2, 'from': 'KE', 'class': 'first', '_ver': 2},
+    ])
+    assert tuple(replica.get(1)) == (1, 'BA', 'first', 2)
+    assert replica.get(1)._fields == ('id', '_1', '_2', '_3')
+    assert [row[0] for row in replica.lookup('from', 'KE')] == [2]
+    assert sorted(
+        row.id for row in replica.lookup(('class', '_ver'), 'first', 2)
+    ) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_notifications_during_snapshot_applied_after(
+    listener, replica, monkeypatch
+):
+    fetch_snapshot = replica._fetch_snapshot
+
+    async def slow_fetch_snapshot(listener):
+        rows = await fetch_snapshot(listener)
+        replica.apply(event(
+            'DELETE {"code": "SK", "name": "", "region": "EU"}'))
+        await asyncio.sleep(0)
+        return rows
+
+    monkeypatch.setattr(replica, '_fetch_snapshot', slow_fetch_snapshot)
+    await replica.snapshot(listener)
+    assert replica.get('SK') is None
+    assert len(replica) == 2
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_resnapshot_on_reconnect(server, listener, replica):
+    await replica.attach(listener)
+    server.tables['countries'] = COUNTRIES[:1]
+    (await listener.pg_connection()).break_connection()
+    await listener._listen()
+    assert len(replica) == 1
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_resnapshot_retried(monkeypatch, server, listener, replica):
+    await replica.attach(listener)
+    fetch_snapshot = replica._fetch_snapshot
+    failures = [RuntimeError('boom'), RuntimeError('boom again')]
+
+    async def flaky_fetch_snapshot(listener):
+        if failures:
+            raise failures.pop(0)
+        return await fetch_snapshot(listener)
+
+    monkeypatch.setattr(replica, '_fetch_snapshot', flaky_fetch_snapshot)
+    server.tables['countries'] = COUNTRIES[:1]
+    (await listener.pg_connection()).break_connection()
+    await listener._listen()
+    assert len(replica) == 3
+    await replica._retry_task
+    assert not failures
+    assert len(replica) == 1
+    await listener.drop_connection()
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.metrics
+from pg_bawler.listener import NotificationListener
+from pg_bawler.recording import NotificationReplayer
+from pg_bawler.retry import RetryPolicy
+from pg_bawler.retry import RetryScheduler
+
+
+def test_policy_delays():
+    policy = RetryPolicy(base_delay=1, multiplier=2, max_delay=5, jitter=0.5)
+    assert policy.get_delay(1, 0) == 1
+    assert policy.get_delay(2, 0) == 2
+    assert policy.get_delay(3, 1) == 2
+    assert policy.get_delay(10, 0) == 5
+
+
+@pytest.fixture
+def listener():
+    return NotificationListener({}, driver='memory')
+
+
+def make_scheduler(listener, **kwargs):
+    listener.retry = RetryScheduler(
+        listener, registry=pg_bawler.metrics.MetricsRegistry(), **kwargs)
+    return listener.retry
+
+
+@pytest.mark.asyncio
+async def test_retry_until_success(listener):
+    attempts = []
+
+    async def handler(notification, listener):
+        attempts.append(notification.payload)
+        if len(attempts) < 3:
+            raise ValueError('not yet')
+
+    listener.register_handler('foo', handler)
+    make_scheduler(
+        listener, default_policy=RetryPolicy(base_delay=0.05, jitter=0))
+    listener._dispatch(pg_bawler.core.Notification(1, 'foo', 'x'))
+    await asyncio.sleep(0.01)
+    assert len(listener.retry) == 1
+    await asyncio.sleep(0.3)
+    assert attempts == ['x', 'x', 'x']
+    assert len(listener.retry) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_timer_in_due_order(listener):
+    order = []
+
+    async def handler(notification, listener):
+        order.append(notification.payload)
+
+    scheduler = make_scheduler(listener)
+    now = listener.loop.time()
+    for payload, delay in (('c', 0.03), ('a', 0.01), ('b', 0.02)):
+        scheduler.schedule(
+            now + delay, handler,
+            pg_bawler.core.Notification(1, 'foo', payload), 2)
+    assert scheduler._timer_due == now + 0.01
+    await asyncio.sleep(0.06)
+    assert order == ['a', 'b', 'c']
+    assert scheduler._timer is None
+
+
+@pytest.mark.asyncio
+async def test_dead_letter(listener, tmpdir):
+    dead_letter = str(tmpdir.join('dead.bawler'))
+
+    async def handler(notification, listener):
+        raise ValueError(notification.payload)
+
+    async def other(notification, listener):
+        raise ValueError(notification.payload)
+
+    listener.register_handler('foo', handler)
+    listener.register_handler('bar', other)
+    make_scheduler(
+        listener,
+        default_policy=None,
+        policies={other: RetryPolicy(max_attempts=2, base_delay=10)},
+        dead_letter=dead_letter)
+    listener._dispatch(pg_bawler.core.Notification(1, 'foo', 'lost'))
+    listener._dispatch(pg_bawler.core.Notification(1, 'bar', 'pending'))
+    await asyncio.sleep(0.01)
+    assert len(listener.retry) == 1
+    await listener.stop(drain_timeout=0)
+    assert [
+        (notification.channel, notification.payload)
+        for _, notification in NotificationReplayer(dead_letter)
+    ] == [('foo', 'lost'), ('bar', 'pending')]
@@ -0,0 +1,60 @@
+import io
+
+import pytest
+
+import pg_bawler.memory
+import pg_bawler.sender
+from pg_bawler.listener import NotificationListener
+
+
+def test_synthetic_payloads():
+    payloads = pg_bawler.sender.synthetic_payloads(8)
+    assert next(payloads) == '0 xxxxxx'
+    assert next(payloads) == '1 xxxxxx'
+
+
+def test_read_payloads(tmpdir, monkeypatch):
+    payload_file = tmpdir.join('payloads.txt')
+    payload_file.write('a\n\nb\n')
+    monkeypatch.setattr('sys.stdin', io.StringIO('c\n'))
+    assert pg_bawler.sender.read_payloads([str(payload_file), '-']) == [
+        'a', 'b', 'c']
+
+
+@pytest.mark.asyncio
+async def test_generate_load():
+    server = pg_bawler.memory.MemoryServer()
+    connection_params = {'server': server}
+    async with NotificationListener(
+        connection_params, driver='memory'
+    ) as listener:
+        await listener.register_channel('foo')
+        await listener.register_channel('bar')
+        report = await pg_bawler.sender.generate_load(
+            connection_params,
+            driver='memory',
+            channels=['foo', 'bar'],
+            payloads=['it\'s'] * 20,
+            count=20,
+            rate=400,
+            connections=2)
+        notifications = [
+            await listener.get_notification() for _ in range(20)]
+    assert report['sent'] == 20
+    assert report['errors'] == 0
+    assert report['elapsed'] >= 19 / 400
+    assert report['latency_p50'] <= report['latency_max']
+    assert {n.channel for n in notifications} == {'foo', 'bar'}
+    assert {n.payload for n in notifications} == {'it\'s'}
+
+
+def test_main(capsys):
+    pg_bawler.sender.main(
+        '--dsn', 'dbname=test',
+        '--driver', 'memory',
+        '--count', '10',
+        '--connections', '2',
+        'foo')
+    output = capsys.readouterr().out
+    assert 'sent: 10 errors: 0' in output
+    assert 'latency p99: ' in output
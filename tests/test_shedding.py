@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.metrics
+from pg_bawler.listener import NotificationListener
+from pg_bawler.shedding import AdmissionController
+from pg_bawler.shedding import ChannelPolicy
+from pg_bawler.shedding import PgBawlerSheddingError
+from pg_bawler.tracing import wrap_envelope
+
+
+def notification(channel, payload='x'):
+    return pg_bawler.core.Notification(1, channel, payload)
+
+
+@pytest.fixture
+def listener():
+    listener = NotificationListener({}, driver='memory')
+    listener.handled = []
+    listener.release = asyncio.Event()
+
+    async def handler(notification, listener):
+        await listener.release.wait()
+        listener.handled.append((notification.channel, notification.payload))
+
+    for channel in ('critical', 'bulk', 'audit'):
+        listener.register_handler(channel, handler)
+    return listener
+
+
+async def finish(listener):
+    listener.admission.max_inflight = float('inf')
+    listener.admission.pump()
+    listener.release.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def make_controller(listener, **kwargs):
+    listener.admission = AdmissionController(
+        listener, registry=pg_bawler.metrics.MetricsRegistry(), seed=0,
+        **kwargs)
+    return listener.admission
+
+
+def test_unknown_policy():
+    with pytest.raises(PgBawlerSheddingError):
+        ChannelPolicy(policy='drop-everything')
+
+
+@pytest.mark.asyncio
+async def test_priority(listener):
+    admission = make_controller(
+        listener, max_inflight=1,
+        policies={'critical': ChannelPolicy(priority=10)})
+    admission.submit(notification('bulk', 'first'))
+    for number in range(3):
+        admission.submit(notification('bulk', str(number)))
+    admission.submit(notification('critical', 'important'))
+    assert admission.queue_depth == 4
+    listener.release.set()
+    for _ in range(20):
+        await asyncio.sleep(0)
+    assert listener.handled == [
+        ('bulk', 'first'),
+        ('critical', 'important'),
+        ('bulk', '0'),
+        ('bulk', '1'),
+        ('bulk', '2'),
+    ]
+    assert admission.queue_depth == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy, queued', [
+    ('none', ['0', '1', '2', '3', '3']),
+    ('drop-newest', ['0', '1']),
+    ('drop-oldest', ['3', '3']),
+    ('coalesce', ['0', '1', '2', '3']),
+])
+async def test_policies(listener, policy, queued):
+    admission = make_controller(
+        listener, max_inflight=1, queue_threshold=2,
+        policies={'bulk': ChannelPolicy(policy=policy)})
+    admission.submit(notification('bulk', 'running'))
+    for payload in ('0', '1', '2', '3', '3'):
+        admission.submit(notification('bulk', payload))
+    assert [
+        entry[1].payload for entry in admission._queues['bulk']] == queued
+    assert admission.shed_counts['bulk'] == 5 - len(queued)
+    if policy != 'none':
+        assert admission.registry.snapshot()['pg_bawler.shed.bulk'][
+            'value'] == 5 - len(queued)
+    await finish(listener)
+
+
+@pytest.mark.asyncio
+async def test_coalesce_keeps_latest_row(listener):
+    admission = make_controller(
+        listener, max_inflight=1, queue_threshold=0,
+        policies={'bulk': ChannelPolicy(policy='coalesce')})
+    admission.submit(notification('bulk', 'running'))
+    for txid, (row_id, name) in enumerate(
+        [(1, 'a'), (2, 'b'), (1, 'c'), (1, 'd')]
+    ):
+        admission.submit(notification('bulk', wrap_envelope(
+            'UPDATE {{"id": {}, "name": "{}"}}'.format(row_id, name),
+            timestamp=1.5, txid=txid, origin='public.bulk')))
+    assert [
+        entry[1].payload.rsplit('\n', 1)[1]
+        for entry in admission._queues['bulk']
+    ] == ['UPDATE {"id": 1, "name": "d"}', 'UPDATE {"id": 2, "name": "b"}']
+    assert admission.shed_counts['bulk'] == 2
+    await finish(listener)
+    assert [
+        payload.endswith('"d"}') for _, payload in listener.handled[1:]
+    ] == [True, False]
+
+
+@pytest.mark.asyncio
+async def test_sample(listener):
+    admission = make_controller(
+        listener, max_inflight=1, queue_threshold=0,
+        policies={'audit': ChannelPolicy(policy='sample', percent=10)})
+    admission.submit(notification('audit'))
+    for _ in range(1000):
+        admission.submit(notification('audit'))
+    assert 50 < admission.queue_depth < 150
+    assert admission.shed_counts['audit'] == 1000 - admission.queue_depth
+    await finish(listener)
+
+
+@pytest.mark.asyncio
+async def test_latency_threshold(listener):
+    admission = make_controller(
+        listener, max_inflight=1, latency_threshold=0.5,
+        policies={'bulk': ChannelPolicy(policy='drop-newest')})
+    admission.submit(notification('bulk'))
+    admission.submit(notification('bulk'))
+    assert not admission.shed_counts
+    admission.handler_latency = 1
+    admission.submit(notification('bulk'))
+    assert admission.shed_counts['bulk'] == 1
+    await finish(listener)
+
+
+@pytest.mark.asyncio
+async def test_listener_uses_admission(listener):
+    listener.release.set()
+    admission = make_controller(listener, max_inflight=1)
+    await listener.register_channel('critical')
+    for payload in ('a', 'b', 'c'):
+        listener.driver.notifies(await listener.pg_connection()).put_nowait(
+            notification('critical', payload))
+    for _ in range(3):
+        await listener._listen()
+    for _ in range(20):
+        await asyncio.sleep(0)
+    assert listener.handled == [
+        ('critical', 'a'), ('critical', 'b'), ('critical', 'c')]
+    assert admission.handler_latency > 0
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_pumped_handlers(listener):
+    listener.release.set()
+    admission = make_controller(listener, max_inflight=1)
+    for payload in ('a', 'b', 'c'):
+        admission.submit(notification('bulk', payload))
+    assert await listener.drain(1) == 0
+    assert listener.handled == [('bulk', 'a'), ('bulk', 'b'), ('bulk', 'c')]
+    assert not listener.handler_tasks
+
+
+@pytest.mark.asyncio
+async def test_stop_abandons_queued(listener):
+    listener.release.set()
+    admission = make_controller(listener, max_inflight=1)
+    for payload in ('a', 'b', 'c'):
+        admission.submit(notification('bulk', payload))
+    await listener.stop(drain_timeout=1)
+    assert listener.handled == [('bulk', 'a')]
+    assert admission.queue_depth == 2
+    assert not listener.handler_tasks
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.metrics
+from pg_bawler.listener import NotificationListener
+from pg_bawler.spool import NotificationSpool
+
+
+def notification(payload):
+    return pg_bawler.core.Notification(1, 'foo', payload)
+
+
+@pytest.fixture
+def listener():
+    listener = NotificationListener({}, driver='memory')
+    listener.handled = []
+    listener.release = asyncio.Event()
+
+    async def handler(notification, listener):
+        await listener.release.wait()
+        listener.handled.append(notification.payload)
+
+    listener.register_handler('foo', handler)
+    return listener
+
+
+def make_spool(listener, directory, **kwargs):
+    kwargs.setdefault('registry', pg_bawler.metrics.MetricsRegistry())
+    listener.spool = NotificationSpool(listener, str(directory), **kwargs)
+    return listener.spool
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_spill_to_disk_and_replay_in_order(listener, tmpdir):
+    spool = make_spool(
+        listener, tmpdir, memory_limit=3, max_inflight=1, segment_size=128)
+    payloads = [str(number) * 10 for number in range(20)]
+    for payload in payloads:
+        spool.submit(notification(payload))
+    assert len(spool.memory) == 3
+    assert spool.disk_count == 16
+    assert len(spool.segments) > 1
+    listener.release.set()
+    await settle()
+    assert listener.handled == payloads
+    assert len(spool) == 0
+    assert not [
+        name for name in os.listdir(str(tmpdir)) if name.endswith('.spool')]
+
+
+@pytest.mark.asyncio
+async def test_disk_cap(listener, tmpdir):
+    registry = pg_bawler.metrics.MetricsRegistry()
+    spool = make_spool(
+        listener, tmpdir, memory_limit=1, max_inflight=1, segment_size=64,
+        max_segments=2, registry=registry)
+    for number in range(20):
+        spool.submit(notification('x' * 20))
+    assert len(spool.segments) == 2
+    assert registry.snapshot()['pg_bawler.spool.dropped']['value'] == (
+        20 - 1 - len(spool))
+    listener.release.set()
+    await settle()
+
+
+@pytest.mark.asyncio
+async def test_resume_after_restart(listener, tmpdir):
+    spool = make_spool(
+        listener, tmpdir, memory_limit=2, max_inflight=1, segment_size=64)
+    payloads = [str(number) for number in range(10)]
+    for payload in payloads:
+        spool.submit(notification(payload))
+    # first notification is being handled, the rest is spooled
+    assert len(spool) == 9
+    await listener.stop(drain_timeout=0)
+    assert spool.closed
+    assert not spool.memory
+
+    restarted = NotificationListener({}, driver='memory')
+    restarted.handled = []
+    restarted.release = listener.release
+    restarted.register_handler('foo', listener.registered_channels['foo'][0])
+    spool = make_spool(
+        restarted, tmpdir, memory_limit=2, max_inflight=1, segment_size=64)
+    assert len(spool) == 9
+    restarted.release.set()
+    spool.pump()
+    await settle()
+    assert restarted.handled == payloads[1:]
+
+
+@pytest.mark.asyncio
+async def test_resume_partially_read_segment(listener, tmpdir):
+    spool = make_spool(
+        listener, tmpdir, memory_limit=1, max_inflight=1, segment_size=4096)
+    for payload in 'abcdef':
+        spool.submit(notification(payload))
+    listener.release.set()
+    # let two handlers finish, so part of segment is loaded into memory
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    spool.max_inflight = 0
+    await settle()
+    handled = list(listener.handled)
+    assert 0 < len(handled) < 6
+    spool.close()
+    spool = NotificationSpool(
+        listener, str(tmpdir), memory_limit=1, max_inflight=10,
+        registry=pg_bawler.metrics.MetricsRegistry())
+    listener.spool = spool
+    spool.pump()
+    await settle()
+    assert listener.handled == list('abcdef')
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.memory
+from pg_bawler.listener import NotificationListener
+from pg_bawler.subscription import PgBawlerSubscriptionError
+from pg_bawler.subscription import PgBawlerSubscriptionOverflow
+
+
+@pytest.fixture
+def server():
+    return pg_bawler.memory.MemoryServer()
+
+
+@pytest.fixture
+def listener(server):
+    listener = NotificationListener({'server': server}, driver='memory')
+    listener.listen_timeout = 0.1
+    return listener
+
+
+def notify(listener, payload, channel='foo'):
+    listener._dispatch(pg_bawler.core.Notification(1, channel, payload))
+
+
+@pytest.mark.asyncio
+async def test_subscribers_share_listen(server, listener):
+    listen_task = asyncio.ensure_future(listener.listen())
+    received = []
+
+    async def consume(count):
+        async for event in listener.subscribe('foo'):
+            received.append(event.payload)
+            if len(received) == count:
+                break
+
+    consumer = asyncio.ensure_future(consume(2))
+    async with listener.subscribe('foo') as subscription:
+        await asyncio.sleep(0.01)
+        assert len(server.listeners['foo']) == 1
+        server.notify('foo', 'first')
+        server.notify('foo', 'second')
+        await asyncio.wait_for(consumer, 1)
+        assert received == ['first', 'second']
+        assert [
+            (await subscription.get()).payload for _ in range(2)
+        ] == ['first', 'second']
+        # leaving ``async for`` closed the first subscription
+        await asyncio.sleep(0.01)
+        assert listener.subscriptions['foo'] == [subscription]
+    assert 'foo' not in listener.subscriptions
+    assert not server.listeners['foo']
+    assert 'foo' not in listener.registered_channels
+
+    await listener.stop()
+    await listen_task
+
+
+@pytest.mark.asyncio
+async def test_channel_with_handlers_stays_listened(server, listener):
+
+    async def handler(notification, listener):
+        pass
+
+    listener.register_handler('foo', handler)
+    await listener.register_channel('foo')
+    async with listener.subscribe('foo'):
+        pass
+    assert server.listeners['foo']
+    await listener.drop_connection()
+
+
+@pytest.mark.asyncio
+async def test_overflow_policies(listener):
+    newest = listener.subscribe('foo', maxsize=2, overflow='drop-newest')
+    oldest = listener.subscribe('foo', maxsize=2, overflow='drop-oldest')
+    error = listener.subscribe('foo', maxsize=2)
+    for payload in '123':
+        notify(listener, payload)
+    assert [event.payload for event in newest.buffer] == ['1', '2']
+    assert [event.payload for event in oldest.buffer] == ['2', '3']
+    assert newest.dropped == oldest.dropped == error.dropped == 1
+    assert error.closed
+    assert listener.subscriptions['foo'] == [newest, oldest]
+
+    received = []
+    with pytest.raises(PgBawlerSubscriptionOverflow):
+        async for event in error:
+            received.append(event.payload)
+    assert received == ['1', '2']
+
+    with pytest.raises(PgBawlerSubscriptionError):
+        listener.subscribe('foo', overflow='block')
+    await newest.aclose()
+    await oldest.aclose()
+    await listener.drop_connection()
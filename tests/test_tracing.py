@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import pg_bawler.core
+import pg_bawler.metrics
+import pg_bawler.tracing
+from pg_bawler.listener import NotificationListener
+from pg_bawler.sender import NotificationSender
+
+
+def test_parse_envelope():
+    payload = pg_bawler.tracing.wrap_envelope(
+        'INSERT {"id": 1}',
+        timestamp=1478123562.25, txid=1234, origin='public.foo bar')
+    envelope, body = pg_bawler.tracing.parse_envelope(payload)
+    assert envelope == (1478123562.25, 1234, 'public.foo bar')
+    assert body == 'INSERT {"id": 1}'
+
+
+@pytest.mark.parametrize('payload', [
+    'INSERT {"id": 1}',
+    '@bawler no newline',
+    '@bawler not-a-number 1 origin\nINSERT {}',
+])
+def test_parse_not_enveloped(payload):
+    assert pg_bawler.tracing.parse_envelope(payload) == (None, payload)
+
+
+def test_histogram():
+    histogram = pg_bawler.metrics.Histogram('test', buckets=(1, 2, 3))
+    assert histogram.percentile(50) is None
+    for value in (0.5, 1.5, 1.7, 2.5, 10):
+        histogram.observe(value)
+    assert histogram.count == 5
+    assert histogram.percentile(50) == 2
+    assert histogram.percentile(99) == float('inf')
+    assert histogram.snapshot()['buckets'][-1] == ['+Inf', 1]
+
+
+def test_registry_type_conflict():
+    registry = pg_bawler.metrics.MetricsRegistry()
+    assert registry.histogram('a') is registry.histogram('a')
+    registry.metrics['b'] = object()
+    with pytest.raises(TypeError):
+        registry.histogram('b')
+
+
+def test_sender_envelope_statement():
+    sender = NotificationSender(None)
+    sender.envelope = True
+    sender.origin = 'tests'
+    statement = sender.get_notify_statement(channel='foo', payload='bar')
+    assert pg_bawler.tracing.ENVELOPE_PREFIX in statement
+    assert 'txid_current()' in statement
+    assert '\' tests\'' in statement
+
+
+@pytest.mark.asyncio
+async def test_dispatch_strips_envelope_and_traces():
+    registry = pg_bawler.metrics.MetricsRegistry()
+    received = []
+
+    async def handler(notification, listener):
+        received.append(notification)
+
+    listener = NotificationListener(None)
+    listener.latency_tracer = pg_bawler.tracing.LatencyTracer(
+        sample_rate=1, registry=registry)
+    listener.register_handler('foo', handler)
+    listener._dispatch(pg_bawler.core.Notification(
+        1, 'foo',
+        pg_bawler.tracing.wrap_envelope(
+            'INSERT {}', timestamp=0, txid=1, origin='public.foo')))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert [event.payload for event in received] == ['INSERT {}']
+    assert received[0].schema == 'public'
+    assert listener.latency_tracer.db_to_listener.count == 1
+    assert listener.latency_tracer.listener_to_handler.count == 1
+
+
+def test_percentile():
+    assert pg_bawler.metrics.percentile([], 50) is None
+    values = list(range(100, 0, -1))
+    assert pg_bawler.metrics.percentile(values, 50) == 50
+    assert pg_bawler.metrics.percentile(values, 99) == 99
+    assert pg_bawler.metrics.percentile(values, 100) == 100